@@ -0,0 +1,189 @@
+import time
+import math
+import config
+
+try:
+    from time import ticks_ms, ticks_us, ticks_diff
+except ImportError:
+    # CPython
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_us():
+        return int(time.monotonic() * 1000000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+TABLE_SIZE = 64
+
+def _ease_table():
+    """Smoothstep ease-in-out, 0..256 over TABLE_SIZE steps"""
+    table = []
+    for i in range(TABLE_SIZE):
+        x = i / (TABLE_SIZE - 1)
+        table.append(int(round(x * x * (3 - 2 * x) * 256)))
+    return table
+
+def _wave_table(floor):
+    """One period of a raised cosine between floor and 256"""
+    table = []
+    for i in range(TABLE_SIZE):
+        x = (1 - math.cos(2 * math.pi * i / TABLE_SIZE)) / 2
+        table.append(int(round(floor + (256 - floor) * x)))
+    return table
+
+# Integer lookup tables built once at import; frames never touch floats
+EASE_IN_OUT = _ease_table()
+PULSE = _wave_table(64)      # Meeting-soon warning: 25%..100%
+BREATHE = _wave_table(16)    # Error state: ~6%..100%
+
+class Effect:
+    """A periodic brightness modulation over every column but one"""
+    def __init__(self, table, period_ms, except_col=None):
+        self.table = table
+        self.period_ms = period_ms
+        self.except_col = except_col
+
+def pulse(except_col):
+    """Pulsing warning for a meeting that starts soon"""
+    return Effect(PULSE, config.PULSE_PERIOD_MS, except_col)
+
+def breathe():
+    """Slow breathing for the error state"""
+    return Effect(BREATHE, config.BREATHE_PERIOD_MS)
+
+class Animator:
+    """Frame-timed fades and effects on top of a NeoPixel framebuffer
+
+    Callers draw a frame into the NeoPixel as usual inside begin()/commit().
+    commit() snapshots it as the new target; each tick() then renders one
+    frame of the cross-fade from the previous output, plus any active effect,
+    and shows it. Ticks come from a machine.Timer or an asyncio task at a
+    fixed frame rate. Ticks that could not run on time (e.g. while a TLS
+    handshake holds the CPU) are counted in dropped_frames.
+    """
+    def __init__(self, led_matrix, logger, fps=None):
+        self.leds = led_matrix
+        self.logger = logger
+        self.frame_ms = 1000 // (fps or config.ANIMATION_FPS)
+        size = len(led_matrix.buf)
+        self.from_frame = bytearray(size)
+        self.to_frame = bytearray(size)
+        self.output = bytearray(size)  # Last frame handed to the LEDs
+        self.effect = None
+        self.fade_start = None
+        self.effect_start = 0
+        self.paused = False
+        self.timer = None
+        self.last_tick = None
+        self.frames = 0
+        self.dropped_frames = 0
+        self.render_us = 0
+
+    def begin(self):
+        """Stop ticking while the caller draws the next target frame"""
+        self.paused = True
+
+    def commit(self, effect=None):
+        """Fade from the current output to the frame just drawn"""
+        self.from_frame[:] = self.output
+        self.to_frame[:] = self.leds.buf
+        if self.to_frame != self.from_frame:
+            self.fade_start = ticks_ms()
+        if effect is None or self.effect is None or effect.table is not self.effect.table:
+            self.effect_start = ticks_ms()
+        self.effect = effect
+        self.paused = False
+
+    def active(self):
+        """True while a fade or effect needs frames"""
+        return self.fade_start is not None or self.effect is not None
+
+    def _blend(self, weight):
+        """output = from + (to - from) * weight / 256"""
+        a = self.from_frame
+        b = self.to_frame
+        out = self.output
+        for i in range(len(out)):
+            x = a[i]
+            out[i] = x + (((b[i] - x) * weight) >> 8)
+
+    def _apply_effect(self, now):
+        """Scale output by the effect's table, leaving one column untouched"""
+        effect = self.effect
+        phase = ticks_diff(now, self.effect_start) % effect.period_ms
+        scale = effect.table[phase * TABLE_SIZE // effect.period_ms]
+        buf = self.leds.buf
+        out = self.output
+        skip = None if effect.except_col is None else self.leds.column_mask(effect.except_col)
+        i = 0
+        for p in range(len(out) // 3):
+            if skip is not None and skip[p]:
+                buf[i] = out[i]
+                buf[i + 1] = out[i + 1]
+                buf[i + 2] = out[i + 2]
+            else:
+                buf[i] = (out[i] * scale) >> 8
+                buf[i + 1] = (out[i + 1] * scale) >> 8
+                buf[i + 2] = (out[i + 2] * scale) >> 8
+            i += 3
+
+    def tick(self):
+        """Render and show one animation frame"""
+        if self.paused:
+            return
+        now = ticks_ms()
+        if self.last_tick is not None:
+            late = ticks_diff(now, self.last_tick) - self.frame_ms
+            if late >= self.frame_ms:
+                self.dropped_frames += late // self.frame_ms
+        self.last_tick = now
+        if not self.active():
+            return
+
+        started = ticks_us()
+        if self.fade_start is not None:
+            elapsed = ticks_diff(now, self.fade_start)
+            if elapsed >= config.FADE_DURATION_MS:
+                self.output[:] = self.to_frame
+                self.fade_start = None
+            else:
+                self._blend(EASE_IN_OUT[elapsed * TABLE_SIZE // config.FADE_DURATION_MS])
+
+        if self.effect is not None:
+            self._apply_effect(now)
+        else:
+            self.leds.buf[:] = self.output
+        self.leds.dirty = True
+        self.leds.show()
+        self.frames += 1
+        self.render_us = ticks_diff(ticks_us(), started)
+
+    def _on_timer(self, timer):
+        self.tick()
+
+    def start(self):
+        """Drive tick() from a periodic hardware timer"""
+        from machine import Timer
+        self.output[:] = self.leds.buf
+        self.timer = Timer(period=self.frame_ms, mode=Timer.PERIODIC, callback=self._on_timer)
+        self.logger.info("Animation running at %s fps", 1000 // self.frame_ms)
+
+    async def run(self):
+        """Drive tick() from an asyncio task instead of a timer"""
+        import asyncio
+        sleep_ms = getattr(asyncio, "sleep_ms", None)
+        self.output[:] = self.leds.buf
+        while True:
+            self.tick()
+            if sleep_ms:
+                await sleep_ms(self.frame_ms)
+            else:
+                await asyncio.sleep(self.frame_ms / 1000)
+
+    def stop(self):
+        """Stop the hardware timer"""
+        if self.timer:
+            self.timer.deinit()
+            self.timer = None
@@ -1,29 +1,105 @@
-import urequests as requests
+import asyncio
 import json
 import time
 import jwt
 import config
-from time_manager import TimeManager
-from log_config import sanitize_calendar_id, sanitize_error
+from http_client import HTTPClient
+from timeline import Timeline
+from event_stream import EventStreamParser, EVENT_FIELDS
+from ics import ICSFeed
+from request_policy import RequestPolicy
+from log_config import sanitize_calendar_id
+from metrics import metrics
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # CPython
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+        
+    def ticks_diff(a, b):
+        return a - b
+
+def _quote(value):
+    """Percent-encode a query parameter value"""
+    safe = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.~"
+    out = []
+    for ch in str(value):
+        if ch in safe:
+            out.append(ch)
+        else:
+            for b in ch.encode("utf-8"):
+                out.append("%%%02X" % b)
+    return "".join(out)
+
+class CalendarStore:
+    """Local copy of one calendar's upcoming events, kept current with sync tokens"""
+    def __init__(self):
+        self.sync_token = None
+        self.etag = None
+        self.events = {}  # event id -> (start timestamp, end timestamp)
+        self.until = 0  # Events starting from here on were not kept
+        
+    def reset(self):
+        """Drop all local state so the next sync is a full one"""
+        self.sync_token = None
+        self.etag = None
+        self.events = {}
+        self.until = 0
+        
+    def prune(self, before):
+        """Forget events that ended before the given timestamp"""
+        for event_id in [k for k, v in self.events.items() if v[1] < before]:
+            del self.events[event_id]
+            
+    def window(self, start, end):
+        """Return (start, end) pairs overlapping [start, end]"""
+        return [v for v in self.events.values() if v[0] < end and v[1] > start]
 
 class CalendarAPI:
-    def __init__(self, time_manager, logger):
+    """Google calendars, plus any other calendar sources, merged into one busy timeline
+
+    A source is any object with an async fetch(start, end) method returning
+    busy (start, end) pairs in that window, or None when it could not be
+    read. By default there is one ICSFeed per entry in ICS_FEEDS.
+    """
+    def __init__(self, time_manager, logger, sources=None, sync_mode=None):
         self.time_manager = time_manager
         self.token = None
         self.token_expires = 0
-        self.base_url = "https://www.googleapis.com/calendar/v3"
+        self.base_url = config.CALENDAR_API_BASE_URL
+        self.token_url = config.OAUTH_TOKEN_URL
         self.logger = logger
+        self.sync_mode = sync_mode or config.CALENDAR_SYNC_MODE  # See CALENDAR_SYNC_MODE
+        self.stores = {}  # calendar id -> CalendarStore
+        self.timeline = Timeline()  # Merged busy blocks from the last successful refresh
+        self.changed = False
+        self.last_refresh = 0
+        self.http = HTTPClient(logger)  # Shared keep-alive pool for token and event requests
+        self.http.on_date = time_manager.observe_date  # Bootstraps the clock if NTP is slow
+        self.policy = RequestPolicy(logger, time_manager.get_utc_timestamp)  # Retries, breakers and quota for Google requests
+        if sources is None:
+            sources = [ICSFeed(feed, self.http, logger) for feed in config.ICS_FEEDS]
+        self.sources = sources
+        self.source_events = [[] for _ in sources]  # Intervals from each source at the last refresh
+        self.token_stats = {"sign_ms": 0, "exchange_ms": 0, "refreshes": 0, "cache_hits": 0, "flash_hits": 0}
+        self._token_loaded = False
+        
+        # Decode the service account key once instead of on every token refresh
+        key_data = json.loads(config.SERVICE_ACCOUNT_KEY)
+        self.client_email = key_data["client_email"]
+        self.private_key = key_data["private_key"]
         
     def _get_jwt_token(self):
         """Create a JWT token for service account authentication"""
         try:
             self.logger.debug("Generating new JWT token")
             current_time = self.time_manager.get_utc_timestamp()
-            key_data = json.loads(config.SERVICE_ACCOUNT_KEY)
             
             # Create JWT claims
             claims = {
-                "iss": key_data["client_email"],
+                "iss": self.client_email,
                 "scope": "https://www.googleapis.com/auth/calendar.readonly",
                 "aud": "https://oauth2.googleapis.com/token",
                 "exp": current_time + 3600,
@@ -31,153 +107,467 @@ class CalendarAPI:
             }
             
             # Create and sign JWT using the micropython-jwt package
-            token = jwt.encode(claims, key_data["private_key"], algorithm="RS256")
-            self.logger.debug("JWT token generated successfully")
+            started = ticks_ms()
+            token = jwt.encode(claims, self.private_key, algorithm="RS256")
+            self.token_stats["sign_ms"] = ticks_diff(ticks_ms(), started)
+            metrics.add("token_sign", self.token_stats["sign_ms"] * 1000)
+            self.logger.debug("JWT token generated in %s ms", self.token_stats['sign_ms'])
             return token
             
         except Exception as e:
-            self.logger.error(f"Error creating JWT token: {sanitize_error(e)}")
+            self.logger.error("Error creating JWT token: %s", e)
             return None
             
-    def _get_access_token(self):
+    async def _get_access_token(self):
         """Get access token using service account JWT"""
+        response = None
         try:
             self.logger.debug("Getting new access token")
             jwt_token = self._get_jwt_token()
             if not jwt_token:
                 return False
                 
-            url = "https://oauth2.googleapis.com/token"
+            url = self.token_url
             data = {
                 "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
                 "assertion": jwt_token
             }
             
-            response = requests.post(url, json=data)
+            started = ticks_ms()
+            response = await self.policy.call("token", lambda: self.http.post(url, json=data))
+            self.token_stats["exchange_ms"] = ticks_diff(ticks_ms(), started)
+            metrics.add("token_exchange", self.token_stats["exchange_ms"] * 1000)
             if response.status_code == 200:
                 result = response.json()
                 self.token = result["access_token"]
                 self.token_expires = self.time_manager.get_utc_timestamp() + result["expires_in"]
-                self.logger.info("Successfully obtained new access token")
+                self.token_stats["refreshes"] += 1
+                self.logger.info("Successfully obtained new access token (sign %s ms, exchange %s ms)",
+                                 self.token_stats['sign_ms'], self.token_stats['exchange_ms'])
+                self._save_token()
                 return True
-            self.logger.error(f"Failed to get access token. Status code: {response.status_code}")
+            self.logger.error("Failed to get access token. Status code: %s", response.status_code)
+            metrics.incr("api_errors")
             return False
         except Exception as e:
-            self.logger.error(f"Error getting access token: {sanitize_error(e)}")
+            self.logger.error("Error getting access token: %s", e)
+            metrics.incr("api_errors")
             return False
         finally:
-            response.close()
+            if response:
+                response.close()
             
-    def _ensure_token(self):
-        """Ensure we have a valid access token"""
-        if not self.token or self.time_manager.get_utc_timestamp() >= self.token_expires:
-            self.logger.debug("Token expired or missing, refreshing...")
-            return self._get_access_token()
-        return True
-        
-    def get_calendar_status(self):
-        """Get current and upcoming events from all calendars"""
-        if not self._ensure_token():
-            self.logger.error("Failed to ensure valid token")
-            return None, 0, None
+    def _load_token(self):
+        """Restore an access token persisted before the last reboot"""
+        try:
+            with open(config.TOKEN_CACHE_FILE) as f:
+                cached = json.load(f)
+            if cached["expires"] - config.TOKEN_REFRESH_MARGIN > self.time_manager.get_utc_timestamp():
+                self.token = cached["access_token"]
+                self.token_expires = cached["expires"]
+                self.token_stats["flash_hits"] += 1
+                self.logger.info("Using access token cached on flash")
+        except OSError:
+            pass
+        except Exception as e:
+            self.logger.warning("Ignoring unreadable token cache: %s", e)
             
+    def _save_token(self):
+        """Persist the current access token so a reboot within the hour skips signing"""
         try:
-            # Ensure time is synced
-            if not self.time_manager.ensure_time_synced():
-                self.logger.warning("Time sync failed")
-                
-            # Calculate time range
-            now = self.time_manager.get_utc_timestamp()
-            timeMin = self.time_manager.format_utc_datetime(now)
-            timeMax = self.time_manager.format_utc_datetime(now + 10800)  # 3 hours ahead
+            with open(config.TOKEN_CACHE_FILE, "w") as f:
+                json.dump({"access_token": self.token, "expires": self.token_expires}, f)
+        except Exception as e:
+            self.logger.warning("Could not persist access token: %s", e)
             
-            all_events = []
+    async def probe_time(self):
+        """Make a cheap request to the token host so its Date header can set the clock
+        
+        The connection stays pooled for the token exchange that follows.
+        """
+        try:
+            await self.http.request("HEAD", self.token_url)
+            return True
+        except Exception as e:
+            self.logger.warning("Could not reach %s for the time: %s", self.token_url, e)
+            return False
             
-            # Fetch events from all calendars
-            for calendar_id in config.CALENDAR_IDS:
-                try:
-                    safe_id = sanitize_calendar_id(calendar_id)
-                    self.logger.debug(f"Fetching events for calendar: {safe_id}")
-                    
-                    url = f"{self.base_url}/calendars/{calendar_id}/events"
-                    params = {
-                        "timeMin": timeMin,
-                        "timeMax": timeMax,
-                        "singleEvents": "true",
-                        "orderBy": "startTime"
-                    }
-                    
-                    param_str = "&".join([f"{k}={v}" for k, v in params.items()])
-                    url = f"{url}?{param_str}"
-                    
-                    headers = {"Authorization": f"Bearer {self.token}"}
-                    response = requests.get(url, headers=headers)
-                    
-                    if response.status_code == 200:
-                        calendar_events = response.json().get("items", [])
-                        self.logger.debug(f"Found {len(calendar_events)} events in calendar {safe_id}")
-                        all_events.extend(calendar_events)
-                    else:
-                        self.logger.error(f"Error fetching calendar {safe_id}: {response.status_code}")
-                        
-                except Exception as e:
-                    self.logger.error(f"Error processing calendar {safe_id}: {sanitize_error(e)}")
-                finally:
-                    response.close()
-                    
-            # Sort all events by start time
-            all_events.sort(key=lambda x: x["start"]["dateTime"])
-            self.logger.info(f"Processing {len(all_events)} total events")
+    def token_refresh_due(self, now):
+        """True when the token is within TOKEN_REFRESH_MARGIN of expiring"""
+        return not self.token or now >= self.token_expires - config.TOKEN_REFRESH_MARGIN
+        
+    async def _ensure_token(self):
+        """Ensure we have a valid access token, refreshing it ahead of expiry"""
+        if not self._token_loaded:
+            self._token_loaded = True
+            self._load_token()
             
-            current_time = self.time_manager.get_utc_timestamp()
-            total_remaining = 0
-            is_busy = False
-            next_meeting_in = None
-            
-            # Process all events
-            for event in all_events:
-                start_time = self.time_manager.parse_datetime(event["start"]["dateTime"])
-                end_time = self.time_manager.parse_datetime(event["end"]["dateTime"])
+        now = self.time_manager.get_utc_timestamp()
+        if not self.token_refresh_due(now):
+            self.token_stats["cache_hits"] += 1
+            return True
+            
+        if self.token and now < self.token_expires:
+            # Still valid: refresh early, but keep using the old token if that fails
+            self.logger.debug("Token close to expiry, refreshing early")
+            if not await self._get_access_token():
+                self.logger.warning("Early token refresh failed, using current token")
+            return True
+            
+        self.logger.debug("Token expired or missing, refreshing...")
+        return await self._get_access_token()
+        
+    def retry_at(self, now):
+        """Earliest time a refresh can reach Google again after breakers opened or the quota ran out"""
+        endpoints = ["freebusy" if self.sync_mode == "freebusy" else "events"]
+        if self.token_refresh_due(now):
+            endpoints.append("token")
+        return self.policy.blocked_until(now, endpoints)
+        
+    async def prefetch_token(self):
+        """Refresh the access token now if it is due, so a fetch never has to wait for signing"""
+        if config.CALENDAR_IDS and self.token_refresh_due(self.time_manager.get_utc_timestamp()):
+            return await self._ensure_token()
+        return True
+        
+    def _parse_times(self, start, end):
+        """Parse raw start/end strings (dateTime, or date for all-day events) into timestamps"""
+        return (self.time_manager.parse_datetime(start), self.time_manager.parse_datetime(end))
+        
+    def _sink(self, parser):
+        """Body sink for a streamed response, timing the JSON parsing when metrics are on"""
+        if not metrics.enabled:
+            return parser.feed
+            
+        def feed(chunk):
+            started = metrics.start()
+            parser.feed(chunk)
+            metrics.record("json_parse", started)
+        return feed
+        
+    def _events_url(self, calendar_id, params):
+        params["fields"] = EVENT_FIELDS
+        param_str = "&".join([f"{k}={_quote(v)}" for k, v in params.items()])
+        return f"{self.base_url}/calendars/{_quote(calendar_id)}/events?{param_str}"
+        
+    async def _fetch_window(self, calendar_id, timeMin, timeMax):
+        """Fetch every event in [timeMin, timeMax] for one calendar, following pagination
+        
+        Returns None if the calendar could not be read.
+        """
+        safe_id = sanitize_calendar_id(calendar_id)
+        events = []
+        
+        def on_item(event_id, start, end, status, transparency):
+            if status == "cancelled" or transparency == "transparent":
+                return
+            try:
+                events.append(self._parse_times(start, end))
+            except (TypeError, ValueError):
+                self.logger.debug("Skipping malformed event in calendar %s", safe_id)
                 
-                # If event is happening now
-                if start_time <= current_time <= end_time:
-                    is_busy = True
-                    remaining = (end_time - current_time) / 60  # Convert to minutes
-                    total_remaining = remaining
+        page_token = None
+        try:
+            self.logger.debug("Fetching events for calendar: %s", safe_id)
+            while True:
+                params = {
+                    "timeMin": timeMin,
+                    "timeMax": timeMax,
+                    "singleEvents": "true",
+                    "orderBy": "startTime",
+                    "maxResults": config.CALENDAR_PAGE_SIZE
+                }
+                if page_token:
+                    params["pageToken"] = page_token
                     
-                    # Check for back-to-back meetings
-                    next_event_idx = all_events.index(event) + 1
-                    while next_event_idx < len(all_events):
-                        next_event = all_events[next_event_idx]
-                        next_start = self.time_manager.parse_datetime(next_event["start"]["dateTime"])
-                        next_end = self.time_manager.parse_datetime(next_event["end"]["dateTime"])
-                        
-                        # If less than 5 minutes between meetings
-                        if (next_start - end_time) <= 300:
-                            additional_time = (next_end - next_start) / 60
-                            total_remaining += additional_time
-                            end_time = next_end
-                            self.logger.debug("Found back-to-back meeting")
-                        else:
-                            break
-                        next_event_idx += 1
+                headers = {"Authorization": f"Bearer {self.token}"}
+                parser = EventStreamParser(on_item)
+                url = self._events_url(calendar_id, params)
+                started = metrics.start()
+                response = await self.policy.call("events", lambda: self.http.get(url, headers=headers, sink=self._sink(parser)))
+                metrics.record("events_list", started)
+                
+                if response.status_code != 200:
+                    self.logger.error("Error fetching calendar %s: %s", safe_id, response.status_code)
+                    metrics.incr("api_errors")
+                    return None
+                page_token = parser.fields.get("nextPageToken")
+                if not page_token:
+                    break
                     
-                    self.logger.info(f"Currently busy with {int(total_remaining)} minutes remaining")
-                    return is_busy, int(total_remaining), None
+            self.logger.debug("Found %s events in calendar %s", len(events), safe_id)
+            return events
+        except Exception as e:
+            self.logger.error("Error processing calendar %s: %s", safe_id, e)
+            metrics.incr("api_errors")
+        return None
+        
+    async def _sync_calendar(self, calendar_id, store, now):
+        """Bring a calendar's local store up to date, fetching only changes when possible
+        
+        Returns True when the store is current, False if the sync failed and the
+        store still holds the last known state. Pages are parsed as they stream
+        in and applied one event at a time.
+        
+        A full sync cannot be bounded by timeMax, so recurring series are listed
+        for as far ahead as Google expands them. Only events starting within
+        CALENDAR_SYNC_HORIZON are kept; once the lookahead window reaches past
+        that, the next sync is a full one again.
+        """
+        safe_id = sanitize_calendar_id(calendar_id)
+        full_sync = store.sync_token is None or now + config.CALENDAR_LOOKAHEAD > store.until
+        events = {} if full_sync else store.events
+        horizon = int(now) + max(config.CALENDAR_SYNC_HORIZON, config.CALENDAR_LOOKAHEAD) if full_sync else store.until
+        page_token = None
+        
+        def on_item(event_id, start, end, status, transparency):
+            # Cancelled and "show as available" events don't make us busy
+            if status == "cancelled" or transparency == "transparent":
+                events.pop(event_id, None)
+                return
+            try:
+                times = self._parse_times(start, end)
+            except (TypeError, ValueError):
+                # Malformed event without a usable start/end
+                events.pop(event_id, None)
+                return
+            if times[0] >= horizon:
+                events.pop(event_id, None)
+            else:
+                events[event_id] = times
                 
-                # If this is a future event
-                elif start_time > current_time:
-                    minutes_until = (start_time - current_time) / 60
-                    if next_meeting_in is None or minutes_until < next_meeting_in:
-                        next_meeting_in = int(minutes_until)
-            
-            if next_meeting_in is not None:
-                self.logger.info(f"Next meeting in {next_meeting_in} minutes")
+        while True:
+            params = {
+                "singleEvents": "true",
+                "maxResults": config.CALENDAR_PAGE_SIZE
+            }
+            if full_sync:
+                params["timeMin"] = self.time_manager.format_utc_datetime(now)
             else:
-                self.logger.info("No upcoming meetings")
+                params["syncToken"] = store.sync_token
+            if page_token:
+                params["pageToken"] = page_token
+                
+            headers = {"Authorization": f"Bearer {self.token}"}
+            if store.etag and not full_sync and not page_token:
+                headers["If-None-Match"] = store.etag
+                
+            parser = EventStreamParser(on_item)
+            url = self._events_url(calendar_id, params)
+            started = metrics.start()
+            try:
+                response = await self.policy.call("events", lambda: self.http.get(url, headers=headers, sink=self._sink(parser)))
+                status = response.status_code
+            except Exception as e:
+                self.logger.error("Error syncing calendar %s: %s", safe_id, e)
+                metrics.incr("api_errors")
+                return False
+            metrics.record("events_list", started)
+                
+            if status == 304:
+                self.logger.debug("Calendar %s unchanged", safe_id)
+                return True
+                
+            if status == 410:
+                # Sync token invalidated by the server, start over
+                self.logger.warning("Sync token expired for calendar %s, doing full resync", safe_id)
+                store.reset()
+                if full_sync:
+                    return False
+                return await self._sync_calendar(calendar_id, store, now)
                 
-            return is_busy, 0, next_meeting_in
+            if status != 200:
+                self.logger.error("Error syncing calendar %s: %s", safe_id, status)
+                metrics.incr("api_errors")
+                return False
+                
+            self.logger.debug("Applied %s changes to calendar %s", parser.count, safe_id)
+            page_token = parser.fields.get("nextPageToken")
+            if not page_token:
+                break
+                
+        store.events = events
+        store.until = horizon
+        store.sync_token = parser.fields.get("nextSyncToken")
+        store.etag = response.header("ETag") or parser.fields.get("etag")
+        return True
+        
+    async def _fetch_freebusy(self, timeMin, timeMax, calendar_ids):
+        """Fetch merged busy intervals for all calendars with one freeBusy.query, or None on failure"""
+        response = None
+        try:
+            self.logger.debug("Querying free/busy for %s calendars", len(calendar_ids))
+            url = f"{self.base_url}/freeBusy"
+            data = {
+                "timeMin": timeMin,
+                "timeMax": timeMax,
+                "timeZone": "UTC",
+                "items": [{"id": calendar_id} for calendar_id in calendar_ids]
+            }
+            headers = {"Authorization": f"Bearer {self.token}"}
+            started = metrics.start()
+            response = await self.policy.call("freebusy", lambda: self.http.post(url, json=data, headers=headers))
+            metrics.record("freebusy", started)
             
+            if response.status_code != 200:
+                self.logger.error("Error querying free/busy: %s", response.status_code)
+                metrics.incr("api_errors")
+                return None
+                
+            busy = []
+            for calendar_id, calendar in response.json().get("calendars", {}).items():
+                if calendar.get("errors"):
+                    reason = calendar["errors"][0].get("reason")
+                    self.logger.error("Free/busy error for calendar %s: %s", sanitize_calendar_id(calendar_id), reason)
+                    continue
+                for interval in calendar.get("busy", []):
+                    busy.append((self.time_manager.parse_datetime(interval["start"]),
+                                 self.time_manager.parse_datetime(interval["end"])))
+            self.logger.debug("Found %s busy intervals", len(busy))
+            return busy
         except Exception as e:
-            self.logger.error(f"Error checking calendars: {sanitize_error(e)}")
-            return None, 0, None 
\ No newline at end of file
+            self.logger.error("Error querying free/busy: %s", e)
+            metrics.incr("api_errors")
+            return None
+        finally:
+            if response:
+                response.close()
+                
+    async def _get_events(self, now, calendar_ids, dirty=None):
+        """Collect (start, end) pairs from the Google calendars and the other sources
+        
+        Everything is fetched concurrently. Returns None when any of them could
+        not be read, so an outage never looks like an empty calendar.
+        """
+        end = now + config.CALENDAR_LOOKAHEAD
+        results = await asyncio.gather(self._get_google_events(now, calendar_ids, dirty),
+                                       *[source.fetch(now, end) for source in self.sources])
+        if None in results:
+            return None
+        self.source_events = results[1:]
+        all_events = []
+        for events in results:
+            all_events.extend(events)
+        return all_events
+        
+    async def _get_google_events(self, now, calendar_ids, dirty=None):
+        """Collect (start, end) pairs for the given calendars within the lookahead window
+        
+        In incremental mode, dirty limits the network sync to those calendars;
+        the rest are read from their local stores. Returns None when a calendar
+        could not be read and there is no earlier copy of it to fall back on.
+        """
+        if not calendar_ids:
+            return []
+        timeMin = self.time_manager.format_utc_datetime(now)
+        timeMax = self.time_manager.format_utc_datetime(now + config.CALENDAR_LOOKAHEAD)
+        
+        if self.sync_mode == "freebusy":
+            return await self._fetch_freebusy(timeMin, timeMax, calendar_ids)
+            
+        if self.sync_mode != "incremental":
+            results = await asyncio.gather(*[self._fetch_window(calendar_id, timeMin, timeMax)
+                                             for calendar_id in calendar_ids])
+            if None in results:
+                return None
+        else:
+            for calendar_id in calendar_ids:
+                if calendar_id not in self.stores:
+                    self.stores[calendar_id] = CalendarStore()
+            # Download all calendars concurrently, each on its own pooled connection
+            synced = calendar_ids
+            if dirty is not None:
+                # Stores whose kept horizon the window has reached need their full sync too
+                synced = list(dirty) + [c for c in calendar_ids if c not in dirty
+                                        and self.stores[c].until < now + config.CALENDAR_LOOKAHEAD]
+            ok = await asyncio.gather(*[self._sync_calendar(calendar_id, self.stores[calendar_id], now)
+                                        for calendar_id in synced])
+            for calendar_id, current in zip(synced, ok):
+                if not current and self.stores[calendar_id].sync_token is None:
+                    # Never synced, so the store is empty rather than stale
+                    return None
+            results = []
+            for calendar_id in calendar_ids:
+                store = self.stores[calendar_id]
+                store.prune(now)
+                results.append(store.window(now, now + config.CALENDAR_LOOKAHEAD))
+                
+        all_events = []
+        for events in results:
+            all_events.extend(events)
+        return all_events
+        
+    async def refresh(self, calendar_ids=None, dirty=None):
+        """Fetch events from all calendars into the local schedule
+        
+        Returns True on success. self.changed tells whether the schedule differs
+        from the previous refresh. calendar_ids defaults to config.CALENDAR_IDS;
+        pass dirty to sync only the calendars known to have changed.
+        """
+        calendar_ids = calendar_ids or config.CALENDAR_IDS
+        if calendar_ids and not await self._ensure_token():
+            self.logger.error("Failed to ensure valid token")
+            return False
+            
+        try:
+            # Fetch events from all calendars (time sync runs as its own task)
+            now = self.time_manager.get_utc_timestamp()
+            all_events = await self._get_events(now, calendar_ids, dirty)
+            if all_events is None:
+                self.logger.error("Calendars could not be read, keeping the last known schedule")
+                return False
+                    
+            stats = self.http.stats
+            self.logger.debug("HTTP: %s requests, %s handshakes, %s reused", stats['requests'], stats['handshakes'], stats['reused'])
+            
+            # Build the merged busy timeline once per fetch
+            started = metrics.start()
+            timeline = Timeline(all_events)
+            metrics.record("timeline_build", started)
+            self.logger.info("Processing %s total events into %s busy blocks", len(all_events), len(timeline))
+            
+            self.changed = timeline != self.timeline
+            self.timeline = timeline
+            self.last_refresh = now
+            return True
+            
+        except Exception as e:
+            self.logger.error("Error checking calendars: %s", e)
+            return False
+            
+    def evaluate(self, current_time, timeline=None):
+        """Compute status from the local schedule (or another timeline) at the given time
+        
+        Returns (is_busy, remaining_minutes, next_meeting_in, target) where target
+        is the timestamp the progress column counts down to (end of the current
+        busy block, or start of the next meeting), or None.
+        """
+        if timeline is None:
+            timeline = self.timeline
+        return timeline.status(current_time)
+        
+    def next_boundary(self, current_time):
+        """Return the earliest busy block start or end after current_time, or None"""
+        return self.timeline.next_boundary(current_time)
+        
+    def status_at(self, current_time):
+        """Get (is_busy, remaining_minutes, next_meeting_in) from the local schedule"""
+        is_busy, total_remaining, next_meeting_in, _ = self.evaluate(current_time)
+        if is_busy:
+            self.logger.info("Currently busy with %s minutes remaining", total_remaining)
+        elif next_meeting_in is not None:
+            self.logger.info("Next meeting in %s minutes", next_meeting_in)
+        else:
+            self.logger.info("No upcoming meetings")
+        return is_busy, total_remaining, next_meeting_in
+        
+    def get_calendar_status(self):
+        """Blocking fetch-and-evaluate for callers outside the event loop"""
+        try:
+            ok = asyncio.run(self.refresh())
+        finally:
+            # Pooled streams belong to the loop that just finished
+            self.http.close()
+        if not ok:
+            return None, 0, None
+        return self.status_at(self.time_manager.get_utc_timestamp())
\ No newline at end of file
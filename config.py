@@ -7,16 +7,63 @@ except ImportError:
 
 # Hardware Configuration
 LED_PIN = 16  # GPIO pin connected to WS2812B data line
-LED_COUNT = 64  # 8x8 matrix = 64 LEDs
 LED_BRIGHTNESS = 0.3  # Brightness level (0.0 to 1.0)
-MATRIX_WIDTH = 8
-MATRIX_HEIGHT = 8
+LED_GAMMA = 1.0  # Gamma correction applied through the brightness lookup table (1.0 = linear)
+PANEL_WIDTH = 8  # LEDs across one panel as mounted
+PANEL_HEIGHT = 8  # LEDs down one panel as mounted
+PANELS_X = 1  # Panels chained left to right...
+PANELS_Y = 1  # ...then top to bottom
+PANEL_SERPENTINE = False  # Every other row of a panel's wiring runs backwards
+PANEL_ROTATION = 0  # Clockwise rotation of each panel's wiring as mounted (0, 90, 180 or 270)
+MATRIX_WIDTH = PANEL_WIDTH * PANELS_X
+MATRIX_HEIGHT = PANEL_HEIGHT * PANELS_Y
+LED_COUNT = MATRIX_WIDTH * MATRIX_HEIGHT  # One 8x8 panel = 64 LEDs
+
+# Display Configuration
+SCROLL_TEXT = False  # Scroll "Free for 25m" style text beside the progress column (needs 7+ rows)
+TEXT_SCROLL_SPEED = 12  # Columns per second
+TEXT_FPS = 20  # Frame rate while text is scrolling
+FRAME_BUDGET_MS = 40  # Time one scrolling frame may take to draw and write out
+
+# Power Configuration
+POWER_BUDGET_MA = 400  # LED current limit, brightness is scaled down to fit (0 = no limit); USB 2.0 gives 500 mA
+LED_CHANNEL_MA = 20  # Current of one WS2812B colour channel at full output (in mA)
+LED_IDLE_MA = 1  # Current of one WS2812B when dark (in mA)
+BOARD_ACTIVE_MA = 80  # MCU and WiFi current while awake, for the power estimate (in mA)
+BOARD_SLEEP_MA = 25  # MCU and WiFi current in lightsleep, for the power estimate (in mA)
+SUPPLY_VOLTS = 5.0  # Supply voltage, for the power estimate
+UTC_OFFSET = 0  # Local time minus UTC, for working hours and all-day or floating event times (in minutes)
+WORK_HOURS = (0, 24)  # Local hours at full brightness, e.g. (8, 18)
+WORK_DAYS = (0, 1, 2, 3, 4, 5, 6)  # Days with working hours, Monday = 0
+OFF_HOURS_BRIGHTNESS = 0.05  # Brightness outside working hours (0 = LEDs off)
+LIGHT_SLEEP = False  # lightsleep the MCU while nothing is due; the WiFi chip's interrupt still wakes it
+LIGHT_SLEEP_MIN = 5  # Only sleep when nothing is due for at least this long (in seconds)
+POWER_SAMPLE_INTERVAL = 1  # How often LED current is sampled for the power estimate (in seconds)
+
+# Animation Configuration
+ANIMATION_ENABLED = True  # Fade between states and pulse/breathe for warnings and errors
+ANIMATION_FPS = 30  # Animation frame rate
+FADE_DURATION_MS = 500  # Cross-fade length between busy/free frames
+PULSE_PERIOD_MS = 1000  # Pulse period for the "meeting starts soon" warning
+BREATHE_PERIOD_MS = 3000  # Breathing period for the error state
+ANIMATION_WARNING_MINUTES = 5  # Pulse when the next meeting starts in less than this
+
+# Network Configuration
+WIFI_CONNECT_TIMEOUT = 20  # Give up on a connection attempt after this (in seconds)
+WIFI_RETRY_INTERVAL = 10  # Wait between failed connection attempts (in seconds)
+WIFI_CHECK_INTERVAL = 5  # How often the supervisor checks the link (in seconds)
 
 # Time Configuration
-UPDATE_INTERVAL = 60  # How often to check calendar (in seconds)
+UPDATE_INTERVAL = 60  # How often to check calendar (in seconds); shortest refresh interval
+REFRESH_MAX_INTERVAL = 300  # Refresh interval backs off up to this while calendars are unchanged (in seconds)
 NTP_SERVER = "pool.ntp.org"  # NTP server for time synchronization
-NTP_SYNC_INTERVAL = 900  # How often to sync time (in seconds) - reduced to 15 minutes
-NTP_RETRY_INTERVAL = 60  # How long to wait between retry attempts (in seconds)
+NTP_SYNC_INTERVAL = 900  # Starting interval between time syncs (in seconds) - adapted to measured drift
+NTP_MIN_INTERVAL = 300  # Shortest interval between syncs when the clock drifts fast (in seconds)
+NTP_MAX_INTERVAL = 14400  # Longest interval between syncs when the clock is stable (in seconds)
+NTP_RETRY_INTERVAL = 60  # Wait after a failed sync (in seconds) - doubled on each further failure
+NTP_TIMEOUT = 2  # How long to wait for NTP replies (in seconds)
+NTP_TOLERANCE = 250  # Clock error corrected by stepping the clock (in milliseconds)
+DATE_FALLBACK_DELAY = 3  # Wait this long for NTP at boot before taking the time from an HTTPS Date header (in seconds)
 NTP_MAX_RETRIES = 3  # Maximum number of retry attempts for NTP sync
 NTP_BACKUP_SERVERS = [  # Backup NTP servers if primary fails
     "time.google.com",
@@ -24,6 +71,62 @@ NTP_BACKUP_SERVERS = [  # Backup NTP servers if primary fails
     "time.apple.com"
 ]
 MINUTES_PER_LED = 10  # Each LED in progress column represents this many minutes
+BACK_TO_BACK_GAP = 300  # Meetings separated by at most this are shown as one busy block (in seconds)
+
+# Calendar API Configuration
+CALENDAR_API_BASE_URL = "https://www.googleapis.com/calendar/v3"  # Point at a local mock server for testing
+OAUTH_TOKEN_URL = "https://oauth2.googleapis.com/token"
+CALENDAR_LOOKAHEAD = 10800  # How far ahead to look for meetings (in seconds)
+CALENDAR_SYNC_MODE = "incremental"  # "incremental" (syncToken/ETag deltas), "full" (refetch window every cycle) or "freebusy" (one freeBusy.query for all calendars)
+CALENDAR_PAGE_SIZE = 250  # maxResults per events.list page
+CALENDAR_SYNC_HORIZON = 86400  # Incremental mode keeps events starting this far ahead, and syncs in full again when the lookahead reaches past them (in seconds)
+TOKEN_REFRESH_MARGIN = 300  # Refresh the access token this long before it expires (in seconds)
+TOKEN_CACHE_FILE = "token_cache.json"  # Access token persisted across reboots
+SCHEDULE_CACHE_FILE = "schedule_cache.bin"  # Last known busy blocks, kept for reboots and outages
+FAST_BOOT = True  # Show the cached schedule at power-up when the RTC still has the time
+ICS_FEEDS = globals().get("ICS_FEEDS", [])  # Other calendars, set in config_local.py: see config_template.py
+ICS_REFRESH_INTERVAL = 300  # Shortest interval between downloads of one ICS feed (in seconds)
+RETRY_ATTEMPTS = 3  # Tries per API request when Google answers 429, 5xx or a rate-limit 403
+RETRY_BASE_DELAY = 1  # Backoff before the first retry, doubled for each further one, with jitter (in seconds)
+RETRY_MAX_WAIT = 10  # Longest wait within one request; a longer Retry-After opens the circuit breaker instead (in seconds)
+BREAKER_FAILURES = 3  # Failed requests in a row that open an endpoint's circuit breaker
+BREAKER_OPEN_TIME = 60  # How long a breaker first stays open, doubled while its probes fail (in seconds)
+BREAKER_MAX_OPEN_TIME = 1800  # Longest time a breaker stays open (in seconds)
+API_QUOTA_PER_HOUR = 1200  # Google API requests this device may make per hour, to protect the shared project quota (0 = no limit)
+REFRESH_RETRY_MAX_INTERVAL = 900  # Failed refreshes back off up to this (in seconds)
+HTTP_TIMEOUT = 10  # Socket timeout for API requests (in seconds)
+HTTP_IDLE_TIMEOUT = 240  # Close pooled connections idle longer than this (in seconds)
+
+# Push Notification Configuration
+WATCH_ENABLED = False  # Register events.watch channels and refetch calendars when Google reports a change
+WATCH_ADDRESS = None  # Public HTTPS URL forwarded to WATCH_PORT, e.g. "https://busylight.example.com/notify"
+WATCH_PORT = 8081  # Local port of the webhook receiver
+WATCH_TTL = 86400  # Requested channel lifetime (in seconds)
+WATCH_RENEW_MARGIN = 600  # Renew a channel this long before it expires (in seconds)
+WATCH_CHECK_INTERVAL = 60  # How often channels are checked for renewal (in seconds)
+WATCH_POLL_INTERVAL = 900  # Safety-net poll while every calendar has a live channel (in seconds)
+
+# Hub Configuration
+HUB_CLIENT_MODE = False  # Render status frames pushed by a hub instead of polling Google directly
+HUB_HOST = None  # Hub address the light registers with, e.g. "192.168.1.10"
+HUB_PORT = 5005  # UDP port used by the hub and the lights
+HUB_GROUP = 1  # Calendar group this light displays
+HUB_GROUPS = {1: CALENDAR_IDS}  # Hub side: group id -> calendars merged for that group
+HUB_MULTICAST = None  # e.g. "239.0.0.77" to send one frame per group instead of one per light
+HUB_HEARTBEAT = 30  # Frames are resent, and lights re-register, at least this often (in seconds)
+HUB_TIMEOUT = 90  # Lights show an error, and the hub forgets a light, after this long without contact (in seconds)
+
+# Logging Configuration
+LOG_LEVEL = "INFO"  # "DEBUG", "INFO", "WARNING" or "ERROR"; messages below it are never formatted
+LOG_RING_SIZE = 64  # Recent log lines kept in RAM
+LOG_FILE = None  # Set to e.g. "log.txt" to flush the RAM ring to flash in batches
+LOG_FLUSH_LINES = 16  # Write to flash after this many new lines (errors flush immediately)
+LOG_FILE_MAX_BYTES = 16384  # Rotate the log file to <LOG_FILE>.1 past this size
+
+# Metrics Configuration
+METRICS_ENABLED = False  # Collect phase timings and counters and serve them for Prometheus
+METRICS_PORT = 9100  # Scrape http://<device>:9100/metrics
+METRICS_WINDOW = 32  # Recent samples kept per timed phase for the quantiles
 
 # Colors (RGB format)
 COLOR_BUSY = (255, 0, 0)      # Red for main display
@@ -32,4 +135,6 @@ COLOR_UPDATING = (0, 0, 255)  # Blue while updating
 COLOR_ERROR = (255, 165, 0)   # Orange for errors
 COLOR_PROGRESS = (0, 191, 255)  # Deep Sky Blue for time remaining indicator
 COLOR_OVERFLOW = (75, 0, 130)   # Indigo for overflow time indicator
-COLOR_OFF = (0, 0, 0)        # Off state 
\ No newline at end of file
+COLOR_OFF = (0, 0, 0)        # Off state
+COLOR_TEXT_ON_BUSY = (255, 255, 255)  # Scrolling text over the busy colour
+COLOR_TEXT_ON_FREE = (0, 0, 0)  # Scrolling text over the free colour
\ No newline at end of file
@@ -23,6 +23,12 @@ CALENDAR_IDS = [
     "your_calendar_id_2@group.calendar.google.com"
 ]
 
+# Other calendars: iCalendar feed URLs, or dicts for CalDAV and password-protected feeds, e.g.
+#   "https://example.com/team.ics"
+#   {"url": "https://dav.example.com/calendars/me/work/", "caldav": True, "user": "me", "password": "secret"}
+# A hub merges each feed into every group, or only into those listed, e.g. {"url": ..., "groups": [2]}
+ICS_FEEDS = []
+
 # Service Account JSON key (paste the entire contents of your service account JSON key file)
 SERVICE_ACCOUNT_KEY = """{
     "type": "service_account",
@@ -0,0 +1,139 @@
+import json
+
+# fields= projection for events.list: only what the status logic reads
+EVENT_FIELDS = "items(id,status,transparency,start,end),nextPageToken,nextSyncToken,etag"
+
+# Top-level response members kept by the parser
+TOP_FIELDS = ("nextPageToken", "nextSyncToken", "etag")
+ITEM_FIELDS = ("id", "status", "transparency")
+TIME_FIELDS = ("dateTime", "date")
+
+_QUOTE = 0x22
+_BACKSLASH = 0x5C
+
+class EventStreamParser:
+    """Incremental parser for events.list responses
+
+    Bytes are fed as they arrive from the socket. Instead of building the full
+    dict tree, the parser tracks its position in the document and keeps only
+    the handful of strings the status logic needs. Each finished item is
+    passed to on_item(event_id, start, end, status, transparency), where
+    start/end are the raw dateTime (or date) strings. Top-level page and
+    sync tokens end up in self.fields. Memory use is bounded by the longest
+    captured string, regardless of response size.
+    """
+    def __init__(self, on_item):
+        self.on_item = on_item
+        self.fields = {}
+        self.count = 0
+        # Container stack: [is_object, key, expecting_key]
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.capture = None  # bytearray while a wanted string is being read
+        self.string_is_key = False
+        self._reset_item()
+
+    def _reset_item(self):
+        self.item = {"id": None, "status": None, "transparency": None, "start": None, "end": None}
+
+    def _wanted(self):
+        """Name of the slot the value at the current position fills, or None"""
+        stack = self.stack
+        depth = len(stack)
+        if depth == 1:
+            key = stack[0][1]
+            return key if key in TOP_FIELDS else None
+        if depth < 3 or stack[0][1] != "items" or stack[1][0]:
+            return None
+        if depth == 3:
+            key = stack[2][1]
+            return key if key in ITEM_FIELDS else None
+        if depth == 4 and stack[2][1] in ("start", "end") and stack[3][1] in TIME_FIELDS:
+            return stack[2][1]
+        return None
+
+    def _string_done(self, raw):
+        if self.string_is_key:
+            self.stack[-1][1] = raw.decode()
+            self.stack[-1][2] = False
+            return
+        if raw is None:
+            return
+        value = json.loads(b'"' + raw + b'"') if raw.find(b"\\") >= 0 else raw.decode()
+        slot = self._wanted()
+        if len(self.stack) == 1:
+            self.fields[slot] = value
+        elif slot in ("start", "end"):
+            # Prefer dateTime over date if both are present
+            if self.item[slot] is None or self.stack[3][1] == "dateTime":
+                self.item[slot] = value
+        else:
+            self.item[slot] = value
+
+    def _close(self):
+        """Pop a container, emitting the item if it was one"""
+        self.stack.pop()
+        if len(self.stack) == 2 and self.stack[0][1] == "items":
+            item = self.item
+            self.count += 1
+            self.on_item(item["id"], item["start"], item["end"], item["status"], item["transparency"])
+            self._reset_item()
+
+    def feed(self, data):
+        """Consume the next chunk of the response body"""
+        i = 0
+        n = len(data)
+        stack = self.stack
+        while i < n:
+            if self.in_string:
+                if self.escape:
+                    # Byte after a backslash; \\uXXXX digits are plain bytes
+                    if self.capture is not None:
+                        self.capture.append(data[i])
+                    self.escape = False
+                    i += 1
+                    continue
+                # Jump to the next quote or backslash
+                j = i
+                while j < n and data[j] != _QUOTE and data[j] != _BACKSLASH:
+                    j += 1
+                if self.capture is not None:
+                    self.capture.extend(data[i:j])
+                if j == n:
+                    break
+                if data[j] == _BACKSLASH:
+                    if self.capture is not None:
+                        self.capture.append(_BACKSLASH)
+                    self.escape = True
+                    i = j + 1
+                    continue
+                self.in_string = False
+                raw = self.capture
+                self.capture = None
+                self._string_done(bytes(raw) if raw is not None else None)
+                i = j + 1
+                continue
+
+            c = data[i]
+            if c == 0x20 or c == 0x0A or c == 0x0D or c == 0x09 or c == 0x3A:  # whitespace, ':'
+                pass
+            elif c == _QUOTE:
+                self.in_string = True
+                self.string_is_key = bool(stack) and stack[-1][0] and stack[-1][2]
+                self.capture = bytearray() if self.string_is_key or self._wanted() else None
+            elif c == 0x7B:  # '{'
+                stack.append([True, None, True])
+            elif c == 0x5B:  # '['
+                stack.append([False, 0, False])
+            elif c == 0x7D or c == 0x5D:  # '}' or ']'
+                self._close()
+            elif c == 0x2C:  # ','
+                top = stack[-1]
+                if top[0]:
+                    top[1] = None
+                    top[2] = True
+                else:
+                    top[1] += 1
+            # Numbers and literals are never needed; their bytes are skipped
+            i += 1
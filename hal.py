@@ -0,0 +1,98 @@
+import sys
+import time
+import asyncio
+
+# Hardware abstraction layer. Firmware modules reach the LEDs, WiFi, NTP,
+# sockets, light sleep and the clocks that schedule them only through these
+# hooks, so the same code runs on the device and under CPython. The defaults
+# wrap machine/network/socket/time; under CPython the sockets and clocks work
+# as they are, for the hub. Host scripts that run the light itself call
+# sim.install() for virtual implementations, down to a virtual clock.
+
+ON_DEVICE = sys.implementation.name == "micropython"
+
+# WS2812B bit timings in ns: high/low for a 0 bit, high/low for a 1 bit
+WS2812_TIMING = (400, 850, 800, 450)
+
+class BitstreamOutput:
+    """WS2812B strip on a GPIO pin, driven with machine.bitstream"""
+    def __init__(self, pin_num):
+        from machine import Pin, bitstream
+        self.pin = Pin(pin_num, Pin.OUT)
+        self._bitstream = bitstream
+
+    def write(self, buf):
+        """Stream a GRB framebuffer to the LEDs"""
+        self._bitstream(self.pin, 0, WS2812_TIMING, buf)
+
+def _device_led_output(pin_num, num_leds):
+    return BitstreamOutput(pin_num)
+
+def _device_wlan():
+    import network
+    return network.WLAN(network.STA_IF)
+
+class NTPTransport:
+    """UDP sockets to NTP servers, and the RTC their answers correct"""
+    def resolve(self, host, port):
+        import socket
+        return socket.getaddrinfo(host, port)[0][-1]
+
+    def socket(self):
+        """Non-blocking UDP socket"""
+        import socket
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        return sock
+
+    def now_ms(self):
+        return time.time_ns() // 1000000
+
+    def step(self, offset_ms):
+        """Move the RTC by offset_ms; returns the step actually applied in ms
+
+        The RTC is set in whole seconds, so up to half a second of the offset
+        can remain. Under CPython the clock belongs to the OS and nothing is
+        stepped.
+        """
+        if not ON_DEVICE:
+            return 0
+        from machine import RTC
+        now = self.now_ms()
+        seconds = (now + offset_ms + 500) // 1000
+        tm = time.gmtime(seconds)
+        RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+        return seconds * 1000 - now
+
+def _device_ntp():
+    return NTPTransport()
+
+def _device_lightsleep(ms):
+    import machine
+    machine.lightsleep(ms)
+
+try:
+    _ticks_ms = time.ticks_ms
+except AttributeError:
+    # CPython
+    def _ticks_ms():
+        return int(time.monotonic() * 1000)
+
+# Hooks used by the firmware; replace with install()
+led_output = _device_led_output  # (pin_num, num_leds) -> object with write(buf)
+wlan = _device_wlan  # () -> object with active/connect/isconnected/ifconfig
+ntp = _device_ntp  # () -> object with resolve/socket/now_ms/step, like NTPTransport
+open_connection = asyncio.open_connection  # (host, port, ssl=...) -> (reader, writer)
+lightsleep = _device_lightsleep  # (ms) -> None once woken, by the timeout or an interrupt
+clock = time.time  # () -> UTC seconds, the wall clock schedules are evaluated against
+ticks_ms = _ticks_ms  # () -> milliseconds from a counter the wall clock's steps do not move
+
+def install(led_output=None, wlan=None, ntp=None, open_connection=None, lightsleep=None,
+            clock=None, ticks_ms=None):
+    """Replace one or more platform hooks"""
+    hooks = globals()
+    for name, impl in (("led_output", led_output), ("wlan", wlan), ("ntp", ntp),
+                       ("open_connection", open_connection), ("lightsleep", lightsleep),
+                       ("clock", clock), ("ticks_ms", ticks_ms)):
+        if impl is not None:
+            hooks[name] = impl
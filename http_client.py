@@ -0,0 +1,260 @@
+import asyncio
+import json
+import config
+import hal
+from metrics import metrics
+
+# Largest read handed to a streaming sink at once
+READ_CHUNK = 512
+
+class HTTPError(OSError):
+    pass
+
+class Response:
+    """Fully-read HTTP response, shaped like the urequests one"""
+    def __init__(self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def header(self, name, default=None):
+        """Case-insensitive header lookup"""
+        return _header(self.headers, name.lower()) or default
+
+    def close(self):
+        # Body is already read and the connection is back in the pool
+        pass
+
+class _Connection:
+    """One open stream pair to a host"""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = hal.clock()
+        self.requests = 0
+        self.responded = False  # Status line of the current request was received
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+def _split_url(url):
+    """Split a URL into (use_tls, host, port, path)"""
+    scheme, _, rest = url.partition("://")
+    hostport, slash, path = rest.partition("/")
+    path = slash + path if slash else "/"
+    use_tls = scheme == "https"
+    host, _, port = hostport.partition(":")
+    port = int(port) if port else (443 if use_tls else 80)
+    return use_tls, host, port, path
+
+class HTTPClient:
+    """Minimal non-blocking HTTP/1.1 client that keeps connections open
+
+    Connections are pooled per (scheme, host, port), so consecutive calls to
+    googleapis.com or oauth2.googleapis.com reuse a TLS session instead of
+    handshaking every time. Requests are coroutines; several can be in flight
+    at once, each on its own pooled connection.
+    """
+    def __init__(self, logger, idle_timeout=None, timeout=None):
+        self.logger = logger
+        self.idle_timeout = config.HTTP_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.timeout = config.HTTP_TIMEOUT if timeout is None else timeout
+        self.pool = {}  # (use_tls, host, port) -> [idle _Connection, ...]
+        self.stats = {"requests": 0, "handshakes": 0, "reused": 0, "reconnects": 0}
+        self.on_date = None  # Called with each response's Date header, if set
+
+    async def _acquire(self, key):
+        """Return an idle pooled connection for key, or open a new one"""
+        idle = self.pool.get(key)
+        now = hal.clock()
+        while idle:
+            conn = idle.pop()
+            if now - conn.last_used <= self.idle_timeout:
+                self.stats["reused"] += 1
+                return conn, True
+            self.logger.debug("Closing idle connection to %s", key[1])
+            conn.close()
+        self.stats["handshakes"] += 1
+        use_tls, host, port = key
+        started = metrics.start()
+        reader, writer = await asyncio.wait_for(
+            hal.open_connection(host, port, ssl=True if use_tls else None), self.timeout)
+        metrics.record("tls_connect" if use_tls else "connect", started)
+        return _Connection(reader, writer), False
+
+    def _release(self, key, conn, keep_alive):
+        """Return a connection to the pool, or close it"""
+        if keep_alive:
+            conn.last_used = hal.clock()
+            self.pool.setdefault(key, []).append(conn)
+        else:
+            conn.close()
+
+    async def _send(self, conn, method, host, path, headers, body):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}"]
+        for name, value in headers.items():
+            lines.append(f"{name}: {value}")
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append("")
+        lines.append("")
+        conn.writer.write("\r\n".join(lines).encode())
+        if body:
+            conn.writer.write(body)
+        await conn.writer.drain()
+
+    async def _read_head(self, reader):
+        """Read the status line and headers; returns (version, status, reason, headers)"""
+        status_line = await reader.readline()
+        if not status_line:
+            raise HTTPError("Connection closed by server")
+        parts = status_line.decode().split(" ", 2)
+        version = parts[0]
+        status = int(parts[1])
+        reason = parts[2].strip() if len(parts) > 2 else ""
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n":
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip()] = value.strip()
+        return version, status, reason, headers
+
+    def _keep_alive(self, version, headers):
+        connection = _header(headers, "connection").lower()
+        return connection != "close" and (version != "HTTP/1.0" or connection == "keep-alive")
+
+    async def _read_response(self, conn, method, sink=None):
+        """Read status, headers and body; returns (Response, keep_alive)
+
+        With a sink, a 200 (or WebDAV 207) body is passed to sink(chunk) as it
+        arrives and Response.content stays empty; other statuses are buffered
+        as usual.
+        """
+        reader = conn.reader
+        version, status, reason, headers = await self._read_head(reader)
+        conn.responded = True
+        keep_alive = self._keep_alive(version, headers)
+        if self.on_date:
+            date = _header(headers, "date")
+            if date:
+                self.on_date(date)
+
+        body = bytearray()
+        if sink is None or status not in (200, 207):
+            sink = body.extend
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            pass
+        elif "chunked" in _header(headers, "transfer-encoding").lower():
+            await self._read_chunked(reader, sink)
+        elif _header(headers, "content-length"):
+            await self._pump(reader, int(_header(headers, "content-length")), sink)
+        else:
+            # Body runs to end of stream, so the socket cannot be reused
+            while True:
+                chunk = await reader.read(READ_CHUNK)
+                if not chunk:
+                    break
+                sink(chunk)
+            keep_alive = False
+        return Response(status, reason, headers, bytes(body)), keep_alive
+
+    async def _pump(self, reader, length, sink):
+        """Pass exactly length bytes to sink in pieces of at most READ_CHUNK"""
+        while length > 0:
+            chunk = await reader.read(min(length, READ_CHUNK))
+            if not chunk:
+                raise HTTPError("Connection closed mid-body")
+            sink(chunk)
+            length -= len(chunk)
+
+    async def _read_chunked(self, reader, sink):
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                raise HTTPError("Connection closed mid-chunk")
+            size = int(size_line.split(b";")[0].strip(), 16)
+            if size == 0:
+                break
+            await self._pump(reader, size, sink)
+            await reader.readline()  # CRLF after chunk data
+        # Skip trailers up to the terminating blank line
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n":
+                break
+
+    def _prepare(self, url, data, json_body, headers, method):
+        """Normalise request arguments; returns (key, host, path, headers, body)"""
+        use_tls, host, port, path = _split_url(url)
+        headers = dict(headers or {})
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        if isinstance(data, str):
+            data = data.encode()
+        if data is None and method in ("POST", "PUT", "PATCH"):
+            data = b""
+        return (use_tls, host, port), host, path, headers, data
+
+    async def request(self, method, url, data=None, json=None, headers=None, sink=None):
+        """Perform a request, reusing a pooled connection when possible
+
+        Pass sink to stream a successful response body instead of buffering it.
+        """
+        key, host, path, headers, data = self._prepare(url, data, json, headers, method)
+        self.stats["requests"] += 1
+        for attempt in range(2):
+            conn, reused = await self._acquire(key)
+            conn.responded = False
+            try:
+                await self._send(conn, method, host, path, headers, data)
+                response, keep_alive = await asyncio.wait_for(self._read_response(conn, method, sink), self.timeout)
+            except (OSError, ValueError, IndexError) as e:
+                conn.close()
+                if reused and attempt == 0 and not conn.responded:
+                    # Server dropped the idle connection; retry on a fresh one
+                    self.logger.debug("Pooled connection to %s was reset, reconnecting", host)
+                    self.stats["reconnects"] += 1
+                    continue
+                raise
+            except Exception:
+                # Timeouts and cancellation leave the stream mid-response
+                conn.close()
+                raise
+            conn.requests += 1
+            self._release(key, conn, keep_alive)
+            return response
+
+    async def get(self, url, **kw):
+        return await self.request("GET", url, **kw)
+
+    async def post(self, url, **kw):
+        return await self.request("POST", url, **kw)
+
+    def close(self):
+        """Close every pooled connection"""
+        for idle in self.pool.values():
+            for conn in idle:
+                conn.close()
+        self.pool = {}
+
+def _header(headers, name):
+    """Case-insensitive header lookup, '' when absent"""
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return ""
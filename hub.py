@@ -0,0 +1,187 @@
+import asyncio
+import time
+import config
+from calendar_api import CalendarAPI
+from time_manager import TimeManager
+from timeline import Timeline
+from scheduler import Scheduler
+from hub_protocol import decode, encode_status, HELLO
+from log_config import setup_logging
+
+# Hub mode (CPython): one process signs tokens and polls every calendar once,
+# then pushes a small status frame per calendar group to all registered lights.
+
+# How often the hub re-evaluates group status and sends changed frames (in seconds)
+TICK_INTERVAL = 1
+
+class _HubDatagrams(asyncio.DatagramProtocol):
+    def __init__(self, hub):
+        self.hub = hub
+
+    def datagram_received(self, data, addr):
+        self.hub.datagram(data, addr)
+
+class Hub:
+    """Fetches calendars once and fans per-group status out to lights over UDP
+
+    Lights register by sending HELLO frames for their group and are sent that
+    group's STATUS frame whenever it changes, and at least every
+    HUB_HEARTBEAT seconds. With HUB_MULTICAST set, one frame per group goes to
+    the multicast address instead of one per light.
+    """
+    def __init__(self, logger, groups=None, calendar=None, time_manager=None):
+        self.logger = logger
+        self.groups = groups or config.HUB_GROUPS  # group id -> [calendar id, ...]
+        self.time_manager = time_manager or TimeManager(logger)
+        self.calendar = calendar or CalendarAPI(self.time_manager, logger, sync_mode="incremental")
+        self.scheduler = Scheduler(self.calendar, logger)
+        self.timelines = {group: Timeline() for group in self.groups}
+        self.devices = {}  # addr -> [group, last HELLO time]
+        self.frames = {}  # group -> (status, frame bytes)
+        self.seq = 0
+        self.calendar_ok = False
+        self.transport = None
+        self.last_heartbeat = 0
+        self.stats = {"hellos": 0, "frames_sent": 0, "refreshes": 0, "expired": 0}
+        if self.calendar.sync_mode != "incremental":
+            # Group timelines are built from the per-calendar incremental stores
+            logger.warning("Hub mode uses incremental sync instead of %s", self.calendar.sync_mode)
+            self.calendar.sync_mode = "incremental"
+
+    def calendar_ids(self):
+        """Every calendar used by any group, each listed once"""
+        ids = []
+        for calendar_ids in self.groups.values():
+            for calendar_id in calendar_ids:
+                if calendar_id not in ids:
+                    ids.append(calendar_id)
+        return ids
+
+    def datagram(self, data, addr):
+        frame = decode(data)
+        if not frame or frame[0] != HELLO:
+            return
+        group = frame[3]
+        if group not in self.groups:
+            self.logger.debug("HELLO from %s for unknown group %s", addr, group)
+            return
+        self.stats["hellos"] += 1
+        known = addr in self.devices
+        self.devices[addr] = [group, time.time()]
+        if not known:
+            self.logger.debug("Light %s joined group %s", addr, group)
+            current = self.frames.get(group)
+            if current:
+                self._send(current[1], addr)
+
+    def _send(self, frame, addr):
+        self.transport.sendto(frame, addr)
+        self.stats["frames_sent"] += 1
+
+    def rebuild_timelines(self, now):
+        """Merge each group's calendars from the shared local stores, plus its other sources"""
+        end = now + config.CALENDAR_LOOKAHEAD
+        for group, calendar_ids in self.groups.items():
+            events = []
+            for calendar_id in calendar_ids:
+                store = self.calendar.stores.get(calendar_id)
+                if store:
+                    events.extend(store.window(now, end))
+            for source, busy in zip(self.calendar.sources, self.calendar.source_events):
+                groups = getattr(source, "groups", None)
+                if groups is None or group in groups:
+                    events.extend(v for v in busy if v[0] < end and v[1] > now)
+            self.timelines[group] = Timeline(events)
+
+    def update_frames(self, now):
+        """Recompute each group's status; returns the groups whose frame changed"""
+        changed = []
+        fault = not self.calendar_ok
+        for group, timeline in self.timelines.items():
+            is_busy, remaining, next_in, _ = self.calendar.evaluate(now, timeline)
+            status = (is_busy, remaining, next_in, fault)
+            current = self.frames.get(group)
+            if current and current[0] == status:
+                continue
+            self.seq = (self.seq + 1) & 0xFFFF
+            self.frames[group] = (status, encode_status(self.seq, group, status[:3], fault))
+            changed.append(group)
+        return changed
+
+    def broadcast(self, groups):
+        """Send the current frame of each listed group to its lights"""
+        if not groups:
+            return
+        if config.HUB_MULTICAST:
+            for group in groups:
+                self._send(self.frames[group][1], (config.HUB_MULTICAST, config.HUB_PORT))
+            return
+        wanted = set(groups)
+        for addr, (group, _) in self.devices.items():
+            if group in wanted:
+                self._send(self.frames[group][1], addr)
+
+    def expire(self, now):
+        """Forget lights that stopped sending HELLO"""
+        stale = [addr for addr, (_, seen) in self.devices.items() if now - seen > config.HUB_TIMEOUT]
+        for addr in stale:
+            del self.devices[addr]
+        self.stats["expired"] += len(stale)
+
+    async def poll(self):
+        """Refresh all calendars on the scheduler's adaptive cadence"""
+        calendar_ids = self.calendar_ids()
+        while True:
+            now = self.time_manager.get_utc_timestamp()
+            if self.scheduler.refresh_due(now):
+                ok = await self.calendar.refresh(calendar_ids)
+                self.stats["refreshes"] += 1
+                self.scheduler.refreshed(now, ok, self.calendar.changed, retry_at=None if ok else self.calendar.retry_at(now))
+                self.calendar_ok = ok
+                if ok:
+                    self.rebuild_timelines(now)
+                else:
+                    self.logger.error("Calendar refresh failed")
+            await self.calendar.prefetch_token()
+            await asyncio.sleep(max(1, self.scheduler.next_refresh - self.time_manager.get_utc_timestamp()))
+
+    async def fan_out(self):
+        """Send frames that changed each tick, and everything on the heartbeat"""
+        while True:
+            now = self.time_manager.get_utc_timestamp()
+            changed = self.update_frames(now)
+            if now - self.last_heartbeat >= config.HUB_HEARTBEAT:
+                self.last_heartbeat = now
+                self.expire(now)
+                changed = list(self.frames)
+                self.logger.debug("Heartbeat to %s lights (%s frames sent so far)",
+                                  len(self.devices), self.stats["frames_sent"])
+            self.broadcast(changed)
+            await asyncio.sleep(TICK_INTERVAL)
+
+    async def start(self, host="0.0.0.0", port=None):
+        loop = asyncio.get_event_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _HubDatagrams(self), local_addr=(host, port or config.HUB_PORT))
+        self.logger.info("Hub serving %s groups (%s calendars) on UDP port %s",
+                         len(self.groups), len(self.calendar_ids()), port or config.HUB_PORT)
+
+    async def run(self, host="0.0.0.0", port=None):
+        await self.start(host, port)
+        try:
+            await asyncio.gather(self.poll(), self.fan_out())
+        finally:
+            self.transport.close()
+            self.calendar.http.close()
+
+def main():
+    loggers = setup_logging()
+    time_manager = TimeManager(loggers['time'])
+    hub = Hub(loggers['main'], calendar=CalendarAPI(time_manager, loggers['calendar'], sync_mode="incremental"), time_manager=time_manager)
+    try:
+        asyncio.run(hub.run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
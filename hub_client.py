@@ -0,0 +1,92 @@
+import socket
+import asyncio
+import time
+import config
+from hub_protocol import decode, encode_hello, newer, STATUS, FLAG_FAULT
+
+# How often a waiting client checks its socket for a frame (in seconds)
+POLL_INTERVAL = 0.05
+
+class HubClient:
+    """Light side of hub mode: registers with the hub and receives status frames
+
+    Uses a plain non-blocking UDP socket polled from the event loop, which
+    works the same under MicroPython and CPython.
+    """
+    def __init__(self, logger, host=None, port=None, group=None, listen_port=None):
+        self.logger = logger
+        self.host = host or config.HUB_HOST
+        self.port = port or config.HUB_PORT
+        self.group = config.HUB_GROUP if group is None else group
+        self.listen_port = self.port if listen_port is None else listen_port
+        self.sock = None
+        self.last_seq = None
+        self.last_frame = 0  # time.time() of the last accepted frame
+        self.last_hello = 0
+        self.frames = 0
+
+    def open(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("0.0.0.0", self.listen_port))
+        if config.HUB_MULTICAST and hasattr(socket, "IP_ADD_MEMBERSHIP"):
+            group = bytes(int(part) for part in config.HUB_MULTICAST.split("."))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, group + bytes(4))
+        sock.setblocking(False)
+        self.sock = sock
+        self.logger.info("Listening for hub frames for group %s on port %s", self.group, self.listen_port)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def hello(self):
+        """Register with the hub; repeated every HUB_HEARTBEAT as a keepalive"""
+        self.last_hello = time.time()
+        if not self.host:
+            return
+        try:
+            self.sock.sendto(encode_hello(self.group), (self.host, self.port))
+        except OSError as e:
+            self.logger.warning("Could not reach hub: %s", e)
+
+    def _read(self):
+        """Next frame for our group as (status, fault), or None if nothing is waiting"""
+        while True:
+            try:
+                data, _ = self.sock.recvfrom(64)
+            except OSError:
+                return None
+            frame = decode(data)
+            if not frame:
+                continue
+            kind, flags, seq, group, status = frame
+            if kind != STATUS or group != self.group:
+                continue
+            if not newer(seq, self.last_seq):
+                if time.time() - self.last_frame <= config.HUB_HEARTBEAT:
+                    continue
+                # Nothing newer for a whole heartbeat: the hub restarted and counts from 0 again
+                self.logger.info("Hub sequence went back from %s to %s, following it", self.last_seq, seq)
+            self.last_seq = seq
+            self.last_frame = time.time()
+            self.frames += 1
+            return status, bool(flags & FLAG_FAULT)
+
+    async def receive(self, timeout):
+        """Wait up to timeout seconds for a frame; returns (status, fault) or None"""
+        if self.sock is None:
+            self.open()
+        deadline = time.time() + timeout
+        while True:
+            if time.time() - self.last_hello >= config.HUB_HEARTBEAT:
+                self.hello()
+            frame = self._read()
+            if frame:
+                return frame
+            if time.time() >= deadline:
+                # Take whatever the hub sends next, in case it restarted within a heartbeat
+                self.last_seq = None
+                return None
+            await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,44 @@
+import struct
+
+# Datagrams exchanged between a hub and its lights. Every packet is one
+# fixed-size frame:
+#   magic "BL", version, kind, flags, seq, group, remaining minutes, next meeting in
+# STATUS frames flow hub -> light; HELLO frames flow light -> hub to register
+# (and keep registering) the sender for a group.
+FRAME = ">2sBBBHHHH"
+FRAME_SIZE = struct.calcsize(FRAME)
+MAGIC = b"BL"
+VERSION = 1
+
+STATUS = 1
+HELLO = 2
+
+FLAG_BUSY = 0x01
+FLAG_NEXT = 0x02  # next_in is valid
+FLAG_FAULT = 0x04  # Hub cannot currently read the calendars
+
+MAX_MINUTES = 0xFFFF
+
+def encode_status(seq, group, status, fault=False):
+    """STATUS frame for an (is_busy, remaining_minutes, next_meeting_in) tuple"""
+    is_busy, remaining, next_in = status
+    flags = (FLAG_BUSY if is_busy else 0) | (FLAG_NEXT if next_in is not None else 0) | (FLAG_FAULT if fault else 0)
+    return struct.pack(FRAME, MAGIC, VERSION, STATUS, flags, seq & 0xFFFF, group,
+                       min(max(remaining, 0), MAX_MINUTES), min(max(next_in or 0, 0), MAX_MINUTES))
+
+def encode_hello(group):
+    return struct.pack(FRAME, MAGIC, VERSION, HELLO, 0, 0, group, 0, 0)
+
+def decode(data):
+    """Return (kind, flags, seq, group, status) or None for anything that is not a valid frame"""
+    if len(data) != FRAME_SIZE:
+        return None
+    magic, version, kind, flags, seq, group, remaining, next_in = struct.unpack(FRAME, data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    status = (bool(flags & FLAG_BUSY), remaining, next_in if flags & FLAG_NEXT else None)
+    return kind, flags, seq, group, status
+
+def newer(seq, last):
+    """True if seq is at or after last, allowing for 16-bit wraparound"""
+    return last is None or (seq - last) & 0xFFFF < 0x8000
@@ -0,0 +1,616 @@
+import binascii
+import config
+from time_manager import days_from_civil, civil_from_days
+from metrics import metrics
+
+# Longest content line kept after unfolding; the rest of a longer line is dropped
+MAX_LINE = 2048
+# Longest event assumed when deciding whether an occurrence before the window can still overlap it (in seconds)
+LONGEST_EVENT = 7 * 86400
+# Recurrence periods examined per event before giving up on a rule
+MAX_PERIODS = 5000
+# Redirects followed per feed request
+MAX_REDIRECTS = 3
+
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+DURATION_UNITS = {"W": 604800, "D": 86400, "H": 3600, "M": 60, "S": 1}
+
+# Properties read from a VEVENT; everything else, continuation lines included, is skipped
+EVENT_PROPERTIES = (b"DTSTART", b"DTEND", b"DURATION", b"RRULE", b"EXDATE", b"STATUS",
+                    b"TRANSP", b"UID", b"RECURRENCE-ID")
+COMPONENT_PROPERTIES = (b"BEGIN", b"END")
+
+CALDAV_QUERY = """<?xml version="1.0" encoding="utf-8"?>
+<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+<D:prop><C:calendar-data/></D:prop>
+<C:filter><C:comp-filter name="VCALENDAR"><C:comp-filter name="VEVENT">
+<C:time-range start="%s" end="%s"/>
+</C:comp-filter></C:comp-filter></C:filter>
+</C:calendar-query>"""
+
+def _local_shift(value):
+    """Seconds to add to a UTC timestamp to get the event's own clock"""
+    return 0 if value.endswith("Z") else config.UTC_OFFSET * 60
+
+def parse_time(value):
+    """UTC timestamp for an iCalendar DATE or DATE-TIME value
+
+    Times ending in Z are UTC. Floating times, times with a TZID and dates
+    are taken as local time UTC_OFFSET minutes from UTC, as there is no time
+    zone database on the device.
+    """
+    days = days_from_civil(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+    if len(value) == 8:
+        return days * 86400 - config.UTC_OFFSET * 60
+    if value[8] != "T":
+        raise ValueError("Invalid DATE-TIME")
+    seconds = days * 86400 + int(value[9:11]) * 3600 + int(value[11:13]) * 60 + int(value[13:15])
+    return seconds - _local_shift(value)
+
+def parse_duration(value):
+    """Seconds in an iCalendar DURATION such as PT1H30M, P1D or -PT15M"""
+    sign = -1 if value[0] == "-" else 1
+    value = value.lstrip("+-")
+    if value[0] != "P":
+        raise ValueError("Invalid DURATION")
+    total = n = 0
+    for ch in value[1:]:
+        if "0" <= ch <= "9":
+            n = n * 10 + ord(ch) - 48
+        elif ch != "T":
+            total += n * DURATION_UNITS[ch]
+            n = 0
+    return sign * total
+
+def parse_rule(value):
+    """RRULE parts as a dict, e.g. {'FREQ': 'WEEKLY', 'BYDAY': 'MO,WE'}"""
+    rule = {}
+    for part in value.upper().split(";"):
+        name, _, v = part.partition("=")
+        rule[name] = v
+    return rule
+
+def _weekday(days):
+    """Monday = 0 for a day count since 1970-01-01, a Thursday"""
+    return (days + 3) % 7
+
+def _ints(rule, name):
+    return [int(v) for v in rule[name].split(",")] if rule.get(name) else []
+
+def _month_days(y, m, byday, bymonthday, day):
+    """Sorted day counts in month m of year y matching BYDAY/BYMONTHDAY, or the given day of the month"""
+    first = days_from_civil(y, m, 1)
+    length = days_from_civil(y + m // 12, m % 12 + 1, 1) - first
+    if not byday and not bymonthday:
+        return [first + day - 1] if day <= length else []
+    days = None
+    if bymonthday:
+        days = []
+        for d in bymonthday:
+            if d < 0:
+                d += length + 1
+            if 1 <= d <= length:
+                days.append(first + d - 1)
+    if byday:
+        matches = []
+        for n, wd in byday:
+            run = list(range(first + (wd - _weekday(first)) % 7, first + length, 7))
+            if n == 0:
+                matches.extend(run)
+            elif 0 < abs(n) <= len(run):
+                matches.append(run[n - 1 if n > 0 else n])
+        days = matches if days is None else [d for d in days if d in matches]
+    return sorted(days)
+
+def occurrences(dtstart, rule, lo, hi, until=None):
+    """Start times of a recurring event in [lo, hi), in order
+
+    All times are seconds on the event's own clock (UTC plus its offset), so
+    days and weekdays fall where the organiser sees them. Supports FREQ
+    DAILY, WEEKLY, MONTHLY and YEARLY with INTERVAL, COUNT, UNTIL, BYDAY
+    (with ordinals such as -1FR in monthly and yearly rules), BYMONTHDAY,
+    BYMONTH, BYSETPOS and WKST. Periods before the window are skipped
+    arithmetically unless COUNT needs them counted.
+    """
+    freq = rule.get("FREQ")
+    interval = max(1, int(rule.get("INTERVAL") or 1))
+    count = int(rule["COUNT"]) if rule.get("COUNT") else None
+    byday = []
+    if rule.get("BYDAY"):
+        for item in rule["BYDAY"].split(","):
+            byday.append((int(item[:-2]) if len(item) > 2 else 0, WEEKDAYS.index(item[-2:])))
+    bymonthday = _ints(rule, "BYMONTHDAY")
+    bymonth = sorted(_ints(rule, "BYMONTH"))
+    setpos = _ints(rule, "BYSETPOS")
+    wkst = WEEKDAYS.index(rule.get("WKST") or "MO")
+    day0, tod = divmod(dtstart, 86400)
+    y0, m0, d0 = civil_from_days(day0)
+    lo_day = (lo - tod) // 86400
+    ly, lm, _ = civil_from_days(lo_day)
+
+    if freq == "DAILY":
+        def period(k):
+            d = day0 + k * interval
+            return d, [d]
+        first = (lo_day - day0) // interval
+    elif freq == "WEEKLY":
+        week0 = day0 - (_weekday(day0) - wkst) % 7
+        offsets = sorted(set((wd - wkst) % 7 for _, wd in byday)) or [(_weekday(day0) - wkst) % 7]
+
+        def period(k):
+            w = week0 + 7 * interval * k
+            return w, [w + o for o in offsets]
+        first = (lo_day - week0) // (7 * interval)
+    elif freq == "MONTHLY":
+        month0 = y0 * 12 + m0 - 1
+
+        def period(k):
+            y, m = divmod(month0 + k * interval, 12)
+            return days_from_civil(y, m + 1, 1), _month_days(y, m + 1, byday, bymonthday, d0)
+        first = (ly * 12 + lm - 1 - month0) // interval
+    elif freq == "YEARLY":
+        months = bymonth or [m0]
+
+        def period(k):
+            y = y0 + k * interval
+            days = []
+            for m in months:
+                days.extend(_month_days(y, m, byday, bymonthday, d0))
+            return days_from_civil(y, 1, 1), days
+        first = (ly - y0) // interval
+    else:
+        raise ValueError("Unsupported FREQ %s" % freq)
+
+    if count is not None or first < 0:
+        first = 0
+    n = 0
+    for k in range(first, first + MAX_PERIODS):
+        start, days = period(k)
+        if start * 86400 >= hi:
+            return
+        if freq in ("DAILY", "WEEKLY"):
+            # BYxxx parts that limit rather than expand these frequencies
+            if bymonth:
+                days = [d for d in days if civil_from_days(d)[1] in bymonth]
+            if freq == "DAILY" and byday:
+                days = [d for d in days if _weekday(d) in [wd for _, wd in byday]]
+            if freq == "DAILY" and bymonthday:
+                days = [d for d in days if civil_from_days(d)[2] in bymonthday]
+        if setpos:
+            days = sorted(days[p - 1 if p > 0 else p] for p in setpos if 0 < abs(p) <= len(days))
+        for d in days:
+            t = d * 86400 + tod
+            if t < dtstart:
+                continue
+            if until is not None and t > until:
+                return
+            if count is not None:
+                if n >= count:
+                    return
+                n += 1
+            if t >= hi:
+                return
+            if t >= lo:
+                yield t
+
+def _split(line):
+    """(name, value) of an unfolded content line; parameters are not needed"""
+    if b'"' not in line:
+        colon = line.find(b":")
+    else:
+        # A quoted parameter value may contain a colon
+        quoted = False
+        colon = -1
+        for i in range(len(line)):
+            ch = line[i]
+            if ch == 0x22:
+                quoted = not quoted
+            elif ch == 0x3A and not quoted:
+                colon = i
+                break
+    if colon < 0:
+        raise ValueError("Content line without a value")
+    name = line[:colon]
+    semi = name.find(b";")
+    if semi >= 0:
+        name = name[:semi]
+    return name.decode().upper(), line[colon + 1:].decode()
+
+class ICSParser:
+    """Incremental reader for iCalendar streams, one VEVENT at a time
+
+    Bytes are fed as they arrive from the socket. Lines are split and
+    unfolded on the fly, and only the few properties the status logic needs
+    are kept; descriptions, attendees, alarms and time zone definitions are
+    skipped, continuation lines included. Each finished VEVENT is passed to
+    on_event(props) as a dict of property name -> value, with EXDATE as a
+    list of UTC timestamps limited to the window [start, end). Memory is
+    bounded by MAX_LINE, whatever the size of the feed.
+    """
+    def __init__(self, on_event, start=None, end=None):
+        self.on_event = on_event
+        self.start = start
+        self.end = end
+        self.partial = bytearray()  # Physical line split across chunks
+        self.overlong = False
+        self.logical = None  # bytearray of a wanted property being unfolded
+        self.event = None  # Properties of the VEVENT being read
+        self.nested = 0  # Depth of components (e.g. VALARM) inside the VEVENT
+        self.count = 0
+        self.truncated = 0
+
+    def feed(self, chunk):
+        if not isinstance(chunk, bytes):
+            chunk = bytes(chunk)
+        start = 0
+        while True:
+            nl = chunk.find(b"\n", start)
+            piece = chunk[start:] if nl < 0 else chunk[start:nl]
+            room = MAX_LINE - len(self.partial)
+            if len(piece) > room:
+                self.overlong = True
+                piece = piece[:max(0, room)]
+            if nl < 0:
+                self.partial.extend(piece)
+                return
+            if self.partial:
+                self.partial.extend(piece)
+                piece = bytes(self.partial)
+                self.partial = bytearray()
+            if self.overlong:
+                self.truncated += 1
+                self.overlong = False
+            elif piece.endswith(b"\r"):
+                piece = piece[:-1]
+            self._physical(piece)
+            start = nl + 1
+
+    def close(self):
+        """Flush a final line without a line break"""
+        if self.partial:
+            self._physical(bytes(self.partial).rstrip(b"\r"))
+            self.partial = bytearray()
+        self._physical(b"")
+
+    def _physical(self, line):
+        if line[:1] in (b" ", b"\t"):
+            # Continuation of the previous line
+            if self.logical is not None:
+                room = MAX_LINE - len(self.logical)
+                if len(line) - 1 > room:
+                    self.truncated += 1
+                self.logical.extend(line[1:1 + room])
+            return
+        if self.logical is not None:
+            logical = bytes(self.logical)
+            self.logical = None
+            try:
+                self._property(*_split(logical))
+            except (ValueError, UnicodeError):
+                pass
+        if not line:
+            return
+        end = len(line)
+        for sep in (b";", b":"):
+            i = line.find(sep)
+            if 0 <= i < end:
+                end = i
+        name = line[:end].upper()
+        if name in COMPONENT_PROPERTIES or (self.event is not None and not self.nested and name in EVENT_PROPERTIES):
+            self.logical = bytearray(line)
+
+    def _property(self, name, value):
+        if name == "BEGIN":
+            if self.event is not None:
+                self.nested += 1
+            elif value.upper() == "VEVENT":
+                self.event = {"EXDATE": []}
+        elif name == "END":
+            if self.event is None:
+                return
+            if self.nested:
+                self.nested -= 1
+            elif value.upper() == "VEVENT":
+                event = self.event
+                self.event = None
+                self.count += 1
+                self.on_event(event)
+        elif name == "EXDATE":
+            exdates = self.event["EXDATE"]
+            for item in value.split(","):
+                t = parse_time(item)
+                if self.start is None or self.start - LONGEST_EVENT <= t < self.end:
+                    exdates.append(t)
+        else:
+            self.event[name] = value
+
+class Window:
+    """Busy (start, end) pairs overlapping [start, end) from a stream of parsed VEVENTs
+
+    Pass add as the parser's on_event. Recurring events are expanded only
+    within the window. A modified instance (RECURRENCE-ID) replaces the
+    occurrence it overrides, whether it comes before or after its master in
+    the feed. Cancelled and transparent events are not busy. Only events in
+    the window are kept, so memory follows the window, not the feed.
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.busy = []  # Single events and modified instances
+        self.occurrences = []  # (uid hash, occurrence start, end) expanded from recurring events
+        self.overrides = set()  # (uid hash, occurrence start) replaced by a modified instance
+        self.skipped = 0
+
+    def add(self, event):
+        try:
+            self._add(event)
+        except (KeyError, ValueError, IndexError):
+            self.skipped += 1
+
+    def _add(self, event):
+        value = event["DTSTART"]
+        start = parse_time(value)
+        if "DTEND" in event:
+            end = parse_time(event["DTEND"])
+        elif "DURATION" in event:
+            end = start + parse_duration(event["DURATION"])
+        else:
+            # A date lasts the day, a date-time without an end is an instant
+            end = start + (86400 if len(value) == 8 else 0)
+        uid = hash(event.get("UID", ""))
+        free = event.get("STATUS", "").upper() == "CANCELLED" or event.get("TRANSP", "").upper() == "TRANSPARENT"
+
+        if "RECURRENCE-ID" in event:
+            occurrence = parse_time(event["RECURRENCE-ID"])
+            if self.start - LONGEST_EVENT <= occurrence < self.end:
+                self.overrides.add((uid, occurrence))
+            if not free and start < self.end and end > self.start:
+                self.busy.append((start, end))
+            return
+        if free:
+            return
+        if "RRULE" not in event:
+            if start < self.end and end > self.start:
+                self.busy.append((start, end))
+            return
+
+        rule = parse_rule(event["RRULE"])
+        shift = _local_shift(value)
+        until = None
+        if rule.get("UNTIL"):
+            until = parse_time(rule["UNTIL"]) + shift
+            if len(rule["UNTIL"]) == 8:
+                until += 86399  # The whole last day
+        duration = end - start
+        exdates = event["EXDATE"]
+        for t in occurrences(start + shift, rule, self.start - duration + 1 + shift, self.end + shift, until):
+            t -= shift
+            if t not in exdates:
+                self.occurrences.append((uid, t, t + duration))
+
+    def intervals(self):
+        """Busy (start, end) pairs in the window"""
+        busy = list(self.busy)
+        overrides = self.overrides
+        for uid, start, end in self.occurrences:
+            if (uid, start) not in overrides:
+                busy.append((start, end))
+        return busy
+
+def _unescape(data):
+    """Undo the XML escaping of calendar-data text"""
+    if b"&" not in data:
+        return data
+    for entity, ch in ((b"&lt;", b"<"), (b"&gt;", b">"), (b"&quot;", b'"'), (b"&apos;", b"'"),
+                       (b"&#13;", b"\r"), (b"&#xD;", b"\r"), (b"&#10;", b"\n"), (b"&#xA;", b"\n"),
+                       (b"&amp;", b"&")):
+        data = data.replace(entity, ch)
+    return data
+
+class MultistatusReader:
+    """Passes the calendar-data of a streamed CalDAV multistatus response to an ICSParser
+
+    Only the text of calendar-data elements goes through, with XML entities
+    and CDATA sections undone; the rest of the XML is skipped. A short tail
+    is carried between chunks so tags and entities may be split anywhere.
+    """
+    def __init__(self, parser):
+        self.parser = parser
+        self.inside = False
+        self.cdata = False
+        self.carry = b""
+
+    def feed(self, chunk):
+        data = self.carry + bytes(chunk)
+        self.carry = b""
+        i = 0
+        n = len(data)
+        parser = self.parser
+        while i < n:
+            if not self.inside:
+                j = data.find(b"calendar-data", i)
+                k = data.find(b">", j) if j >= 0 else -1
+                if k < 0:
+                    # Keep enough for a tag split across chunks
+                    self.carry = data[max(i, n - 32) if j < 0 else max(i, j - 16):]
+                    return
+                lt = data.rfind(b"<", i, j)
+                i = k + 1
+                if (lt >= 0 and data[lt + 1] == 0x2F) or data[k - 1] == 0x2F:
+                    continue  # Closing or empty element
+                self.inside = True
+            elif self.cdata:
+                j = data.find(b"]]>", i)
+                if j < 0:
+                    parser.feed(data[i:max(i, n - 2)])
+                    self.carry = data[max(i, n - 2):]
+                    return
+                parser.feed(data[i:j])
+                self.cdata = False
+                i = j + 3
+            else:
+                j = data.find(b"<", i)
+                if j < 0:
+                    text = data[i:]
+                    amp = text.rfind(b"&")
+                    if amp >= 0 and text.find(b";", amp) < 0:
+                        self.carry = text[amp:]
+                        text = text[:amp]
+                    parser.feed(_unescape(text))
+                    return
+                parser.feed(_unescape(data[i:j]))
+                if n - j < 9:
+                    self.carry = data[j:]
+                    return
+                if data[j:j + 9] == b"<![CDATA[":
+                    self.cdata = True
+                    i = j + 9
+                else:
+                    # End of this calendar object; make sure its last line is terminated
+                    parser.feed(b"\n")
+                    self.inside = False
+                    i = j
+
+def _resolve_url(base, location):
+    """Absolute URL for a Location header, which may be relative to the URL it came from"""
+    if "://" in location:
+        return location
+    scheme, _, rest = base.partition("://")
+    if location.startswith("//"):
+        return scheme + ":" + location
+    host = rest.split("/", 1)[0]
+    if location.startswith("/"):
+        return "%s://%s%s" % (scheme, host, location)
+    path = rest[len(host):].split("?", 1)[0]
+    return "%s://%s%s%s" % (scheme, host, path[:path.rfind("/") + 1] or "/", location)
+
+def _origin(url):
+    """Scheme and host[:port] of an absolute URL"""
+    scheme, _, rest = url.partition("://")
+    return scheme.lower(), rest.split("/", 1)[0].split("?", 1)[0].lower()
+
+def _basic_auth(user, password):
+    return "Basic " + binascii.b2a_base64(("%s:%s" % (user, password)).encode()).decode().strip()
+
+class ICSFeed:
+    """Calendar source reading an iCalendar feed, or a CalDAV calendar, over HTTP
+
+    A feed is a URL, or a dict with "url" and optionally "caldav", "user",
+    "password" and, in hub mode, "groups". A plain feed is fetched with GET
+    and streamed through the parser, so megabyte feeds never sit in RAM; a
+    CalDAV calendar is asked with a calendar-query REPORT for just the events
+    in the window. The password is only ever sent to the feed's own origin.
+    Each download covers twice the requested window, and the result is
+    reused while it still covers the window and is younger than
+    ICS_REFRESH_INTERVAL, or when the server answers 304 to its ETag.
+    """
+    def __init__(self, feed, http, logger):
+        if isinstance(feed, str):
+            feed = {"url": feed}
+        url = feed["url"]
+        if url.startswith("webcal://"):
+            url = "https://" + url[9:]
+        self.url = url
+        self.caldav = feed.get("caldav", False)
+        self.groups = feed.get("groups")  # Hub groups this feed is merged into; None means every group
+        self.http = http
+        self.logger = logger
+        self.name = url.split("/")[2]  # Host only: feed paths often embed a secret
+        self.headers = {}
+        if feed.get("user"):
+            self.headers["Authorization"] = _basic_auth(feed["user"], feed.get("password", ""))
+        self.etag = None
+        self.cached = None  # Intervals from the last download
+        self.covered = 0  # End of the window they cover
+        self.fetched = 0
+        self.stats = {"downloads": 0, "not_modified": 0, "events": 0, "skipped": 0, "truncated": 0}
+
+    def _sink(self, parser):
+        if not metrics.enabled:
+            return parser.feed
+
+        def feed(chunk):
+            started = metrics.start()
+            parser.feed(chunk)
+            metrics.record("ics_parse", started)
+        return feed
+
+    async def _download(self, start, end, window, revalidate):
+        """Stream the feed into window; returns the HTTP status"""
+        parser = ICSParser(window.add, start, end)
+        headers = dict(self.headers)
+        if self.caldav:
+            headers["Depth"] = "1"
+            headers["Content-Type"] = "application/xml; charset=utf-8"
+            body = CALDAV_QUERY % (_caldav_time(start), _caldav_time(end))
+            sink = self._sink(MultistatusReader(parser))
+        else:
+            if self.etag and revalidate:
+                headers["If-None-Match"] = self.etag
+            body = None
+            sink = self._sink(parser)
+        url = self.url
+        method = "REPORT" if self.caldav else "GET"
+        for _ in range(MAX_REDIRECTS + 1):
+            response = await self.http.request(method, url, data=body, headers=headers, sink=sink)
+            location = response.header("Location")
+            status = response.status_code
+            if status not in (301, 302, 303, 307, 308) or not location:
+                break
+            target = _resolve_url(url, location)
+            if _origin(target) != _origin(url):
+                # Never hand the feed's credentials to another scheme, host or port
+                headers.pop("Authorization", None)
+            url = target
+            if status in (301, 308):
+                if _origin(url) == _origin(self.url):
+                    self.url = url  # Moves to another origin are followed each time, without credentials
+            elif status == 303 and method != "GET":
+                # See Other: the result is fetched with a plain GET
+                method = "GET"
+                body = None
+                headers.pop("Content-Type", None)
+                headers.pop("Depth", None)
+        parser.close()
+        if response.status_code == 200 and not self.caldav:
+            self.etag = response.header("ETag")
+        self.stats["events"] += parser.count
+        self.stats["truncated"] += parser.truncated
+        return response.status_code
+
+    async def fetch(self, start, end):
+        """Busy (start, end) pairs overlapping [start, end), or None if the feed could not be read"""
+        if self.cached is not None and end <= self.covered and start - self.fetched < config.ICS_REFRESH_INTERVAL:
+            return self._clip(start, end)
+        span_end = start + 2 * (end - start)
+        window = Window(start, span_end)
+        started = metrics.start()
+        try:
+            # A 304 only helps while the last download still covers the window
+            status = await self._download(start, span_end, window, self.cached is not None and end <= self.covered)
+        except Exception as e:
+            self.logger.error("Error reading calendar feed %s: %s", self.name, e)
+            return None
+        metrics.record("ics_fetch", started)
+        if status == 304 and end <= self.covered:
+            self.stats["not_modified"] += 1
+            self.fetched = start
+            return self._clip(start, end)
+        if status not in (200, 207):
+            self.logger.error("Error reading calendar feed %s: %s", self.name, status)
+            return None
+        self.stats["downloads"] += 1
+        self.stats["skipped"] += window.skipped
+        self.cached = window.intervals()
+        self.covered = span_end
+        self.fetched = start
+        self.logger.debug("Found %s busy intervals in calendar feed %s", len(self.cached), self.name)
+        return self._clip(start, end)
+
+    def _clip(self, start, end):
+        return [v for v in self.cached if v[0] < end and v[1] > start]
+
+def _caldav_time(timestamp):
+    days, secs = divmod(int(timestamp), 86400)
+    y, m, d = civil_from_days(days)
+    return "%04d%02d%02dT%02d%02d%02dZ" % (y, m, d, secs // 3600, secs // 60 % 60, secs % 60)
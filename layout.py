@@ -0,0 +1,103 @@
+from array import array
+import config
+
+# Largest number of cached rectangle span lists per layout; cleared when full
+SPAN_CACHE_SIZE = 64
+
+class PanelLayout:
+    """Maps logical (x, y) pixels of a grid of chained panels to positions on the LED chain
+
+    Panels are panel_width x panel_height as mounted and are chained left to
+    right, then top to bottom. Within a panel the LEDs run along rows, every
+    other row reversed when serpentine, and the whole wiring is rotated
+    clockwise by rotation degrees. A column-wired 32x8 strip panel is a
+    serpentine panel rotated by 90 or 270.
+
+    The mapping is computed once into an index array. Rectangles are
+    resolved to sorted, contiguous runs of chain positions, cached, so a
+    solid fill is a handful of slice copies whatever the wiring.
+    """
+    def __init__(self, panel_width=None, panel_height=None, panels_x=None, panels_y=None,
+                 serpentine=None, rotation=None):
+        self.panel_width = panel_width or config.PANEL_WIDTH
+        self.panel_height = panel_height or config.PANEL_HEIGHT
+        self.panels_x = panels_x or config.PANELS_X
+        self.panels_y = panels_y or config.PANELS_Y
+        self.serpentine = config.PANEL_SERPENTINE if serpentine is None else serpentine
+        self.rotation = config.PANEL_ROTATION if rotation is None else rotation
+        if self.rotation not in (0, 90, 180, 270):
+            raise ValueError("Panel rotation must be 0, 90, 180 or 270")
+        self.width = self.panel_width * self.panels_x
+        self.height = self.panel_height * self.panels_y
+        self.index = array("H", bytes(2 * self.width * self.height))  # y * width + x -> chain position
+        self._spans = {}
+        self._build()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _build(self):
+        pw = self.panel_width
+        ph = self.panel_height
+        # Wiring dimensions before rotation
+        if self.rotation in (90, 270):
+            nw, nh = ph, pw
+        else:
+            nw, nh = pw, ph
+        per_panel = pw * ph
+        index = self.index
+        width = self.width
+        for panel in range(self.panels_x * self.panels_y):
+            left = (panel % self.panels_x) * pw
+            top = (panel // self.panels_x) * ph
+            for k in range(per_panel):
+                r, c = divmod(k, nw)
+                if self.serpentine and r & 1:
+                    c = nw - 1 - c
+                x, y = self._rotate(c, r, nw, nh)
+                index[(top + y) * width + left + x] = panel * per_panel + k
+
+    def _rotate(self, c, r, nw, nh):
+        """Mounted (x, y) of wiring column c, row r"""
+        rotation = self.rotation
+        if rotation == 0:
+            return c, r
+        if rotation == 90:
+            return nh - 1 - r, c
+        if rotation == 180:
+            return nw - 1 - c, nh - 1 - r
+        return r, nw - 1 - c
+
+    def position(self, x, y):
+        """Chain position of the pixel at x, y"""
+        return self.index[y * self.width + x]
+
+    def spans(self, x, y, w, h):
+        """(first position, count) runs covering a rectangle already clipped to the layout"""
+        key = (x, y, w, h)
+        spans = self._spans.get(key)
+        if spans is None:
+            index = self.index
+            width = self.width
+            positions = sorted(index[row * width + col] for row in range(y, y + h) for col in range(x, x + w))
+            runs = []
+            start = prev = None
+            for p in positions:
+                if p - 1 != prev:
+                    if start is not None:
+                        runs.append((start, prev - start + 1))
+                    start = p
+                prev = p
+            if start is not None:
+                runs.append((start, prev - start + 1))
+            if len(self._spans) >= SPAN_CACHE_SIZE:
+                self._spans.clear()
+            spans = self._spans[key] = tuple(runs)
+        return spans
+
+    def column_mask(self, col):
+        """One byte per chain position, 1 where the LED is in logical column col"""
+        mask = bytearray(len(self.index))
+        for y in range(self.height):
+            mask[self.index[y * self.width + col]] = 1
+        return mask
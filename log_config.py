@@ -1,22 +1,151 @@
-import logging
-
-def setup_logging():
-    """Configure logging with safe defaults"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
-    # Create loggers for each module
-    loggers = {
-        'calendar': logging.getLogger('calendar'),
-        'neopixel': logging.getLogger('neopixel'),
-        'time': logging.getLogger('time'),
-        'main': logging.getLogger('main')
-    }
-    
+import re
+import time
+import config
+import hal
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+# Redaction rules: (literal that must appear, compiled pattern, replacement).
+# The literal is a cheap substring test so most records skip the regexes.
+# Patterns avoid {m,n} repeats, which MicroPython's re does not support.
+SENSITIVE_PATTERNS = [
+    ("client_email", re.compile(r'client_email": *"[^"]+'), 'client_email":"[REDACTED]'),
+    ("private_key", re.compile(r'private_key": *"[^"]+'), 'private_key":"[REDACTED]'),
+    ("refresh_token", re.compile(r'refresh_token": *"[^"]+'), 'refresh_token":"[REDACTED]'),
+    ("access_token", re.compile(r'access_token": *"[^"]+'), 'access_token":"[REDACTED]'),
+    ("Bearer", re.compile(r'Bearer [^" ]+'), 'Bearer [REDACTED]'),
+    # Email addresses; consecutive dots never match, so already shortened
+    # calendar IDs ("abc...@group.calendar.google.com") stay readable
+    ("@", re.compile(r'[a-zA-Z0-9_%+-]+(\.[a-zA-Z0-9_%+-]+)*@[a-zA-Z0-9-]+(\.[a-zA-Z0-9-]+)*\.[a-zA-Z][a-zA-Z]+'), '[EMAIL_REDACTED]'),
+]
+
+class ConsoleSink:
+    """Print records to the serial console / stdout"""
+    def write(self, level, line):
+        print(line)
+
+class RingSink:
+    """Keep the most recent records in RAM, optionally flushing them to flash in batches
+
+    Records are appended to a fixed-size list of slots. With a path set, lines
+    are written out every flush_lines records (and immediately for errors), so
+    flash sees a few larger writes instead of one per record. The file is
+    rotated to <path>.1 once it grows past max_bytes.
+    """
+    def __init__(self, size=None, path=None, flush_lines=None, max_bytes=None):
+        self.size = size or config.LOG_RING_SIZE
+        self.path = path
+        self.flush_lines = flush_lines or config.LOG_FLUSH_LINES
+        self.max_bytes = max_bytes or config.LOG_FILE_MAX_BYTES
+        self.slots = [None] * self.size
+        self.pos = 0
+        self.pending = 0  # Records not yet flushed to flash
+        self.dropped = 0  # Records overwritten before they were flushed
+
+    def write(self, level, line):
+        self.slots[self.pos] = line
+        self.pos = (self.pos + 1) % self.size
+        if self.path:
+            if self.pending == self.size:
+                self.dropped += 1
+            else:
+                self.pending += 1
+            if self.pending >= self.flush_lines or level >= ERROR:
+                self.flush()
+
+    def lines(self, count=None):
+        """Buffered records, oldest first"""
+        ordered = self.slots[self.pos:] + self.slots[:self.pos]
+        ordered = [line for line in ordered if line is not None]
+        return ordered[-count:] if count else ordered
+
+    def flush(self):
+        """Append records not yet on flash to the log file"""
+        if not self.path or not self.pending:
+            return
+        batch = self.lines(self.pending)
+        self.pending = 0
+        try:
+            self._rotate()
+            with open(self.path, "a") as f:
+                f.write("\n".join(batch) + "\n")
+        except OSError as e:
+            print(f"Log flush failed: {e}")
+
+    def _rotate(self):
+        try:
+            import os
+            if os.stat(self.path)[6] >= self.max_bytes:
+                os.rename(self.path, self.path + ".1")
+        except OSError:
+            pass
+
+class Logger:
+    """Small leveled logger with %-style arguments formatted only when a record is emitted
+
+    Messages below the level cost one comparison, so debug calls can stay in
+    hot paths. Emitted records are sanitised before reaching the sinks.
+    """
+    def __init__(self, name, level, sinks):
+        self.name = name
+        self.level = level
+        self.sinks = sinks
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+    def debug(self, msg, *args):
+        if self.level <= DEBUG:
+            self._emit(DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        if self.level <= INFO:
+            self._emit(INFO, msg, args)
+
+    def warning(self, msg, *args):
+        if self.level <= WARNING:
+            self._emit(WARNING, msg, args)
+
+    def error(self, msg, *args):
+        if self.level <= ERROR:
+            self._emit(ERROR, msg, args)
+
+    def _emit(self, level, msg, args):
+        if args:
+            try:
+                msg = msg % args
+            except (TypeError, ValueError):
+                msg = f"{msg} {args}"
+        t = time.localtime(hal.clock())  # The hal clock, so simulated runs log simulated time
+        line = "%04d-%02d-%02d %02d:%02d:%02d - %s - %s - %s" % (
+            t[0], t[1], t[2], t[3], t[4], t[5], self.name, LEVEL_NAMES[level], sanitize(msg))
+        for sink in self.sinks:
+            sink.write(level, line)
+
+def setup_logging(level=None, ring=None):
+    """Create the module loggers sharing a console sink and a RAM ring
+
+    Returns a dict of loggers; the ring sink is available as loggers['ring'].
+    """
+    level = level if level is not None else LEVELS[config.LOG_LEVEL]
+    ring = ring or RingSink(path=config.LOG_FILE)
+    sinks = [ConsoleSink(), ring]
+    loggers = {name: Logger(name, level, sinks) for name in ('calendar', 'neopixel', 'time', 'main')}
+    loggers['ring'] = ring
     return loggers
 
+def sanitize(text):
+    """Redact credentials, tokens and email addresses from a log message"""
+    for hint, pattern, replacement in SENSITIVE_PATTERNS:
+        if hint in text:
+            text = pattern.sub(replacement, text)
+    return text
+
 def sanitize_calendar_id(calendar_id):
     """Sanitize calendar ID for logging"""
     if not calendar_id:
@@ -28,19 +157,4 @@ def sanitize_calendar_id(calendar_id):
 
 def sanitize_error(error):
     """Sanitize error messages that might contain sensitive data"""
-    error_str = str(error)
-    # List of patterns to sanitize
-    sensitive_patterns = [
-        (r'client_email":"[^"]+', 'client_email":"[REDACTED]'),
-        (r'private_key":"[^"]+', 'private_key":"[REDACTED]'),
-        (r'refresh_token":"[^"]+', 'refresh_token":"[REDACTED]'),
-        (r'access_token":"[^"]+', 'access_token":"[REDACTED]'),
-        (r'Bearer [^"]+', 'Bearer [REDACTED]'),
-        # Add email pattern
-        (r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', '[EMAIL_REDACTED]'),
-    ]
-    
-    for pattern, replacement in sensitive_patterns:
-        error_str = error_str.replace(pattern, replacement)
-    
-    return error_str 
\ No newline at end of file
+    return sanitize(str(error))
@@ -1,104 +1,441 @@
-import network
 import time
-from machine import Pin
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # CPython
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+# Taken before the other imports so boot-to-first-frame includes them
+BOOT_TICKS = ticks_ms()
+
+import asyncio
 import config
+import hal
 from neopixel import NeoPixel
-from calendar_api import CalendarAPI
 from time_manager import TimeManager
+from schedule_cache import ScheduleCache
+from animation import Animator, pulse, breathe
+from text import Marquee, GLYPH_HEIGHT
+from power import PowerGovernor
 from log_config import setup_logging
+from metrics import metrics, serve as serve_metrics
+# calendar_api, scheduler, watch and hub_client are imported in run() after
+# the first frame: they pull in JWT signing, the HTTP client and JSON parsing
+
+boot_frame_ms = None  # Milliseconds from boot to the first frame showing real status
+marquee = None  # Scrolling status text, when SCROLL_TEXT is on
+governor = None  # Brightness limits and light sleep
 
-def connect_wifi():
-    """Connect to WiFi network"""
+class DeviceState:
+    """State shared between the runtime tasks"""
+    def __init__(self):
+        self.online = False
+        self.time_synced = False
+        self.calendar_ok = False
+        self.schedule_until = 0  # End of the window the local schedule is known to cover
+        self.faults = set()  # Names of the subsystems currently failing
+        self.changed = asyncio.Event()  # Set to wake the renderer
+        
+    def notify(self):
+        """Ask the renderer to redraw"""
+        self.changed.set()
+        
+    def set_fault(self, source, failed):
+        """Record or clear a failure reported by one subsystem"""
+        if failed:
+            self.faults.add(source)
+        else:
+            self.faults.discard(source)
+        self.notify()
+
+async def network_supervisor(state):
+    """Keep WiFi connected without blocking the other tasks"""
     logger = loggers['main']
-    wlan = network.WLAN(network.STA_IF)
+    wlan = hal.wlan()
     wlan.active(True)
-    if not wlan.isconnected():
-        logger.info('Connecting to WiFi...')
-        wlan.connect(config.WIFI_SSID, config.WIFI_PASSWORD)
-        while not wlan.isconnected():
-            time.sleep(1)
-    logger.info('WiFi connected!')
-    logger.debug(f'Network config: {wlan.ifconfig()}')
+    while True:
+        if not wlan.isconnected():
+            if state.online:
+                logger.warning("WiFi connection lost")
+                metrics.incr("wifi_disconnects")
+                state.online = False
+            logger.info('Connecting to WiFi...')
+            started = metrics.start()
+            wlan.connect(config.WIFI_SSID, config.WIFI_PASSWORD)
+            deadline = hal.clock() + config.WIFI_CONNECT_TIMEOUT
+            while not wlan.isconnected() and hal.clock() < deadline:
+                await asyncio.sleep(0.25)
+            if not wlan.isconnected():
+                logger.error("WiFi connection failed")
+                metrics.incr("wifi_failures")
+                state.set_fault("wifi", True)
+                await asyncio.sleep(config.WIFI_RETRY_INTERVAL)
+                continue
+            metrics.record("wifi_connect", started)
+            logger.info('WiFi connected!')
+            logger.debug('Network config: %s', wlan.ifconfig())
+            state.online = True
+            state.set_fault("wifi", False)
+        await asyncio.sleep(config.WIFI_CHECK_INTERVAL)
 
-def main():
-    # Set up logging
-    global loggers
-    loggers = setup_logging()
+async def time_sync_task(state, time_manager):
+    """Initial NTP sync, then resyncs on the drift-adapted interval"""
+    logger = loggers['main']
+    governor.busy("ntp")
+    while True:
+        if not state.online:
+            await asyncio.sleep(1)
+            continue
+        if await time_manager.ensure_time_synced():
+            if not state.time_synced:
+                state.time_synced = True
+                state.set_fault("time", False)
+        elif not state.time_synced:
+            logger.error("Initial time sync failed")
+            # An RTC that survived the reset, or an HTTP Date header, keeps things running
+            state.set_fault("time", not time_manager.clock_valid())
+        else:
+            logger.warning("Time sync failed")
+        delay = max(1, time_manager.seconds_until_sync())
+        governor.idle("ntp", time_manager.get_utc_timestamp() + delay)
+        await asyncio.sleep(delay)
+        governor.busy("ntp")
+
+async def calendar_fetcher(state, calendar, scheduler, time_manager, cache, watcher=None):
+    """Refetch calendars on the scheduler's cadence, and changed ones when notified"""
+    logger = loggers['main']
+    governor.busy("fetch")
+    waited = 0
+    while True:
+        if not state.online:
+            await asyncio.sleep(1)
+            continue
+        if not (state.time_synced or time_manager.clock_valid()):
+            # NTP is slow or blocked: the Date header of an HTTPS response will do to start with
+            if waited >= config.DATE_FALLBACK_DELAY and await calendar.probe_time() and time_manager.clock_valid():
+                state.set_fault("time", False)
+                continue
+            waited += 1
+            await asyncio.sleep(1)
+            continue
+        now = time_manager.get_utc_timestamp()
+        dirty = None
+        if watcher and (scheduler.refresh_due(now) or not scheduler.failures):
+            # A scheduled poll covers every calendar; otherwise sync only what changed
+            dirty = watcher.take_dirty()
+            if scheduler.refresh_due(now):
+                dirty = None
+        if scheduler.refresh_due(now) or dirty:
+            logger.debug("Checking calendar status")
+            started = metrics.start()
+            ok = await calendar.refresh(dirty=dirty)
+            metrics.record("calendar_refresh", started)
+            pushed = watcher is not None and watcher.all_covered(now)
+            scheduler.refreshed(now, ok, calendar.changed, pushed, None if ok else calendar.retry_at(now))
+            state.calendar_ok = ok
+            if ok:
+                state.schedule_until = now + config.CALENDAR_LOOKAHEAD
+                cache.save(calendar.timeline, now)
+            else:
+                logger.error("Failed to get calendar status")
+            state.set_fault("calendar", not ok)
+            
+        # Sign a fresh token between fetches, not when the next fetch needs it
+        await calendar.prefetch_token()
+        timeout = max(1, scheduler.next_refresh - time_manager.get_utc_timestamp())
+        governor.idle("fetch", scheduler.next_refresh)
+        # After a failure, notifications wait for the backed-off retry, which refetches everything
+        if watcher and not scheduler.failures:
+            try:
+                await asyncio.wait_for(watcher.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(timeout)
+        governor.busy("fetch")
+
+async def watcher_task(state, watcher):
+    """Keep push channels open once the network and clock are up"""
+    while not (state.online and state.time_synced and state.calendar_ok):
+        await asyncio.sleep(1)
+    await watcher.run()
+
+async def renderer(state, calendar, scheduler, time_manager, led_matrix, animator):
+    """Redraw on state changes and at each scheduled display transition"""
     logger = loggers['main']
     
+    # Progress indicator column (using rightmost column)
+    progress_column = config.MATRIX_WIDTH - 1
+    governor.busy("render")
+    
+    while True:
+        state.changed.clear()
+        now = time_manager.get_utc_timestamp()
+        timeout = None
+        started = metrics.start()
+        try:
+            # The known schedule stays accurate through WiFi and API outages until its window runs out
+            known = now < state.schedule_until and time_manager.clock_valid()
+            if known:
+                if state.faults:
+                    logger.warning("Showing last known schedule while %s is failing", ", ".join(sorted(state.faults)))
+                render_status(led_matrix, animator, calendar.status_at(now), progress_column)
+                first_frame("live" if calendar.last_refresh else "cache")
+                transition = scheduler.next_transition(now)
+                if transition is None or transition > state.schedule_until:
+                    transition = state.schedule_until
+                timeout = transition - time_manager.get_utc_timestamp()
+            elif state.faults or state.schedule_until:
+                # Failing with nothing to fall back on, or the known schedule ran out
+                show_error(led_matrix, animator)
+        except Exception as e:
+            logger.error("Error in renderer: %s", e)
+            show_error(led_matrix, animator)
+        metrics.record("render", started)
+        
+        # Redraw at the working-hours boundary too, for the brightness change
+        change = governor.next_change(now) - now
+        if timeout is None or change < timeout:
+            timeout = change
+        governor.idle("render", now + timeout)
+        try:
+            if timeout > 0:
+                logger.debug("Next display transition in %.1f seconds", timeout)
+                await asyncio.wait_for(state.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        governor.busy("render")
+
+async def hub_receiver(state, client, led_matrix, animator):
+    """Client mode: render status frames pushed by the hub"""
+    logger = loggers['main']
+    progress_column = config.MATRIX_WIDTH - 1
+    while True:
+        if not state.online:
+            await asyncio.sleep(1)
+            continue
+        frame = await client.receive(config.HUB_TIMEOUT)
+        try:
+            if frame is None:
+                logger.error("No status from hub for %s seconds", config.HUB_TIMEOUT)
+                state.set_fault("hub", True)
+                show_error(led_matrix, animator)
+                continue
+            status, fault = frame
+            state.set_fault("hub", False)
+            if fault:
+                show_error(led_matrix, animator)
+            else:
+                render_status(led_matrix, animator, status, progress_column)
+                first_frame("hub")
+        except Exception as e:
+            logger.error("Error in renderer: %s", e)
+            show_error(led_matrix, animator)
+
+def first_frame(source):
+    """Report how long after boot the first real status frame appeared, once"""
+    global boot_frame_ms
+    if boot_frame_ms is not None:
+        return
+    boot_frame_ms = ticks_diff(ticks_ms(), BOOT_TICKS)
+    metrics.set("boot_first_frame_ms", boot_frame_ms)
+    loggers['main'].info("First status frame %s ms after boot (%s)", boot_frame_ms, source)
+
+async def text_scroller(led_matrix):
+    """Advance scrolling text at TEXT_FPS, counting frames that overrun FRAME_BUDGET_MS"""
+    frame_ms = 1000 // config.TEXT_FPS
+    while True:
+        spent = 0
+        if marquee.scrolling():
+            started = ticks_ms()
+            marquee.draw()
+            led_matrix.show()
+            spent = ticks_diff(ticks_ms(), started)
+            metrics.add("text_frame", spent * 1000)
+            if spent > config.FRAME_BUDGET_MS:
+                metrics.incr("frames_over_budget")
+        await asyncio.sleep(max(0, frame_ms - spent) / 1000)
+
+def status_text(status):
+    """Short message for a status tuple, e.g. 'Free for 25m'"""
+    is_busy, remaining_minutes, next_meeting_in = status
+    if is_busy:
+        return "Busy for " + format_minutes(remaining_minutes)
+    if next_meeting_in is not None:
+        return "Free for " + format_minutes(next_meeting_in)
+    return "Free"
+
+def format_minutes(minutes):
+    if minutes < 60:
+        return "%dm" % minutes
+    return "%dh%02dm" % (minutes // 60, minutes % 60)
+
+def present(led_matrix, animator, effect=None):
+    """Show the frame just drawn, fading to it when animation is enabled"""
+    if governor:
+        governor.update()
+    if animator:
+        animator.commit(effect)
+    else:
+        led_matrix.show()
+
+def show_error(led_matrix, animator):
+    """Switch the whole matrix to the error colour"""
+    if animator:
+        animator.begin()
+    if governor:
+        governor.begin()
+    if marquee:
+        marquee.clear()
+    led_matrix.fill(config.COLOR_ERROR, show=False)
+    present(led_matrix, animator, breathe())
+
+def render_status(led_matrix, animator, status, progress_column):
+    """Draw busy/free state and the progress column for a status tuple"""
+    logger = loggers['main']
+    is_busy, remaining_minutes, next_meeting_in = status
+    effect = None
+    if animator:
+        animator.begin()
+    if governor:
+        governor.begin()
+    
+    # Update main display (all columns except progress column)
+    main_color = config.COLOR_BUSY if is_busy else config.COLOR_FREE
+    led_matrix.fill_except_column(main_color, progress_column)
+    
+    # Update progress column based on status
+    if is_busy and remaining_minutes > 0:
+        # Show remaining time in current meeting
+        led_matrix.set_progress_column(progress_column, remaining_minutes)
+        logger.info("Busy: %s minutes remaining", remaining_minutes)
+    elif not is_busy and next_meeting_in is not None:
+        # Show countdown to next meeting
+        led_matrix.set_next_meeting_column(progress_column, next_meeting_in)
+        logger.info("Available: Next meeting in %s minutes", next_meeting_in)
+        if next_meeting_in < config.ANIMATION_WARNING_MINUTES:
+            effect = pulse(progress_column)
+    else:
+        # No current or upcoming meetings
+        led_matrix.fill_rect(progress_column, 0, 1, led_matrix.height, config.COLOR_OFF)
+        logger.info("Available: No upcoming meetings")
+    
+    if marquee:
+        marquee.set(status_text(status), config.COLOR_TEXT_ON_BUSY if is_busy else config.COLOR_TEXT_ON_FREE, main_color)
+        marquee.draw()
+    
+    # Show the updates
+    present(led_matrix, animator, effect)
+
+async def run():
+    global marquee, governor
+    logger = loggers['main']
     logger.info("Starting Busy Light")
     
     # Initialize LED matrix
     led_matrix = NeoPixel(config.LED_PIN, config.LED_COUNT, config.LED_BRIGHTNESS)
-    led_matrix.fill(config.COLOR_UPDATING)  # Blue while starting up
     logger.info("LED matrix initialized")
+    state = DeviceState()
+    governor = PowerGovernor(led_matrix, loggers['main'])
+    tasks = [governor.run()]
+    if config.SCROLL_TEXT:
+        marquee = Marquee(led_matrix, 0, (led_matrix.height - GLYPH_HEIGHT) // 2, led_matrix.width - 1)
+        tasks.append(text_scroller(led_matrix))
     
-    # Progress indicator column (using rightmost column)
-    PROGRESS_COLUMN = config.MATRIX_WIDTH - 1
-    
-    # Connect to WiFi
-    try:
-        connect_wifi()
-    except Exception as e:
-        logger.error(f"WiFi connection failed: {str(e)}")
-        led_matrix.fill(config.COLOR_ERROR)
+    if config.HUB_CLIENT_MODE:
+        # No tokens, NTP or calendar requests on the light; the hub does all of that
+        from hub_client import HubClient
+        led_matrix.fill(config.COLOR_UPDATING)  # Blue while starting up
+        animator = start_animator(led_matrix)
+        governor.animating = lambda: animating(animator)
+        logger.info("Hub client mode, starting tasks")
+        await asyncio.gather(
+            network_supervisor(state),
+            hub_receiver(state, HubClient(loggers['main']), led_matrix, animator),
+            *tasks
+        )
         return
     
-    # Initialize time manager and sync time
+    # Paint the last known schedule straight away if the RTC survived the reset
     time_manager = TimeManager(loggers['time'])
-    if not time_manager.sync_time():
-        logger.error("Initial time sync failed")
-        led_matrix.fill(config.COLOR_ERROR)
-        return
+    cache = ScheduleCache(loggers['main'])
+    timeline = None
+    if config.FAST_BOOT and time_manager.clock_valid():
+        timeline = cache.load(time_manager.get_utc_timestamp())
+    if timeline is not None:
+        render_status(led_matrix, None, timeline.status(time_manager.get_utc_timestamp())[:3], config.MATRIX_WIDTH - 1)
+        first_frame("cache")
+    else:
+        led_matrix.fill(config.COLOR_UPDATING)  # Blue while starting up
+    animator = start_animator(led_matrix)
+    governor.animating = lambda: animating(animator)
     
-    # Initialize Calendar API with time manager
+    # Initialize Calendar API and scheduler
+    from calendar_api import CalendarAPI
+    from scheduler import Scheduler
     calendar = CalendarAPI(time_manager, loggers['calendar'])
+    scheduler = Scheduler(calendar, loggers['main'])
+    if timeline is not None:
+        calendar.timeline = timeline
+        state.calendar_ok = True
+        state.schedule_until = cache.until
+    watcher = None
+    if config.WATCH_ENABLED:
+        from watch import WatchManager
+        watcher = WatchManager(calendar, loggers['calendar'])
+        tasks.append(watcher_task(state, watcher))
     
-    logger.info("System initialized, entering main loop")
+    if metrics.enabled:
+        metrics.register("http", "counter", lambda: calendar.http.stats)
+        metrics.register("api", "counter", lambda: calendar.policy.stats)
+        metrics.register("token", "counter", lambda: {"refreshes": calendar.token_stats["refreshes"],
+                                                      "cache_hits": calendar.token_stats["cache_hits"]})
+        metrics.register("led", "counter", lambda: {"writes": led_matrix.writes,
+                                                    "skipped_writes": led_matrix.skipped_writes})
+        if animator:
+            metrics.register("animation", "counter", lambda: {"frames": animator.frames,
+                                                              "dropped_frames": animator.dropped_frames})
+        metrics.register("power", "gauge", lambda: {"led_ma": governor.led_ma,
+                                                    "average_mw": int(governor.average_mw()),
+                                                    "brightness_pct": int(led_matrix.brightness * 100),
+                                                    "sleep_seconds": governor.slept_ms // 1000})
+        metrics.register("state", "gauge", lambda: {"online": int(state.online),
+                                                    "calendar_ok": int(state.calendar_ok),
+                                                    "fault": int(bool(state.faults))})
+        await serve_metrics(logger)
     
-    while True:
-        try:
-            # Show updating status
-            led_matrix.fill(config.COLOR_UPDATING)
-            logger.debug("Checking calendar status")
-            
-            # Check calendar status
-            is_busy, remaining_minutes, next_meeting_in = calendar.get_calendar_status()
-            
-            if is_busy is None:
-                # Error occurred
-                logger.error("Failed to get calendar status")
-                led_matrix.fill(config.COLOR_ERROR)
-            else:
-                # Update main display (all columns except progress column)
-                main_color = config.COLOR_BUSY if is_busy else config.COLOR_FREE
-                led_matrix.fill_except_column(main_color, PROGRESS_COLUMN)
-                
-                # Update progress column based on status
-                if is_busy and remaining_minutes > 0:
-                    # Show remaining time in current meeting
-                    led_matrix.set_progress_column(PROGRESS_COLUMN, remaining_minutes)
-                    logger.info(f"Busy: {remaining_minutes} minutes remaining")
-                elif not is_busy and next_meeting_in is not None:
-                    # Show countdown to next meeting
-                    led_matrix.set_next_meeting_column(PROGRESS_COLUMN, next_meeting_in)
-                    logger.info(f"Available: Next meeting in {next_meeting_in} minutes")
-                else:
-                    # No current or upcoming meetings
-                    for y in range(config.MATRIX_HEIGHT):
-                        led_matrix.set_pixel_xy(PROGRESS_COLUMN, y, config.COLOR_OFF)
-                    logger.info("Available: No upcoming meetings")
-                
-                # Show the updates
-                led_matrix.show()
-                
-        except Exception as e:
-            logger.error(f"Error in main loop: {str(e)}")
-            led_matrix.fill(config.COLOR_ERROR)
-            
-        # Wait before next update
-        logger.debug(f"Waiting {config.UPDATE_INTERVAL} seconds before next update")
-        time.sleep(config.UPDATE_INTERVAL)
+    logger.info("System initialized, starting tasks")
+    await asyncio.gather(
+        network_supervisor(state),
+        time_sync_task(state, time_manager),
+        calendar_fetcher(state, calendar, scheduler, time_manager, cache, watcher),
+        renderer(state, calendar, scheduler, time_manager, led_matrix, animator),
+        *tasks
+    )
+
+def animating(animator):
+    """True while fades, effects or scrolling text need frames"""
+    return (animator is not None and animator.active()) or (marquee is not None and marquee.scrolling())
+
+def start_animator(led_matrix):
+    """Start the animation task if enabled; it fades on from what the LEDs show now"""
+    if not config.ANIMATION_ENABLED or config.SCROLL_TEXT:
+        # Scrolling text draws straight to the LEDs, so fades and effects are off
+        return None
+    animator = Animator(led_matrix, loggers['neopixel'])
+    asyncio.create_task(animator.run())
+    return animator
+
+def main():
+    # Set up logging
+    global loggers
+    loggers = setup_logging()
+    asyncio.run(run())
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -0,0 +1,216 @@
+import gc
+import time
+import asyncio
+from array import array
+import config
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    # CPython
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+PREFIX = "busylight_"
+QUANTILES = (0.5, 0.9, 0.99)
+# Shortest time between probes of the largest free heap block (in seconds)
+HEAP_PROBE_INTERVAL = 60
+
+class _Phase:
+    """Totals and a fixed-size ring of recent durations for one timed phase"""
+    def __init__(self, window):
+        self.samples = array("l", [0]) * window
+        self.pos = 0
+        self.filled = 0
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def add(self, us):
+        samples = self.samples
+        samples[self.pos] = us
+        self.pos = (self.pos + 1) % len(samples)
+        if self.filled < len(samples):
+            self.filled += 1
+        self.count += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    def recent(self):
+        """Sorted durations currently held in the ring"""
+        return sorted(self.samples[:self.filled])
+
+class Metrics:
+    """Phase timings, counters and gauges held in fixed-size buffers
+
+    Hot paths call start()/record() around a phase and incr() for events;
+    both are a dict lookup and a few integer operations. Values owned by
+    other objects (HTTP pool stats, LED write counts) are pulled through
+    collectors only when the metrics are scraped.
+    """
+    enabled = True
+
+    def __init__(self, window=None):
+        self.window = window or config.METRICS_WINDOW
+        self.phases = {}  # name -> _Phase
+        self.counters = {}
+        self.gauges = {}
+        self.collectors = []  # (prefix, kind, fn returning {name: value})
+        self.started = time.time()
+        self.probed = None  # time.time() of the last largest-block probe
+        self.largest = 0
+        self.fragmentation = 0
+
+    def start(self):
+        """Timestamp to pass to record() when the phase ends"""
+        return ticks_us()
+
+    def record(self, phase, started):
+        """Record the time since start() against a phase"""
+        self.add(phase, ticks_diff(ticks_us(), started))
+
+    def add(self, phase, us):
+        """Record a duration measured by the caller"""
+        entry = self.phases.get(phase)
+        if entry is None:
+            entry = self.phases[phase] = _Phase(self.window)
+        entry.add(us)
+
+    def incr(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def register(self, prefix, kind, fn):
+        """Export fn()'s {name: value} dict as '<prefix>_<name>' counters or gauges at scrape time"""
+        self.collectors.append((prefix, kind, fn))
+
+    def _probe(self):
+        """Find the largest free block with a binary search of allocations"""
+        gc.collect()
+        free = gc.mem_free()
+        low, high = 0, free
+        while high - low > 64:
+            size = (low + high) // 2
+            try:
+                block = bytearray(size)
+                del block
+                low = size
+            except MemoryError:
+                high = size
+        self.largest = low
+        self.fragmentation = 1 - low / free if free else 0
+
+    def _heap(self):
+        """Heap gauges; the largest free block is probed at most every HEAP_PROBE_INTERVAL
+
+        The probe collects and then allocates dozens of near-heap-sized
+        blocks inside the event loop, so frequent scrapes reuse its result.
+        """
+        if not hasattr(gc, "mem_free"):
+            return {}
+        now = time.time()
+        if self.probed is None or now - self.probed >= HEAP_PROBE_INTERVAL:
+            self._probe()
+            self.probed = now
+        return {
+            "heap_free_bytes": gc.mem_free(),
+            "heap_used_bytes": gc.mem_alloc(),
+            "heap_largest_free_bytes": self.largest,
+            "heap_fragmentation_ratio": self.fragmentation,
+        }
+
+    def render(self):
+        """All metrics in Prometheus text exposition format"""
+        lines = []
+        if self.phases:
+            lines.append(f"# TYPE {PREFIX}phase_seconds summary")
+            for name, phase in self.phases.items():
+                recent = phase.recent()
+                for q in QUANTILES:
+                    value = recent[min(len(recent) - 1, int(q * len(recent)))] if recent else 0
+                    lines.append(f'{PREFIX}phase_seconds{{phase="{name}",quantile="{q}"}} {value / 1e6}')
+                lines.append(f'{PREFIX}phase_seconds_sum{{phase="{name}"}} {phase.total_us / 1e6}')
+                lines.append(f'{PREFIX}phase_seconds_count{{phase="{name}"}} {phase.count}')
+            lines.append(f"# TYPE {PREFIX}phase_max_seconds gauge")
+            for name, phase in self.phases.items():
+                lines.append(f'{PREFIX}phase_max_seconds{{phase="{name}"}} {phase.max_us / 1e6}')
+
+        counters = dict(self.counters)
+        gauges = dict(self.gauges)
+        gauges.update(self._heap())
+        gauges["uptime_seconds"] = time.time() - self.started
+        for prefix, kind, fn in self.collectors:
+            target = counters if kind == "counter" else gauges
+            for name, value in fn().items():
+                target[f"{prefix}_{name}"] = value
+
+        for name, value in counters.items():
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+            lines.append(f"{PREFIX}{name}_total {value}")
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            lines.append(f"{PREFIX}{name} {value}")
+        lines.append("")
+        return "\n".join(lines)
+
+class NullMetrics:
+    """Stand-in used when metrics are disabled; every call is a no-op"""
+    enabled = False
+
+    def start(self):
+        return 0
+
+    def record(self, phase, started):
+        pass
+
+    def add(self, phase, us):
+        pass
+
+    def incr(self, name, n=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+    def register(self, prefix, kind, fn):
+        pass
+
+# Shared instance imported by the instrumented modules
+metrics = Metrics() if config.METRICS_ENABLED else NullMetrics()
+
+async def _handle(reader, writer, logger):
+    """Answer one scrape; the whole exchange is bounded by HTTP_TIMEOUT"""
+    try:
+        request = await asyncio.wait_for(reader.readline(), config.HTTP_TIMEOUT)
+        while True:
+            line = await asyncio.wait_for(reader.readline(), config.HTTP_TIMEOUT)
+            if not line or line == b"\r\n":
+                break
+        parts = request.decode().split(" ")
+        if len(parts) > 1 and parts[1].split("?")[0] == "/metrics":
+            status = "200 OK"
+            body = metrics.render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"Not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode())
+        writer.write(body)
+        await writer.drain()
+    except Exception as e:
+        logger.debug("Metrics request failed: %s", e)
+    finally:
+        writer.close()
+
+async def serve(logger, port=None):
+    """Serve /metrics on the given port alongside the other tasks"""
+    port = port or config.METRICS_PORT
+    server = await asyncio.start_server(lambda r, w: _handle(r, w, logger), "0.0.0.0", port)
+    logger.info("Metrics available at :%s/metrics", port)
+    return server
@@ -1,91 +1,256 @@
-from machine import Pin
-import neopixel
 import config
+import hal
+from layout import PanelLayout
+from metrics import metrics
+
+# Encoded colours kept per NeoPixel; cleared when it grows past this
+COLOR_CACHE_SIZE = 32
 
 class NeoPixel:
-    def __init__(self, pin_num, num_leds, brightness=0.3):
+    """Framebuffer for one LED chain, drawn in logical x, y through a PanelLayout
+
+    The buffer is kept in chain order, so show() streams it unchanged; the
+    drawing calls resolve coordinates through the layout's index map.
+    """
+    def __init__(self, pin_num, num_leds, brightness=0.3, layout=None):
+        self.layout = layout or PanelLayout()
+        if len(self.layout) != num_leds:
+            raise ValueError("LED count %d does not match the %dx%d panel layout"
+                             % (num_leds, self.layout.width, self.layout.height))
         self.num_leds = num_leds
         self.brightness = brightness
-        self.np = neopixel.NeoPixel(Pin(pin_num), num_leds)
-        self.width = config.MATRIX_WIDTH
-        self.height = config.MATRIX_HEIGHT
+        self.output = hal.led_output(pin_num, num_leds)
+        self.width = self.layout.width
+        self.height = self.layout.height
+
+        # GRB framebuffer with brightness/gamma already applied, streamed as-is
+        self.buf = bytearray(num_leds * 3)
+        self._mv = memoryview(self.buf)
+        self._shown = None  # Copy of the last frame written to the LEDs
+        self._base = None  # Frame as drawn, before set_brightness rescaled it
+        self._base_brightness = 0
+        self._rescaled = None  # Buffer as the last rescale left it; differs once something is drawn
+        self.dirty = True
+        self.writes = 0
+        self.skipped_writes = 0
+
+        self._lut = self._build_lut(brightness, config.LED_GAMMA)
+        self._rows = {}  # rgb tuple -> memoryview of one encoded matrix row
+        self._masks = {}  # column -> column_mask()
+        self._free_dim = tuple(int(c * 0.2) for c in config.COLOR_FREE)  # 20% brightness
+        self._free_half = tuple(int(c * 0.5) for c in config.COLOR_FREE)  # 50% brightness
+
+    def _build_lut(self, brightness, gamma):
+        """Channel value -> output byte with brightness and gamma applied"""
+        if gamma == 1:
+            return bytes(int(i * brightness) for i in range(256))
+        return bytes(int(((i / 255) ** gamma) * 255 * brightness) for i in range(256))
+
+    def set_brightness(self, brightness):
+        """Change brightness, rescaling the frame already drawn
+
+        The frame is rescaled from a copy taken as it was drawn, not from the
+        last rescale, so repeated dimming and restoring does not lose the low
+        channel values.
+        """
+        old = self.brightness
+        self.brightness = brightness
+        self._lut = self._build_lut(brightness, config.LED_GAMMA)
+        self._rows.clear()
+        buf = self.buf
+        if self._rescaled != buf:
+            # Drawn since the last rescale: this frame is the new reference
+            if self._base is None:
+                self._base = bytearray(buf)
+            else:
+                self._base[:] = buf
+            self._base_brightness = old
+        base = self._base
+        if self._base_brightness > 0:
+            # Output bytes are linear in brightness, gamma or not
+            scale = int(brightness * 65536 / self._base_brightness)
+            for i in range(len(buf)):
+                buf[i] = min(255, (base[i] * scale) >> 16)
+        else:
+            buf[:] = bytes(len(buf))  # Nothing to rescale; the caller redraws
+        if self._rescaled is None:
+            self._rescaled = bytearray(buf)
+        else:
+            self._rescaled[:] = buf
+        self.dirty = True
+
+    def _row(self, color):
+        """Encoded GRB bytes for a full row of one colour, cached per colour"""
+        row = self._rows.get(color)
+        if row is None:
+            lut = self._lut
+            pixel = bytes((lut[color[1]], lut[color[0]], lut[color[2]]))
+            if len(self._rows) >= COLOR_CACHE_SIZE:
+                self._rows.clear()
+            row = self._rows[color] = memoryview(pixel * self.width)
+        return row
 
     def _set_pixel(self, i, color):
         """Set pixel with brightness adjustment"""
-        r = int(color[0] * self.brightness)
-        g = int(color[1] * self.brightness)
-        b = int(color[2] * self.brightness)
-        self.np[i] = (r, g, b)
+        px = self._row(color)
+        buf = self.buf
+        o = i * 3
+        buf[o] = px[0]
+        buf[o + 1] = px[1]
+        buf[o + 2] = px[2]
+        self.dirty = True
 
     def set_pixel_xy(self, x, y, color):
         """Set pixel at x,y coordinates (0,0 is top-left)"""
         if 0 <= x < self.width and 0 <= y < self.height:
-            # Convert x,y to linear index
-            i = y * self.width + x
-            self._set_pixel(i, color)
+            self._set_pixel(self.layout.index[y * self.width + x], color)
+
+    def _fill_span(self, start, count, row):
+        """Copy an encoded colour row over count LEDs from chain position start"""
+        mv = self._mv
+        o = start * 3
+        end = o + count * 3
+        step = len(row)
+        while o < end:
+            n = min(step, end - o)
+            mv[o:o + n] = row[:n]
+            o += n
+
+    def fill_rect(self, x, y, w, h, color):
+        """Fill a rectangle, clipped to the matrix, with one colour"""
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        x1 = min(x + w, self.width)
+        y1 = min(y + h, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        row = self._row(color)
+        for start, count in self.layout.spans(x0, y0, x1 - x0, y1 - y0):
+            self._fill_span(start, count, row)
+        self.dirty = True
+
+    def blit(self, columns, x, y, color, start=0, count=None):
+        """Draw a 1-bit sprite given as column bitmasks (bit 0 at the top), lit pixels only
+
+        start and count select a window of the columns, e.g. for scrolling text.
+        """
+        if count is None:
+            count = len(columns) - start
+        px = self._row(color)
+        g, r, b = px[0], px[1], px[2]
+        buf = self.buf
+        index = self.layout.index
+        width = self.width
+        height = self.height
+        for c in range(count):
+            cx = x + c
+            if cx < 0 or cx >= width:
+                continue
+            bits = columns[start + c]
+            cy = y
+            while bits:
+                if bits & 1 and 0 <= cy < height:
+                    o = index[cy * width + cx] * 3
+                    buf[o] = g
+                    buf[o + 1] = r
+                    buf[o + 2] = b
+                bits >>= 1
+                cy += 1
+        self.dirty = True
 
     def fill_except_column(self, color, except_col):
         """Fill entire matrix except specified column with a color"""
-        for y in range(self.height):
-            for x in range(self.width):
-                if x != except_col:
-                    self.set_pixel_xy(x, y, color)
+        self.fill_rect(0, 0, except_col, self.height, color)
+        self.fill_rect(except_col + 1, 0, self.width - except_col - 1, self.height, color)
+
+    def _fill_column(self, col, lit, color, from_bottom):
+        """Light `lit` LEDs of a column in color from one end, the rest off"""
+        on = self._row(color)
+        off = self._row(config.COLOR_OFF)
+        buf = self.buf
+        index = self.layout.index
+        width = self.width
+        height = self.height
+        for y in range(height):
+            px = on if (height - 1 - y if from_bottom else y) < lit else off
+            o = index[y * width + col] * 3
+            buf[o] = px[0]
+            buf[o + 1] = px[1]
+            buf[o + 2] = px[2]
+        self.dirty = True
+
+    def column_mask(self, col):
+        """Per-LED flags for one logical column, in chain order"""
+        mask = self._masks.get(col)
+        if mask is None:
+            mask = self._masks[col] = self.layout.column_mask(col)
+        return mask
 
     def set_progress_column(self, col, remaining_minutes):
         """Set progress indicator in specified column"""
         max_minutes = config.MINUTES_PER_LED * self.height
         leds_to_light = min(self.height, remaining_minutes // config.MINUTES_PER_LED)
-        
+
         # If we have overflow time, show all LEDs in overflow color
         if remaining_minutes > max_minutes:
             color = config.COLOR_OVERFLOW
             leds_to_light = self.height
         else:
             color = config.COLOR_PROGRESS
-            
+
         # Fill column from bottom up
-        for y in range(self.height):
-            if y < leds_to_light:
-                self.set_pixel_xy(col, self.height - 1 - y, color)
-            else:
-                self.set_pixel_xy(col, self.height - 1 - y, config.COLOR_OFF)
+        self._fill_column(col, leds_to_light, color, True)
 
     def set_next_meeting_column(self, col, minutes_until):
         """Set next meeting countdown in specified column"""
         if minutes_until is None:
             # No upcoming meeting, turn off column
-            for y in range(self.height):
-                self.set_pixel_xy(col, y, config.COLOR_OFF)
+            self._fill_column(col, 0, config.COLOR_OFF, False)
             return
-            
+
         max_minutes = config.MINUTES_PER_LED * self.height
         leds_to_light = min(self.height, minutes_until // config.MINUTES_PER_LED)
-        
+
         # If next meeting is far away, show dimmed column
         if minutes_until > max_minutes:
             # Show full column in dimmed color
-            color = tuple(int(c * 0.2) for c in config.COLOR_FREE)  # 20% brightness
-            for y in range(self.height):
-                self.set_pixel_xy(col, y, color)
+            self._fill_column(col, self.height, self._free_dim, False)
         else:
             # Show countdown from top down (inverse of busy countdown)
-            color = tuple(int(c * 0.5) for c in config.COLOR_FREE)  # 50% brightness
-            for y in range(self.height):
-                if y < leds_to_light:
-                    self.set_pixel_xy(col, y, color)
-                else:
-                    self.set_pixel_xy(col, y, config.COLOR_OFF)
-
-    def fill(self, color):
+            self._fill_column(col, leds_to_light, self._free_half, False)
+
+    def fill(self, color, show=True):
         """Fill entire matrix with a color"""
-        for i in range(self.num_leds):
-            self._set_pixel(i, color)
-        self.show()
+        row = self._row(color)
+        mv = self._mv
+        row_len = len(row)
+        size = len(self.buf)
+        for o in range(0, size, row_len):
+            end = min(o + row_len, size)
+            mv[o:end] = row[:end - o]
+        self.dirty = True
+        if show:
+            self.show()
 
     def show(self):
-        """Update the display"""
-        self.np.write()
+        """Update the display, skipping the write if the frame is unchanged"""
+        if not self.dirty:
+            self.skipped_writes += 1
+            return False
+        self.dirty = False
+        if self._shown is not None and self._shown == self.buf:
+            self.skipped_writes += 1
+            return False
+        started = metrics.start()
+        self.output.write(self.buf)
+        metrics.record("led_write", started)
+        if self._shown is None:
+            self._shown = bytearray(self.buf)
+        else:
+            self._shown[:] = self.buf
+        self.writes += 1
+        return True
 
     def clear(self):
         """Clear the display"""
-        self.fill(config.COLOR_OFF) 
\ No newline at end of file
+        self.fill(config.COLOR_OFF)
@@ -0,0 +1,153 @@
+import asyncio
+import config
+import hal
+from metrics import metrics
+from time_manager import MIN_VALID_TIME
+
+try:
+    from time import ticks_diff
+except ImportError:
+    # CPython
+    def ticks_diff(a, b):
+        return a - b
+
+# Smallest relative brightness change worth re-encoding the framebuffer for
+BRIGHTNESS_HYSTERESIS = 0.05
+
+def estimate_ma(buf, num_leds):
+    """LED current for an encoded framebuffer: each channel draws in proportion to its output byte"""
+    return num_leds * config.LED_IDLE_MA + sum(buf) * config.LED_CHANNEL_MA // 255
+
+class PowerGovernor:
+    """Keeps the LEDs within a current budget, dims them outside working hours and sleeps the MCU when idle
+
+    Before a frame is shown, update() estimates its LED current from the
+    encoded framebuffer. Output bytes scale linearly with brightness, so the
+    brightness that fits POWER_BUDGET_MA follows from one estimate; the frame
+    is rescaled in place and later frames are encoded at that level. Outside
+    WORK_HOURS on WORK_DAYS the target is OFF_HOURS_BRIGHTNESS instead, 0
+    blanking the matrix.
+
+    Tasks report when they next need the CPU with idle(), and busy() when
+    they wake. With LIGHT_SLEEP on, run() puts the MCU into lightsleep until
+    the earliest of those, provided every task is idle and no animation or
+    scrolling text needs frames. LED and board current are integrated over
+    time for the average power estimate.
+    """
+    def __init__(self, leds, logger, clock=None):
+        self.leds = leds
+        self.logger = logger
+        self.clock = clock or hal.clock  # UTC seconds, for working hours
+        self.target = leds.brightness
+        self.led_ma = estimate_ma(leds.buf, leds.num_leds)  # Frame on the LEDs now
+        self.wakeups = {}  # task name -> UTC time it next needs the CPU, None while running
+        self.animating = None  # () -> True while frames must keep coming
+        self.energy = 0  # mA * ms since start, LEDs and board
+        self.started = hal.ticks_ms()
+        self.last = self.started
+        self.slept_ms = 0
+        self.sleeps = 0
+
+    def working(self, now):
+        """True during working hours in local time"""
+        local = int(now) + config.UTC_OFFSET * 60
+        days = local // 86400
+        if (days + 3) % 7 not in config.WORK_DAYS:  # 1970-01-01 was a Thursday
+            return False
+        hour = local % 86400 // 3600
+        return config.WORK_HOURS[0] <= hour < config.WORK_HOURS[1]
+
+    def next_change(self, now):
+        """UTC time of the next working-hours boundary after now"""
+        offset = config.UTC_OFFSET * 60
+        local = int(now) + offset
+        day = local - local % 86400
+        start, end = config.WORK_HOURS
+        for t in (day + start * 3600, day + end * 3600, day + 86400 + start * 3600):
+            if t > local:
+                return t - offset
+        return day + 86400 - offset
+
+    def target_brightness(self, now):
+        if now < MIN_VALID_TIME or self.working(now):
+            # Full brightness until the clock is known
+            return config.LED_BRIGHTNESS
+        return config.OFF_HOURS_BRIGHTNESS
+
+    def begin(self):
+        """Apply the working-hours brightness; call before drawing a frame"""
+        target = self.target_brightness(self.clock())
+        if target != self.target:
+            self.logger.info("Brightness %s for %s", target, "working hours" if target == config.LED_BRIGHTNESS else "off hours")
+            self.target = target
+            self.leds.set_brightness(target)
+
+    def update(self):
+        """Fit the frame just drawn to the current budget; call before showing it"""
+        leds = self.leds
+        current = leds.brightness
+        target = self.target
+        if not config.POWER_BUDGET_MA or current <= 0:
+            return
+        idle_ma = leds.num_leds * config.LED_IDLE_MA
+        dynamic = estimate_ma(leds.buf, leds.num_leds) - idle_ma
+        wanted = target
+        if dynamic > 0:
+            # Current this frame would draw at the target brightness
+            at_target = dynamic * target / current
+            if idle_ma + at_target > config.POWER_BUDGET_MA:
+                wanted = target * max(0, config.POWER_BUDGET_MA - idle_ma) / at_target
+                metrics.incr("power_limited_frames")
+        if wanted < current or (wanted > current and (wanted == target or wanted - current > current * BRIGHTNESS_HYSTERESIS)):
+            self.logger.debug("Brightness %.3f for a %s mA budget", wanted, config.POWER_BUDGET_MA)
+            leds.set_brightness(wanted)
+
+    def idle(self, task, until):
+        """Task has nothing to do until the UTC time until"""
+        self.wakeups[task] = until
+
+    def busy(self, task):
+        self.wakeups[task] = None
+
+    def _account(self, board_ma):
+        now = hal.ticks_ms()
+        self.energy += (self.led_ma + board_ma) * ticks_diff(now, self.last)
+        self.last = now
+
+    def sample(self):
+        """Add the time since the last sample at the current LED and awake board current"""
+        self._account(config.BOARD_ACTIVE_MA)
+        self.led_ma = estimate_ma(self.leds.buf, self.leds.num_leds)
+
+    def average_mw(self):
+        """Estimated average power since start"""
+        elapsed = ticks_diff(self.last, self.started)
+        if elapsed <= 0:
+            return 0
+        return self.energy * config.SUPPLY_VOLTS / elapsed
+
+    def sleep_ms(self, now):
+        """How long the MCU may lightsleep from now, 0 if something needs it sooner"""
+        if not self.wakeups or (self.animating and self.animating()):
+            return 0
+        deadline = self.next_change(now)
+        for until in self.wakeups.values():
+            if until is None:
+                return 0
+            deadline = min(deadline, until)
+        ms = int((deadline - now) * 1000)
+        return ms if ms >= config.LIGHT_SLEEP_MIN * 1000 else 0
+
+    async def run(self):
+        """Sample power, and lightsleep between deadlines when enabled"""
+        while True:
+            self.sample()
+            ms = self.sleep_ms(self.clock()) if config.LIGHT_SLEEP else 0
+            if ms:
+                self.logger.debug("Light sleep for %s ms", ms)
+                started = hal.ticks_ms()
+                hal.lightsleep(ms)
+                self._account(config.BOARD_SLEEP_MA)
+                self.slept_ms += ticks_diff(hal.ticks_ms(), started)
+                self.sleeps += 1
+            await asyncio.sleep(config.POWER_SAMPLE_INTERVAL)
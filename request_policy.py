@@ -0,0 +1,202 @@
+import os
+import asyncio
+import config
+from time_manager import parse_http_date
+from metrics import metrics
+
+# Statuses worth retrying: rate limits and server-side failures
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def _random():
+    """Uniform in [0, 1) from the hardware RNG"""
+    return int.from_bytes(os.urandom(2), "big") / 65536
+
+def backoff(attempt, base, cap):
+    """Exponential backoff with full jitter: uniform up to base * 2**(attempt - 1), at most cap"""
+    return _random() * min(cap, base * 2 ** (attempt - 1))
+
+def jitter(delay):
+    """Equal jitter: between half and all of delay"""
+    return delay * (1 + _random()) / 2
+
+def retry_after(value, now):
+    """Seconds asked for by a Retry-After header (delay-seconds or HTTP-date), or None"""
+    if not value:
+        return None
+    try:
+        if value.strip().isdigit():
+            return int(value)
+        return max(0, parse_http_date(value) - now)
+    except (ValueError, IndexError):
+        return None
+
+def retryable(response):
+    """True for answers that mean "try again later" rather than "this request is wrong"
+
+    Google reports exhausted per-user and per-project quotas as 403 with a
+    rateLimitExceeded or userRateLimitExceeded reason.
+    """
+    status = response.status_code
+    if status in RETRY_STATUSES:
+        return True
+    return status == 403 and b"ateLimitExceeded" in response.content
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Stops calling an endpoint that keeps failing, then lets one probe through
+
+    After BREAKER_FAILURES failed requests in a row, or a Retry-After longer
+    than RETRY_MAX_WAIT, the breaker opens: requests fail at once without
+    touching the network. Once the open time has passed, one request is let
+    through. If it succeeds the breaker closes, otherwise it opens again for
+    twice as long, up to BREAKER_MAX_OPEN_TIME. Open times are jittered so a
+    fleet of lights does not come back at the same second.
+    """
+    def __init__(self, name, logger):
+        self.name = name
+        self.logger = logger
+        self.failures = 0
+        self.open_time = config.BREAKER_OPEN_TIME
+        self.open_until = None  # None while closed
+        self.probe_until = None  # Set while the one trial request is in flight
+        self.opened = 0
+
+    def allow(self, now):
+        """True if a request may be sent now"""
+        if self.open_until is None:
+            return True
+        if now < self.open_until or (self.probe_until and now < self.probe_until):
+            return False
+        # Half-open; a probe that never reported back is given up on after the timeout
+        self.probe_until = now + config.HTTP_TIMEOUT * config.RETRY_ATTEMPTS
+        return True
+
+    def success(self):
+        if self.open_until is not None:
+            self.logger.info("%s API recovered, circuit closed", self.name)
+        self.failures = 0
+        self.open_time = config.BREAKER_OPEN_TIME
+        self.open_until = None
+        self.probe_until = None
+
+    def failure(self, now, hold=None):
+        """Count a failed request; hold is a wait the server asked for"""
+        self.failures += 1
+        if self.probe_until or self.failures >= config.BREAKER_FAILURES or hold:
+            wait = jitter(self.open_time)
+            if hold:
+                wait = max(wait, hold)
+            self.open_until = now + wait
+            self.probe_until = None
+            self.open_time = min(self.open_time * 2, config.BREAKER_MAX_OPEN_TIME)
+            self.opened += 1
+            self.logger.warning("%s API failing, circuit open for %s s", self.name, int(wait))
+
+class QuotaBudget:
+    """Token bucket for API requests, so one light cannot drain the shared project quota
+
+    Holds up to API_QUOTA_PER_HOUR requests and refills continuously at that
+    rate; 0 disables the limit.
+    """
+    def __init__(self, per_hour=None):
+        self.per_hour = config.API_QUOTA_PER_HOUR if per_hour is None else per_hour
+        self.tokens = self.per_hour
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None and now > self.updated:
+            self.tokens = min(self.per_hour, self.tokens + (now - self.updated) * self.per_hour / 3600)
+        self.updated = now
+
+    def take(self, now):
+        """Use one request from the budget; False if it is spent"""
+        if not self.per_hour:
+            return True
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def available_at(self, now):
+        """Time the next request fits in the budget"""
+        if not self.per_hour:
+            return now
+        self._refill(now)
+        return now + max(0, 1 - self.tokens) * 3600 / self.per_hour
+
+class RequestPolicy:
+    """Retries, circuit breakers and the quota budget for Google API requests
+
+    call() sends a request through its endpoint's breaker and the shared
+    quota budget. Rate limits and server errors are retried up to
+    RETRY_ATTEMPTS times after an exponential backoff with jitter, or after
+    the Retry-After the server sent when that is within RETRY_MAX_WAIT.
+    Longer waits are left to the breaker and the caller's next refresh, so
+    the event loop is never held up for minutes. The last response is
+    returned whatever its status; exceptions from the transport propagate.
+    """
+    def __init__(self, logger, clock):
+        self.logger = logger
+        self.clock = clock  # UTC seconds
+        self.breakers = {}  # endpoint -> CircuitBreaker
+        self.quota = QuotaBudget()
+        self.stats = {"retries": 0, "rejected": 0, "throttled": 0, "breaker_opens": 0}
+
+    def breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(endpoint, self.logger)
+        return breaker
+
+    async def call(self, endpoint, send):
+        """Await send() (a coroutine function returning a Response) under the policy"""
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            now = self.clock()
+            if not breaker.allow(now):
+                self.stats["rejected"] += 1
+                raise CircuitOpenError("%s circuit open for %s s" % (endpoint, max(0, int(breaker.open_until - now))))
+            if not self.quota.take(now):
+                self.stats["throttled"] += 1
+                raise CircuitOpenError("API quota spent for %s s" % int(self.quota.available_at(now) - now))
+            metrics.incr("api_calls")
+            try:
+                response = await send()
+            except Exception:
+                self._failure(breaker, now)
+                raise
+            if not retryable(response):
+                breaker.success()
+                return response
+            attempt += 1
+            wait = retry_after(response.header("Retry-After"), now)
+            if wait is not None and wait > config.RETRY_MAX_WAIT:
+                self._failure(breaker, now, wait)
+                return response
+            if attempt >= config.RETRY_ATTEMPTS or breaker.probe_until:
+                self._failure(breaker, now)
+                return response
+            if wait is None:
+                wait = backoff(attempt, config.RETRY_BASE_DELAY, config.RETRY_MAX_WAIT)
+            self.stats["retries"] += 1
+            self.logger.warning("%s API answered %s, retry %s in %.1f s", endpoint, response.status_code, attempt, wait)
+            response.close()
+            await asyncio.sleep(wait)
+
+    def _failure(self, breaker, now, hold=None):
+        opened = breaker.opened
+        breaker.failure(now, hold)
+        self.stats["breaker_opens"] += breaker.opened - opened
+
+    def blocked_until(self, now, endpoints):
+        """Earliest time requests to all of endpoints may be sent, now if they can go already"""
+        until = self.quota.available_at(now)
+        for endpoint in endpoints:
+            breaker = self.breakers.get(endpoint)
+            if breaker and breaker.open_until is not None:
+                until = max(until, breaker.open_until)
+        return until
@@ -0,0 +1,104 @@
+import os
+import struct
+import binascii
+from array import array
+import config
+from timeline import Timeline
+
+# On-flash layout, little-endian:
+#   header: magic "BLSC", version, flags, block count, CRC-32 of the calendar
+#           ids, timeline base, end of covered window, CRC-32 of everything else
+#   records: one (start, end) pair per busy block, as offsets from the base
+# The file is read straight into the Timeline arrays; there is no JSON step.
+HEADER = "<4sBBHIIII"
+HEADER_SIZE = struct.calcsize(HEADER)
+RECORD = "<ii"
+RECORD_SIZE = struct.calcsize(RECORD)
+MAGIC = b"BLSC"
+VERSION = 1
+
+def _calendars_crc():
+    feeds = [feed if isinstance(feed, str) else feed["url"] for feed in config.ICS_FEEDS]
+    return binascii.crc32("\n".join(config.CALENDAR_IDS + feeds).encode()) & 0xFFFFFFFF
+
+def encode(timeline, until):
+    """File contents for a timeline covering the window up to until"""
+    count = len(timeline)
+    records = bytearray(count * RECORD_SIZE)
+    for i in range(count):
+        struct.pack_into(RECORD, records, i * RECORD_SIZE, timeline.starts[i], timeline.ends[i])
+    head = struct.pack(HEADER, MAGIC, VERSION, 0, count, _calendars_crc(), timeline.base, until, 0)
+    crc = binascii.crc32(records, binascii.crc32(head[:-4])) & 0xFFFFFFFF
+    return head[:-4] + struct.pack("<I", crc) + records
+
+def decode(data):
+    """(timeline, until) from file contents; raises ValueError if they are damaged or not ours"""
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Truncated header")
+    magic, version, _, count, calendars, base, until, crc = struct.unpack_from(HEADER, data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unknown format")
+    if len(data) != HEADER_SIZE + count * RECORD_SIZE:
+        raise ValueError("Truncated records")
+    if binascii.crc32(data[HEADER_SIZE:], binascii.crc32(data[:HEADER_SIZE - 4])) & 0xFFFFFFFF != crc:
+        raise ValueError("CRC mismatch")
+    if calendars != _calendars_crc():
+        raise ValueError("Written for other calendars")
+    values = struct.unpack_from("<%di" % (2 * count), data, HEADER_SIZE)
+    timeline = Timeline()
+    timeline.base = base
+    timeline.starts = array("l", values[0::2])
+    timeline.ends = array("l", values[1::2])
+    return timeline, until
+
+class ScheduleCache:
+    """Last known busy blocks on flash, so the light keeps working through outages and reboots
+
+    Each save covers the lookahead window from the time of the refresh. The
+    file is rewritten only when the blocks change, or when less than half of
+    the covered window is left, to limit flash wear. Writes go to a temporary
+    file that is renamed over the old one, so a reset mid-write leaves the
+    previous schedule intact.
+    """
+    def __init__(self, logger, path=None):
+        self.logger = logger
+        self.path = path or config.SCHEDULE_CACHE_FILE
+        self.saved = None  # Timeline last written
+        self.until = 0  # End of the window covered by the file
+        self.writes = 0
+
+    def load(self, now):
+        """Timeline from flash if it is for these calendars and still covers now, else None"""
+        try:
+            with open(self.path, "rb") as f:
+                timeline, until = decode(f.read())
+        except OSError:
+            return None
+        except Exception as e:
+            self.logger.warning("Ignoring unreadable schedule cache: %s", e)
+            return None
+        if now >= until:
+            self.logger.debug("Cached schedule is stale")
+            return None
+        self.saved = timeline
+        self.until = until
+        self.logger.info("Loaded %s cached busy blocks", len(timeline))
+        return timeline
+
+    def save(self, timeline, now):
+        """Persist timeline, covering the lookahead window from now, if the file needs it"""
+        if timeline == self.saved and self.until - now > config.CALENDAR_LOOKAHEAD // 2:
+            return
+        until = int(now) + config.CALENDAR_LOOKAHEAD
+        temp = self.path + ".tmp"
+        try:
+            with open(temp, "wb") as f:
+                f.write(encode(timeline, until))
+            os.rename(temp, self.path)
+        except Exception as e:
+            self.logger.warning("Could not persist schedule: %s", e)
+            return
+        self.saved = timeline
+        self.until = until
+        self.writes += 1
+        self.logger.debug("Saved %s busy blocks until %s", len(timeline), until)
@@ -0,0 +1,79 @@
+import config
+from request_policy import jitter
+
+# Wake this long after a computed transition so the new state is unambiguous
+TRANSITION_SLACK = 1
+
+class Scheduler:
+    """Decides when to re-render from the local schedule and when to refetch
+
+    Rendering happens exactly at the next state transition (meeting start or
+    end, or the next progress-LED step), computed from cached events. Network
+    refreshes run on their own cadence, which backs off while the calendars
+    are unchanged and snaps back to UPDATE_INTERVAL when something changes.
+    Failed refreshes are retried with a jittered exponential backoff instead.
+    """
+    def __init__(self, calendar, logger):
+        self.calendar = calendar
+        self.logger = logger
+        self.refresh_interval = config.UPDATE_INTERVAL
+        self.next_refresh = 0
+        self.failures = 0  # Failed refreshes in a row
+
+    def refresh_due(self, now):
+        """True when the schedule should be refetched"""
+        return now >= self.next_refresh
+
+    def refreshed(self, now, ok, changed, pushed=False, retry_at=None):
+        """Adapt the refresh cadence after a fetch attempt
+        
+        pushed means every calendar has a live push channel, so polling is
+        only a safety net and runs every WATCH_POLL_INTERVAL. After a failure
+        the wait doubles from UPDATE_INTERVAL up to REFRESH_RETRY_MAX_INTERVAL,
+        jittered so lights do not retry in step, and is never shorter than
+        retry_at, when the API will take requests again.
+        """
+        if ok:
+            self.failures = 0
+        if ok and pushed:
+            self.refresh_interval = config.WATCH_POLL_INTERVAL
+        elif ok and not changed:
+            self.refresh_interval = min(self.refresh_interval * 2, config.REFRESH_MAX_INTERVAL)
+        else:
+            self.refresh_interval = config.UPDATE_INTERVAL
+        wait = self.refresh_interval
+        if not ok:
+            self.failures += 1
+            wait = jitter(min(config.UPDATE_INTERVAL * 2 ** (self.failures - 1), config.REFRESH_RETRY_MAX_INTERVAL))
+            if retry_at is not None:
+                wait = max(wait, retry_at - now)
+        self.next_refresh = now + wait
+        self.logger.debug("Next refresh in %s seconds", int(wait))
+
+    def _column_key(self, minutes):
+        """Progress column state for a minute count, matching NeoPixel's drawing"""
+        if minutes > config.MINUTES_PER_LED * config.MATRIX_HEIGHT:
+            return -1  # Overflow / dimmed full column
+        return min(config.MATRIX_HEIGHT, minutes // config.MINUTES_PER_LED)
+
+    def _next_step(self, now, target):
+        """Time at which the progress column counting down to target next changes"""
+        minutes = int((target - now) / 60)
+        key = self._column_key(minutes)
+        for m in range(minutes - 1, -1, -1):
+            if self._column_key(m) != key:
+                # int((target - t) / 60) drops to m once t passes target - (m + 1) * 60
+                return target - (m + 1) * 60
+        return None
+
+    def next_transition(self, now):
+        """Timestamp of the next moment the display needs to change, or None"""
+        candidates = [self.calendar.next_boundary(now)]
+        is_busy, _, _, target = self.calendar.evaluate(now)
+        if target is not None:
+            candidates.append(self._next_step(now, target))
+            if not is_busy:
+                # Start of the "meeting starts soon" warning
+                candidates.append(target - config.ANIMATION_WARNING_MINUTES * 60)
+        candidates = [t for t in candidates if t is not None and t > now]
+        return min(candidates) + TRANSITION_SLACK if candidates else None
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""Benchmarks for event processing, time parsing and rendering.
+
+Synthetic calendars (1 to 50 calendars, 10 to 10,000 events, back-to-back
+chains, mixed UTC offsets and all-day events) are pushed through the real
+code paths:
+
+  parse/<case>    TimeManager.parse_datetime over every start/end string
+  stream/<case>   EventStreamParser + parsing + Timeline on events.list bodies
+  status/<case>   CalendarAPI.get_calendar_status through an in-memory transport
+                  (host only; needs the jwt package that calendar_api imports)
+  render/<name>   NeoPixel fills, progress columns and show()
+
+Each benchmark reports the best wall time over several runs, peak memory
+above the starting point and memory still held afterwards. Under CPython
+memory comes from tracemalloc; under MicroPython from gc.mem_alloc() deltas
+with the collector paused, so the peak there is the total allocated.
+
+    python scripts/bench.py                 run and print a table
+    python scripts/bench.py --save          store results as the baseline
+    python scripts/bench.py --check         compare with the baseline, exit 1 on regression
+    python scripts/bench.py --quick         skip the 10,000 event cases
+    python scripts/bench.py --only=parse    run benchmarks whose name starts with a prefix
+    python scripts/bench.py --threshold=0.1 allowed slowdown/growth (default 0.2)
+    python scripts/bench.py --base=main     measure the baseline on a git revision first (host only)
+
+Baselines are kept per interpreter and platform in scripts/bench_baseline.json,
+which is machine-specific and not committed: on a fresh checkout or in CI,
+use --base so both sides are measured on the same machine.
+"""
+import gc
+import json
+import sys
+import time
+
+sys.path.insert(0, ".")
+import config
+import hal
+from time_manager import TimeManager, civil_from_days
+from event_stream import EventStreamParser
+from timeline import Timeline
+from neopixel import NeoPixel
+from layout import PanelLayout
+from text import Marquee, GLYPH_HEIGHT
+from log_config import Logger, ConsoleSink, ERROR
+
+if not hal.ON_DEVICE:
+    import sim
+    sim.install()
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BASELINE_FILE = "scripts/bench_baseline.json"
+THRESHOLD = 0.2
+MEMORY_SLACK = 1024  # Bytes of growth ignored when checking memory
+REPEAT = 5  # Minimum timed runs per benchmark
+MIN_TIME_US = 300000  # Keep repeating short benchmarks until this much time is spent
+CHUNK = 512  # Body bytes fed to the parser at once, as HTTPClient does
+
+# name, calendars, total events, pattern
+CASES = (
+    ("1cal-10", 1, 10, "mixed"),
+    ("5cal-200", 5, 200, "mixed"),
+    ("10cal-1000-chain", 10, 1000, "chain"),
+    ("50cal-2000", 50, 2000, "mixed"),
+    ("50cal-10000", 50, 10000, "mixed"),
+    ("1cal-10000-chain", 1, 10000, "chain"),
+)
+LARGE_EVENTS = 10000
+
+# UTC offsets in minutes used by the mixed pattern
+OFFSETS = (0, 0, -480, 330, 540, -210, 60, -300)
+
+if hasattr(time, "ticks_us"):
+    def _now_us():
+        return time.ticks_us()
+
+    def _elapsed_us(start):
+        return time.ticks_diff(time.ticks_us(), start)
+else:
+    def _now_us():
+        return time.perf_counter_ns() // 1000
+
+    def _elapsed_us(start):
+        return time.perf_counter_ns() // 1000 - start
+
+class Random:
+    """Small LCG so generated calendars are identical on every interpreter"""
+    def __init__(self, seed):
+        self.state = seed
+
+    def next(self, n):
+        self.state = (self.state * 1103515245 + 12345) & 0x7FFFFFFF
+        return (self.state >> 8) % n
+
+def _format_local(timestamp, offset_min, fraction=False):
+    """RFC 3339 dateTime in a given UTC offset"""
+    local = timestamp + offset_min * 60
+    days, secs = divmod(local, 86400)
+    y, m, d = civil_from_days(days)
+    text = "%04d-%02d-%02dT%02d:%02d:%02d" % (y, m, d, secs // 3600, secs // 60 % 60, secs % 60)
+    if fraction:
+        text += ".250"
+    if offset_min == 0:
+        return text + "Z"
+    sign = "+" if offset_min > 0 else "-"
+    offset_min = abs(offset_min)
+    return text + "%s%02d:%02d" % (sign, offset_min // 60, offset_min % 60)
+
+def _format_date(timestamp):
+    y, m, d = civil_from_days(timestamp // 86400)
+    return "%04d-%02d-%02d" % (y, m, d)
+
+def generate(calendars, events, pattern, now, seed=1):
+    """Synthetic calendars as {calendar id: [event resource, ...]}
+
+    "chain" lays out back-to-back 30 minute meetings around now with a few
+    small gaps; "mixed" scatters 15-120 minute meetings over a week in
+    assorted offsets, with some all-day, cancelled and transparent events.
+    """
+    rnd = Random(seed)
+    result = {}
+    per_calendar = max(1, events // calendars)
+    for c in range(calendars):
+        items = []
+        t = now - 3600 + c * 300
+        for i in range(per_calendar):
+            event = {"id": f"e{c}x{i}", "status": "confirmed"}
+            if pattern == "chain":
+                start = t
+                t += 1800 + (300 if rnd.next(10) == 0 else 0)
+                event["start"] = {"dateTime": _format_local(start, 0)}
+                event["end"] = {"dateTime": _format_local(start + 1800, 0)}
+            else:
+                kind = rnd.next(20)
+                start = now - 86400 + rnd.next(8 * 86400) // 300 * 300
+                if kind == 0:
+                    event["start"] = {"date": _format_date(start)}
+                    event["end"] = {"date": _format_date(start + 86400)}
+                else:
+                    offset = OFFSETS[rnd.next(len(OFFSETS))]
+                    end = start + (1 + rnd.next(8)) * 900
+                    event["start"] = {"dateTime": _format_local(start, offset, kind == 1)}
+                    event["end"] = {"dateTime": _format_local(end, offset, kind == 1)}
+                if kind == 2:
+                    event["status"] = "cancelled"
+                elif kind == 3:
+                    event["transparency"] = "transparent"
+            items.append(event)
+        result[f"bench{c}@group.calendar.google.com"] = items
+    return result
+
+def page_bodies(items, page_size):
+    """events.list response bodies for a calendar, one per page"""
+    bodies = []
+    for offset in range(0, len(items), page_size):
+        page = {"items": items[offset:offset + page_size]}
+        if offset + page_size < len(items):
+            page["nextPageToken"] = str(offset + page_size)
+        else:
+            page["nextSyncToken"] = "sync"
+        bodies.append(json.dumps(page).encode())
+    return bodies or [b'{"items": [], "nextSyncToken": "sync"}']
+
+def measure(fn, repeat=REPEAT):
+    """Return (best_us, peak_bytes, retained_bytes) for fn()"""
+    best = None
+    runs = total = 0
+    while runs < repeat or total < MIN_TIME_US:
+        gc.collect()
+        start = _now_us()
+        fn()
+        elapsed = _elapsed_us(start)
+        if best is None or elapsed < best:
+            best = elapsed
+        runs += 1
+        total += elapsed
+
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return best, peak - base, current - base
+    if hasattr(gc, "mem_alloc"):
+        base = gc.mem_alloc()
+        gc.disable()
+        try:
+            fn()
+            peak = gc.mem_alloc() - base
+        finally:
+            gc.enable()
+        gc.collect()
+        return best, peak, gc.mem_alloc() - base
+    return best, 0, 0
+
+def _quiet_logger():
+    return Logger("bench", ERROR, [ConsoleSink()])
+
+def bench_parse(data):
+    strings = []
+    for items in data.values():
+        for event in items:
+            for key in ("start", "end"):
+                value = event[key]
+                strings.append(value.get("dateTime") or value.get("date"))
+
+    def run():
+        tm = TimeManager(_quiet_logger())
+        parse = tm.parse_datetime
+        for s in strings:
+            parse(s)
+    return run
+
+def bench_stream(data, now):
+    bodies = [page_bodies(items, config.CALENDAR_PAGE_SIZE) for items in data.values()]
+
+    def run():
+        tm = TimeManager(_quiet_logger())
+        parse = tm.parse_datetime
+        intervals = []
+
+        def on_item(event_id, start, end, status, transparency):
+            if status != "cancelled" and transparency != "transparent":
+                intervals.append((parse(start), parse(end)))
+
+        for pages in bodies:
+            for body in pages:
+                parser = EventStreamParser(on_item)
+                mv = memoryview(body)
+                for i in range(0, len(body), CHUNK):
+                    parser.feed(mv[i:i + CHUNK])
+        window = [(s, e) for s, e in intervals if e > now and s < now + config.CALENDAR_LOOKAHEAD]
+        return Timeline(window)
+    return run
+
+def bench_status(data):
+    """None when CalendarAPI cannot be imported on this interpreter"""
+    try:
+        import sim
+        import hal
+        from calendar_api import CalendarAPI
+        from urllib.parse import parse_qs, unquote, urlparse
+    except ImportError as e:
+        print(f"  skipping status benchmarks: {e}")
+        return None
+
+    pages = {}
+    for calendar_id, items in data.items():
+        pages[calendar_id] = page_bodies(items, config.CALENDAR_PAGE_SIZE)
+
+    def handler(method, path, headers, body):
+        url = urlparse(path)
+        calendar_id = unquote(url.path.split("/")[-2])
+        token = parse_qs(url.query).get("pageToken", ["0"])[0]
+        page = int(token) // config.CALENDAR_PAGE_SIZE
+        return 200, {"Content-Type": "application/json"}, pages[calendar_id][page]
+
+    def run():
+        api = CalendarAPI(TimeManager(_quiet_logger()), _quiet_logger(), sync_mode="incremental")
+        api.token = "bench"
+        api.token_expires = time.time() + 86400
+        api._token_loaded = True
+        return api.get_calendar_status()
+
+    saved = (hal.open_connection, config.CALENDAR_IDS)
+    def run_with_transport():
+        hal.install(open_connection=sim.CannedTransport(handler))
+        config.CALENDAR_IDS = list(data)
+        try:
+            return run()
+        finally:
+            hal.open_connection, config.CALENDAR_IDS = saved
+    return run_with_transport
+
+def render_benchmarks():
+    if not hal.ON_DEVICE:
+        # A recording VirtualMatrix would put its frame log in every measurement
+        sim.install(matrix=sim.NullOutput())
+    leds = NeoPixel(config.LED_PIN, config.LED_COUNT, config.LED_BRIGHTNESS)
+    column = config.MATRIX_WIDTH - 1
+    frames = 100
+
+    def fill():
+        for i in range(frames):
+            leds.fill(config.COLOR_BUSY if i & 1 else config.COLOR_FREE)
+
+    def progress():
+        for i in range(frames):
+            leds.fill_except_column(config.COLOR_BUSY, column)
+            leds.set_progress_column(column, i % 90)
+            leds.show()
+
+    def countdown():
+        for i in range(frames):
+            leds.fill_except_column(config.COLOR_FREE, column)
+            leds.set_next_meeting_column(column, i % 150)
+            leds.show()
+
+    # Four chained 16x16 serpentine panels, 1024 LEDs
+    big = NeoPixel(config.LED_PIN, 1024, config.LED_BRIGHTNESS, PanelLayout(16, 16, 2, 2, True, 0))
+    marquee = Marquee(big, 0, (big.height - GLYPH_HEIGHT) // 2, big.width - 1, speed=1000)
+
+    def panels_status():
+        for i in range(frames):
+            big.fill_except_column(config.COLOR_BUSY, big.width - 1)
+            big.set_progress_column(big.width - 1, i % 90)
+            big.show()
+
+    def panels_text():
+        marquee.set("Free for 25m", config.COLOR_TEXT_ON_FREE, config.COLOR_FREE)
+        for i in range(frames):
+            marquee.draw()
+            big.show()
+
+    return (("render/fill-x100", fill), ("render/progress-x100", progress),
+            ("render/countdown-x100", countdown), ("render/panels-status-x100", panels_status),
+            ("render/panels-text-x100", panels_text))
+
+def benchmarks(quick, only):
+    """Yield (name, fn) for every selected benchmark"""
+    now = int(time.time()) // 60 * 60
+    for name, calendars, events, pattern in CASES:
+        if quick and events >= LARGE_EVENTS:
+            continue
+        if only and not any(f"{kind}/{name}".startswith(only) for kind in ("parse", "stream", "status")):
+            continue
+        try:
+            data = generate(calendars, events, pattern, now)
+        except MemoryError:
+            print(f"  skipping {name}: out of memory generating events")
+            continue
+        yield f"parse/{name}", bench_parse(data)
+        yield f"stream/{name}", bench_stream(data, now)
+        if sys.implementation.name != "micropython":
+            status = bench_status(data)
+            if status:
+                yield f"status/{name}", status
+        data = None
+    for name, fn in render_benchmarks():
+        yield name, fn
+
+def platform_key():
+    return f"{sys.implementation.name}-{sys.platform}"
+
+def load_baselines():
+    try:
+        with open(BASELINE_FILE) as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+def measure_base(rev, args):
+    """Baseline for this platform measured on another git revision"""
+    import os
+    import shutil
+    import subprocess
+    import tempfile
+    path = tempfile.mkdtemp(prefix="bench-")
+    print(f"Measuring the baseline on {rev}...")
+    subprocess.run(["git", "worktree", "add", "--detach", "--quiet", path, rev], check=True)
+    try:
+        if os.path.exists("config_local.py"):
+            shutil.copy("config_local.py", path)
+        passed = [arg for arg in args if arg == "--quick" or arg.startswith("--only=")]
+        subprocess.run([sys.executable, "scripts/bench.py", "--save"] + passed,
+                       cwd=path, check=True, stdout=subprocess.DEVNULL)
+        with open(os.path.join(path, BASELINE_FILE)) as f:
+            return json.load(f).get(platform_key(), {})
+    finally:
+        subprocess.run(["git", "worktree", "remove", "--force", path], check=True)
+
+def check(name, result, baseline, threshold):
+    """List of regression messages for one benchmark"""
+    problems = []
+    if result["time_us"] > baseline["time_us"] * (1 + threshold):
+        problems.append(f"{name}: time {baseline['time_us']} -> {result['time_us']} us")
+    for key in ("peak", "retained"):
+        if result[key] > baseline[key] * (1 + threshold) + MEMORY_SLACK:
+            problems.append(f"{name}: {key} {baseline[key]} -> {result[key]} bytes")
+    return problems
+
+def main():
+    args = sys.argv[1:]
+    quick = "--quick" in args
+    only = None
+    base = None
+    threshold = THRESHOLD
+    for arg in args:
+        if arg.startswith("--only="):
+            only = arg[7:]
+        elif arg.startswith("--threshold="):
+            threshold = float(arg[12:])
+        elif arg.startswith("--base="):
+            base = arg[7:]
+
+    baselines = load_baselines()
+    baseline = measure_base(base, args) if base else baselines.get(platform_key(), {})
+    results = {}
+    regressions = []
+    print(f"{'benchmark':32} {'time us':>10} {'peak B':>10} {'held B':>10} {'vs base':>8}")
+    for name, fn in benchmarks(quick, only):
+        if only and not name.startswith(only):
+            continue
+        try:
+            best, peak, retained = measure(fn)
+        except MemoryError:
+            print(f"{name:32} {'out of memory':>10}")
+            continue
+        results[name] = {"time_us": best, "peak": peak, "retained": retained}
+        ratio = ""
+        if name in baseline and baseline[name]["time_us"]:
+            ratio = "%.2fx" % (best / baseline[name]["time_us"])
+            regressions.extend(check(name, results[name], baseline[name], threshold))
+        print(f"{name:32} {best:>10} {peak:>10} {retained:>10} {ratio:>8}")
+
+    if "--save" in args:
+        baselines.setdefault(platform_key(), {}).update(results)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+        print(f"Saved {len(results)} results to {BASELINE_FILE} ({platform_key()})")
+
+    if "--check" in args:
+        if not baseline:
+            print(f"No baseline for {platform_key()}; run with --save on the code to compare against, or pass --base=<git revision>")
+            sys.exit(1)
+        for problem in regressions:
+            print(f"REGRESSION {problem}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {int(threshold * 100)}%")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Compare TimeManager's RFC 3339 parser with the old strptime-based path.
+
+Run from the repository root on the host or on the device:
+    python scripts/bench_time_parse.py
+    mpremote run scripts/bench_time_parse.py
+"""
+import sys
+import time
+
+sys.path.insert(0, ".")
+from time_manager import parse_rfc3339, format_rfc3339
+
+try:
+    from datetime import datetime, timezone
+except ImportError:
+    datetime = None
+
+ITERATIONS = 5000
+
+if hasattr(time, "ticks_us"):
+    def _now_us():
+        return time.ticks_us()
+
+    def _elapsed_us(start):
+        return time.ticks_diff(time.ticks_us(), start)
+else:
+    def _now_us():
+        return time.perf_counter_ns() // 1000
+
+    def _elapsed_us(start):
+        return _now_us() - start
+
+def _sample_timestamps(count):
+    """Distinct UTC timestamps spread over a few days"""
+    base = 1735689600  # 2025-01-01T00:00:00Z
+    return [format_rfc3339(base + i * 617) for i in range(count)]
+
+def strptime_parse(value):
+    """The previous TimeManager.parse_datetime implementation"""
+    dt = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+def strptime_format(timestamp):
+    """The previous TimeManager.format_utc_datetime implementation"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def bench(name, func, args):
+    """Time func over args and print microseconds per call"""
+    start = _now_us()
+    for arg in args:
+        func(arg)
+    elapsed = _elapsed_us(start)
+    print(f"{name:<24} {elapsed / len(args):8.2f} us/call")
+    return elapsed
+
+def main():
+    strings = _sample_timestamps(ITERATIONS)
+    offsets = [s[:-1] + "-07:00" for s in strings]
+    stamps = [parse_rfc3339(s) for s in strings]
+
+    print(f"{ITERATIONS} iterations")
+    fast = bench("parse_rfc3339 (Z)", parse_rfc3339, strings)
+    bench("parse_rfc3339 (offset)", parse_rfc3339, offsets)
+    fast_fmt = bench("format_rfc3339", format_rfc3339, stamps)
+
+    if datetime is None or not hasattr(datetime, "strptime"):
+        print("datetime.strptime not available, skipping comparison")
+        return
+    slow = bench("strptime parse", strptime_parse, strings)
+    slow_fmt = bench("strftime format", strptime_format, stamps)
+    print(f"parse speedup:  {slow / fast:.1f}x")
+    print(f"format speedup: {slow_fmt / fast_fmt:.1f}x")
+
+if __name__ == '__main__':
+    main()
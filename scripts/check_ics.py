@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""Check the iCalendar and CalDAV readers against the fixtures in scripts/fixtures.
+
+Each fixture is fed whole and in chunks of 1, 7 and 512 bytes, so lines,
+folds, tags and entities get split at every possible point, and the busy
+intervals must match the expected ones exactly. A feed is then served
+through sim.CannedTransport to check ETag revalidation, redirects and the
+download cache, and a CalDAV REPORT to check that a 303 is followed with GET.
+
+    python scripts/check_ics.py             run the checks, exit 1 on a mismatch
+    python scripts/check_ics.py --big=8     also stream a generated 8 MB feed and
+                                            report time and peak memory
+"""
+import asyncio
+import sys
+import time
+
+sys.path.insert(0, ".")
+import config
+import hal
+import sim
+from ics import ICSParser, Window, MultistatusReader, ICSFeed
+from http_client import HTTPClient
+from time_manager import parse_rfc3339, format_rfc3339
+from log_config import Logger, ConsoleSink, ERROR
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+FIXTURES = "scripts/fixtures/"
+CHUNKS = (None, 1, 7, 512)
+
+def _t(value):
+    return parse_rfc3339(value)
+
+# fixture, UTC_OFFSET, window, expected busy intervals in UTC
+CASES = (
+    ("weekly.ics", 0, ("2025-03-10T00:00:00Z", "2025-03-17T00:00:00Z"), (
+        ("2025-03-10T07:00:00Z", "2025-03-10T07:30:00Z"),  # Daily until the 11th
+        ("2025-03-10T14:00:00Z", "2025-03-10T15:00:00Z"),  # Every other Monday
+        ("2025-03-11T07:00:00Z", "2025-03-11T07:30:00Z"),
+        ("2025-03-11T09:00:00Z", "2025-03-11T09:15:00Z"),  # Standup; Monday cancelled, Wednesday excluded
+        ("2025-03-13T09:00:00Z", "2025-03-13T09:15:00Z"),
+        ("2025-03-13T15:00:00Z", "2025-03-13T16:00:00Z"),  # TZID taken as UTC_OFFSET
+        ("2025-03-14T10:00:00Z", "2025-03-14T10:30:00Z"),  # Friday standup moved
+        ("2025-03-15T00:00:00Z", "2025-03-16T00:00:00Z"),  # All-day
+        ("2025-03-15T20:00:00Z", "2025-03-15T21:00:00Z"),  # COUNT=3
+        ("2025-03-16T20:00:00Z", "2025-03-16T21:00:00Z"),
+    )),
+    ("monthly.ics", 60, ("2025-03-01T00:00:00Z", "2025-04-01T00:00:00Z"), (
+        ("2025-03-03T09:00:00Z", "2025-03-03T09:30:00Z"),  # First weekday of the month
+        ("2025-03-03T12:00:00Z", "2025-03-03T13:00:00Z"),  # Weekly, COUNT=4
+        ("2025-03-09T23:00:00Z", "2025-03-10T23:00:00Z"),  # Yearly all-day, local midnight
+        ("2025-03-10T12:00:00Z", "2025-03-10T13:00:00Z"),
+        ("2025-03-15T07:00:00Z", "2025-03-15T08:00:00Z"),  # 15th and last day, floating time
+        ("2025-03-28T15:00:00Z", "2025-03-28T16:00:00Z"),  # Last Friday
+        ("2025-03-31T07:00:00Z", "2025-03-31T08:00:00Z"),
+    )),
+    ("caldav_report.xml", 0, ("2025-03-10T00:00:00Z", "2025-03-17T00:00:00Z"), (
+        ("2025-03-10T17:00:00Z", "2025-03-10T17:15:00Z"),  # From a CDATA section
+        ("2025-03-11T17:00:00Z", "2025-03-11T17:15:00Z"),
+        ("2025-03-12T11:00:00Z", "2025-03-12T12:00:00Z"),  # From escaped text
+    )),
+)
+
+def _quiet_logger():
+    return Logger("check_ics", ERROR, [ConsoleSink()])
+
+def _read(name):
+    with open(FIXTURES + name, "rb") as f:
+        return f.read()
+
+def parse(data, start, end, chunk, caldav):
+    """Busy intervals and the window from data fed in pieces of chunk bytes"""
+    window = Window(start, end)
+    parser = ICSParser(window.add, start, end)
+    sink = MultistatusReader(parser) if caldav else parser
+    step = chunk or len(data)
+    for i in range(0, len(data), step):
+        sink.feed(data[i:i + step])
+    parser.close()
+    return sorted(window.intervals()), window
+
+def _show(intervals):
+    return ", ".join("%s-%s" % (format_rfc3339(s)[5:16], format_rfc3339(e)[11:16]) for s, e in intervals)
+
+def check_fixtures():
+    failures = 0
+    saved = config.UTC_OFFSET
+    try:
+        for name, offset, (lo, hi), expected in CASES:
+            config.UTC_OFFSET = offset
+            data = _read(name)
+            expected = [(_t(s), _t(e)) for s, e in expected]
+            for chunk in CHUNKS:
+                got, window = parse(data, _t(lo), _t(hi), chunk, name.endswith(".xml"))
+                label = "%s in %s" % (name, "one piece" if chunk is None else "%s byte chunks" % chunk)
+                if got == expected:
+                    print("ok    %s (%s busy, %s skipped)" % (label, len(got), window.skipped))
+                else:
+                    failures += 1
+                    print("FAIL  %s" % label)
+                    print("      expected %s" % _show(expected))
+                    print("      got      %s" % _show(got))
+    finally:
+        config.UTC_OFFSET = saved
+    return failures
+
+def check_feed():
+    """ETag revalidation, a permanent redirect and the download cache through HTTPClient"""
+    body = _read("weekly.ics")
+    requests = []
+
+    def handler(method, path, headers, data):
+        requests.append((method, path, headers.get("If-None-Match")))
+        if path == "/old.ics":
+            return 301, {"Location": "/team.ics"}, b""
+        if headers.get("If-None-Match") == '"v1"':
+            return 304, {"ETag": '"v1"'}, b""
+        return 200, {"Content-Type": "text/calendar", "ETag": '"v1"'}, body
+
+    saved = (hal.open_connection, config.ICS_REFRESH_INTERVAL)
+    hal.install(open_connection=sim.CannedTransport(handler))
+    config.ICS_REFRESH_INTERVAL = 300
+    logger = _quiet_logger()
+    feed = ICSFeed("webcal://cal.example.com/old.ics", HTTPClient(logger), logger)
+    start = _t("2025-03-10T00:00:00Z")
+    day = 86400
+    failures = 0
+    try:
+        first = sorted(asyncio.run(feed.fetch(start, start + day)))
+        cached = sorted(asyncio.run(feed.fetch(start + 60, start + 60 + day)))
+        downloads = len(requests)
+        revalidated = sorted(asyncio.run(feed.fetch(start + 600, start + 600 + day)))
+    finally:
+        hal.open_connection, config.ICS_REFRESH_INTERVAL = saved
+    checks = (
+        ("relative redirect followed", first == [(_t("2025-03-10T07:00:00Z"), _t("2025-03-10T07:30:00Z")),
+                                        (_t("2025-03-10T14:00:00Z"), _t("2025-03-10T15:00:00Z"))]),
+        ("permanent redirect remembered", feed.url == "https://cal.example.com/team.ics"),
+        ("second fetch served from the cache", downloads == 2 and cached == first),
+        ("stale cache revalidated with the ETag", requests[-1] == ("GET", "/team.ics", '"v1"')),
+        ("304 reuses the parsed intervals", feed.stats["not_modified"] == 1 and revalidated == first),
+    )
+    for label, passed in checks:
+        print("%s  feed: %s" % ("ok  " if passed else "FAIL", label))
+        failures += not passed
+    return failures
+
+def check_caldav_redirect():
+    """A REPORT answered with 303 See Other is followed with a GET for the result"""
+    body = _read("caldav_report.xml")
+    requests = []
+
+    def handler(method, path, headers, data):
+        requests.append((method, path, len(data)))
+        if method == "REPORT":
+            return 303, {"Location": "results/1"}, b""
+        return 207, {"Content-Type": "application/xml"}, body
+
+    saved = hal.open_connection
+    hal.install(open_connection=sim.CannedTransport(handler))
+    logger = _quiet_logger()
+    feed = ICSFeed({"url": "https://dav.example.com/dav/team/", "caldav": True}, HTTPClient(logger), logger)
+    start = _t("2025-03-10T00:00:00Z")
+    try:
+        got = sorted(asyncio.run(feed.fetch(start, start + 7 * 86400)))
+    finally:
+        hal.open_connection = saved
+    expected = [(_t(s), _t(e)) for s, e in CASES[2][3]]
+    checks = (
+        ("303 after REPORT fetched with GET", [r[:2] for r in requests] == [("REPORT", "/dav/team/"), ("GET", "/dav/team/results/1")]
+         and requests[1][2] == 0),
+        ("303 result parsed", got == expected),
+    )
+    failures = 0
+    for label, passed in checks:
+        print("%s  caldav: %s" % ("ok  " if passed else "FAIL", label))
+        failures += not passed
+    return failures
+
+def check_auth_redirect():
+    """Credentials follow redirects on the feed's origin and are dropped for any other"""
+    body = _read("weekly.ics")
+    requests = []
+
+    def handler(method, path, headers, data):
+        requests.append((path, headers.get("Authorization")))
+        if path == "/old.ics":
+            return 301, {"Location": "/team.ics"}, b""
+        if path == "/team.ics":
+            return 302, {"Location": "https://cdn.example.net/files/team.ics"}, b""
+        return 200, {"Content-Type": "text/calendar"}, body
+
+    saved = hal.open_connection
+    hal.install(open_connection=sim.CannedTransport(handler))
+    logger = _quiet_logger()
+    feed = ICSFeed({"url": "https://cal.example.com/old.ics", "user": "me", "password": "secret"}, HTTPClient(logger), logger)
+    start = _t("2025-03-10T00:00:00Z")
+    try:
+        got = asyncio.run(feed.fetch(start, start + 86400))
+    finally:
+        hal.open_connection = saved
+    auth = [a is not None for _, a in requests]
+    checks = (
+        ("credentials kept on the same origin", auth[:2] == [True, True]),
+        ("credentials dropped for another host", auth[2:] == [False] and got is not None),
+        ("same-origin permanent redirect remembered", feed.url == "https://cal.example.com/team.ics"),
+    )
+    failures = 0
+    for label, passed in checks:
+        print("%s  auth: %s" % ("ok  " if passed else "FAIL", label))
+        failures += not passed
+    return failures
+
+def _big_feed(megabytes):
+    """Chunks of a generated feed: many past events, a few recurring ones and long descriptions"""
+    filler = "DESCRIPTION:" + "Lorem ipsum dolor sit amet\\, consectetur adipiscing elit. " * 3
+    lines = []
+    for i in range(len(filler) // 74 + 1):
+        lines.append(("" if i == 0 else " ") + filler[i * 74:(i + 1) * 74])
+    description = "\r\n".join(lines) + "\r\n"
+    size = 0
+    i = 0
+    yield b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+    while size < megabytes * 1000000:
+        start = format_rfc3339(_t("2020-01-01T09:00:00Z") + i * 3600).replace("-", "").replace(":", "")
+        rule = "RRULE:FREQ=WEEKLY;BYDAY=MO,WE\r\n" if i % 500 == 0 else ""
+        event = ("BEGIN:VEVENT\r\nUID:%s@example.com\r\nDTSTART:%s\r\nDURATION:PT30M\r\n%s%s"
+                 "BEGIN:VALARM\r\nTRIGGER:-PT5M\r\nACTION:DISPLAY\r\nEND:VALARM\r\nEND:VEVENT\r\n"
+                 % (i, start, rule, description)).encode()
+        size += len(event)
+        i += 1
+        yield event
+    yield b"END:VCALENDAR\r\n"
+
+def check_big(megabytes):
+    start = _t("2025-03-10T00:00:00Z")
+    window = Window(start, start + 7 * 86400)
+    parser = ICSParser(window.add, window.start, window.end)
+    if tracemalloc:
+        tracemalloc.start()
+    began = time.time()
+    pending = bytearray()
+    for event in _big_feed(megabytes):
+        pending.extend(event)
+        while len(pending) >= 512:
+            # The sizes HTTPClient hands to a sink
+            parser.feed(bytes(pending[:512]))
+            del pending[:512]
+    parser.feed(bytes(pending))
+    parser.close()
+    elapsed = time.time() - began
+    peak = tracemalloc.get_traced_memory()[1] if tracemalloc else 0
+    if tracemalloc:
+        tracemalloc.stop()
+    print("big:  %s MB, %s events, %s busy in the window, %.1f s, peak %s KB"
+          % (megabytes, parser.count, len(window.intervals()), elapsed, peak // 1024))
+
+def main():
+    failures = check_fixtures() + check_feed() + check_caldav_redirect() + check_auth_redirect()
+    for arg in sys.argv[1:]:
+        if arg.startswith("--big"):
+            check_big(int(arg.partition("=")[2] or 4))
+    if failures:
+        print("%s checks failed" % failures)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Run a hub against the mock calendar server and many simulated lights on localhost.
+
+Each simulated light is a UDP endpoint that registers for one of the groups
+with HELLO frames and records the STATUS frames it receives. Halfway through,
+a meeting is added to every group's calendar so the change has to reach all
+lights. Needs a config_local.py with a service account key that the host's
+jwt package can sign with.
+
+    python scripts/hub_loadtest.py [devices] [seconds]
+"""
+import asyncio
+import sys
+import time
+
+sys.path.insert(0, ".")
+sys.path.insert(0, "scripts")
+import config
+import sim
+import hal
+import mock_calendar_server
+from hub import Hub
+from hub_protocol import decode, encode_hello, STATUS
+from time_manager import format_rfc3339
+from log_config import setup_logging
+
+MOCK_PORT = 8091
+HUB_PORT = 5105
+GROUPS = 4
+API_HOSTS = ("www.googleapis.com", "oauth2.googleapis.com")
+
+class Light(asyncio.DatagramProtocol):
+    """One simulated light"""
+    def __init__(self, group):
+        self.group = group
+        self.transport = None
+        self.frames = 0
+        self.status = None
+        self.changed_at = None  # When the busy flag was first seen set
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.sendto(encode_hello(self.group), ("127.0.0.1", HUB_PORT))
+
+    def datagram_received(self, data, addr):
+        frame = decode(data)
+        if frame and frame[0] == STATUS and frame[3] == self.group:
+            self.frames += 1
+            self.status = frame[4]
+            if self.status[0] and self.changed_at is None:
+                self.changed_at = time.time()
+
+def raise_fd_limit(needed):
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < needed:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, needed), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+async def run(devices, seconds, state):
+    loggers = setup_logging()
+    hub = Hub(loggers['main'], groups={g + 1: [f"room{g}@example.com"] for g in range(GROUPS)})
+    hub_task = asyncio.create_task(hub.run("127.0.0.1", HUB_PORT))
+    await asyncio.sleep(0.5)
+
+    loop = asyncio.get_event_loop()
+    lights = []
+    for i in range(devices):
+        _, light = await loop.create_datagram_endpoint(lambda: Light(i % GROUPS + 1),
+                                                       local_addr=("127.0.0.1", 0))
+        lights.append(light)
+    print(f"{len(hub.devices)} lights registered")
+
+    await asyncio.sleep(seconds / 2)
+    booked = time.time()
+    for g in range(GROUPS):
+        state.upsert(f"room{g}@example.com", {"start": {"dateTime": format_rfc3339(booked - 60)},
+                                              "end": {"dateTime": format_rfc3339(booked + 1800)}})
+    await asyncio.sleep(seconds / 2)
+
+    hub_task.cancel()
+    for light in lights:
+        light.transport.close()
+    return hub, lights, booked
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    raise_fd_limit(devices + 64)
+
+    # Refresh quickly so the mid-run booking is picked up within the test
+    config.UPDATE_INTERVAL = 1
+    config.REFRESH_MAX_INTERVAL = 2
+    config.TOKEN_CACHE_FILE = "/tmp/hub_loadtest_token.json"
+    server = mock_calendar_server.serve(port=MOCK_PORT)
+    state = mock_calendar_server.Handler.state
+    hal.install(open_connection=sim.LoopbackTransport({host: ("127.0.0.1", MOCK_PORT) for host in API_HOSTS}))
+
+    try:
+        hub, lights, booked = asyncio.run(run(devices, seconds, state))
+    finally:
+        server.shutdown()
+
+    updated = [light for light in lights if light.changed_at]
+    delays = sorted(light.changed_at - booked for light in updated)
+    print(f"{devices} lights, {hub.stats['frames_sent']} frames sent, {hub.stats['hellos']} HELLOs, "
+          f"{hub.stats['refreshes']} calendar refreshes, {state.stats['requests']} API requests")
+    print(f"{len(updated)}/{devices} lights saw the new meeting")
+    if delays:
+        print(f"propagation: median {delays[len(delays) // 2]:.2f}s, max {delays[-1]:.2f}s")
+    if len(updated) != devices:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
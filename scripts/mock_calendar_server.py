@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Google token and Calendar events endpoints.
+
+Point CALENDAR_API_BASE_URL at http://<host>:8080/calendar/v3 and
+OAUTH_TOKEN_URL at http://<host>:8080/token to run the busy light against it.
+Serves events.list (with sync tokens, ETags and paging), freeBusy.query and
+events.watch / channels.stop. Watch channels get a "sync" notification POST
+when created and an "exists" POST to their address after every change.
+
+Admin endpoints for driving a scenario:
+  POST   /admin/calendars/<id>/events         add or update an event (JSON body)
+  DELETE /admin/calendars/<id>/events/<eid>   cancel an event
+  POST   /admin/expire-sync-tokens            make every issued sync token return 410
+  POST   /admin/expire-channels               drop every watch channel without notice
+  GET    /admin/stats                         request and byte counters
+"""
+import json
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+API_PREFIX = "/calendar/v3"
+
+class CalendarState:
+    """In-memory calendars with a change log for incremental sync"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.min_valid_seq = 0
+        self.calendars = {}  # calendar id -> {event id: (seq, event)}
+        self.channels = {}  # channel id -> watch channel resource plus calendarId/address/token
+        self.stats = {"requests": 0, "not_modified": 0, "gone": 0, "bytes": 0, "notifications": 0}
+
+    def upsert(self, calendar_id, event):
+        """Add or replace an event, returning the stored resource"""
+        with self.lock:
+            self.seq += 1
+            event = dict(event)
+            event.setdefault("id", f"evt{self.seq}")
+            event.setdefault("status", "confirmed")
+            self.calendars.setdefault(calendar_id, {})[event["id"]] = (self.seq, event)
+        self.notify(calendar_id)
+        return event
+
+    def cancel(self, calendar_id, event_id):
+        """Mark an event cancelled so incremental syncs report the deletion"""
+        with self.lock:
+            events = self.calendars.get(calendar_id, {})
+            if event_id not in events:
+                return False
+            self.seq += 1
+            events[event_id] = (self.seq, {"id": event_id, "status": "cancelled"})
+        self.notify(calendar_id)
+        return True
+
+    def watch(self, calendar_id, request):
+        """Open a push channel; returns the channel resource"""
+        ttl = int(request.get("params", {}).get("ttl", "604800"))
+        with self.lock:
+            channel = {
+                "kind": "api#channel",
+                "id": request["id"],
+                "resourceId": f"res-{calendar_id}",
+                "resourceUri": f"{API_PREFIX}/calendars/{calendar_id}/events",
+                "expiration": str(int((time.time() + ttl) * 1000)),
+            }
+            self.channels[request["id"]] = dict(channel, calendarId=calendar_id, address=request["address"],
+                                                token=request.get("token"), messages=0)
+        self._post(self.channels[request["id"]], "sync")
+        return channel
+
+    def stop(self, request):
+        with self.lock:
+            return self.channels.pop(request.get("id"), None) is not None
+
+    def notify(self, calendar_id):
+        """Tell every live channel on a calendar that it changed"""
+        now_ms = time.time() * 1000
+        with self.lock:
+            channels = [c for c in self.channels.values()
+                        if c["calendarId"] == calendar_id and int(c["expiration"]) > now_ms]
+        for channel in channels:
+            self._post(channel, "exists")
+
+    def _post(self, channel, resource_state):
+        """Deliver a notification from a background thread, like Google's webhook calls"""
+        channel["messages"] += 1
+        headers = {
+            "X-Goog-Channel-ID": channel["id"],
+            "X-Goog-Channel-Token": channel["token"] or "",
+            "X-Goog-Resource-ID": channel["resourceId"],
+            "X-Goog-Resource-URI": channel["resourceUri"],
+            "X-Goog-Resource-State": resource_state,
+            "X-Goog-Message-Number": str(channel["messages"]),
+        }
+
+        def deliver():
+            request = urllib.request.Request(channel["address"], data=b"", headers=headers, method="POST")
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+                self.stats["notifications"] += 1
+            except OSError:
+                pass
+        threading.Thread(target=deliver, daemon=True).start()
+
+    def etag(self, calendar_id):
+        """Collection ETag changes whenever any event in the calendar changes"""
+        events = self.calendars.get(calendar_id, {})
+        latest = max([seq for seq, _ in events.values()] or [0])
+        return f'"{calendar_id}-{latest}"'
+
+    def list_events(self, calendar_id, query):
+        """Return (status, body) for an events.list call"""
+        events = self.calendars.get(calendar_id, {})
+        sync_token = query.get("syncToken")
+        if sync_token:
+            since = int(sync_token[1:])
+            if since < self.min_valid_seq:
+                self.stats["gone"] += 1
+                return 410, {"error": {"code": 410, "message": "Sync token is no longer valid"}}
+            items = [e for seq, e in events.values() if seq > since]
+        else:
+            time_min = query.get("timeMin")
+            time_max = query.get("timeMax")
+            items = [e for _, e in events.values() if e.get("status") != "cancelled"]
+            if time_min:
+                items = [e for e in items if _event_end(e) > time_min]
+            if time_max:
+                items = [e for e in items if _event_start(e) < time_max]
+        items.sort(key=_event_start)
+
+        offset = int(query.get("pageToken", "0"))
+        page_size = int(query.get("maxResults", "250"))
+        page = items[offset:offset + page_size]
+        body = {"kind": "calendar#events", "etag": self.etag(calendar_id), "items": page}
+        if offset + page_size < len(items):
+            body["nextPageToken"] = str(offset + page_size)
+        else:
+            body["nextSyncToken"] = f"s{self.seq}"
+        return 200, body
+
+    def free_busy(self, query):
+        """Return (status, body) for a freeBusy.query call"""
+        time_min = query.get("timeMin", "")
+        time_max = query.get("timeMax", "~")
+        calendars = {}
+        for item in query.get("items", []):
+            calendar_id = item["id"]
+            if calendar_id not in self.calendars:
+                calendars[calendar_id] = {"busy": [], "errors": [{"domain": "global", "reason": "notFound"}]}
+                continue
+            intervals = sorted(
+                (_event_start(e), _event_end(e)) for _, e in self.calendars[calendar_id].values()
+                if e.get("status") != "cancelled" and e.get("transparency") != "transparent"
+                and _event_end(e) > time_min and _event_start(e) < time_max
+            )
+            busy = []
+            for start, end in intervals:
+                if busy and start <= busy[-1][1]:
+                    busy[-1][1] = max(busy[-1][1], end)
+                else:
+                    busy.append([start, end])
+            calendars[calendar_id] = {"busy": [{"start": s, "end": e} for s, e in busy]}
+        return 200, {"kind": "calendar#freeBusy", "timeMin": time_min, "timeMax": time_max, "calendars": calendars}
+
+def _event_start(event):
+    return event.get("start", {}).get("dateTime", "")
+
+def _event_end(event):
+    return event.get("end", {}).get("dateTime", "")
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections open like the real endpoints
+    state = None
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.state.stats["bytes"] += len(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        state = self.state
+
+        if url.path == "/admin/stats":
+            return self._send(200, state.stats)
+
+        if url.path.startswith(API_PREFIX) and len(parts) == 5 and parts[2] == "calendars" and parts[4] == "events":
+            calendar_id = parts[3]
+            with state.lock:
+                state.stats["requests"] += 1
+                etag = state.etag(calendar_id)
+                if query.get("syncToken") and self.headers.get("If-None-Match") == etag:
+                    state.stats["not_modified"] += 1
+                    return self._send(304, headers={"ETag": etag})
+                status, body = state.list_events(calendar_id, query)
+            return self._send(status, body, {"ETag": etag} if status == 200 else None)
+
+        self._send(404, {"error": {"code": 404}})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        state = self.state
+
+        if url.path == "/token":
+            self._read_json()
+            return self._send(200, {"access_token": "mock-access-token", "expires_in": 3600, "token_type": "Bearer"})
+
+        if url.path == API_PREFIX + "/freeBusy":
+            body = self._read_json()
+            with state.lock:
+                state.stats["requests"] += 1
+                status, body = state.free_busy(body)
+            return self._send(status, body)
+
+        if url.path.startswith(API_PREFIX) and len(parts) == 6 and parts[2] == "calendars" and parts[5] == "watch":
+            return self._send(200, state.watch(parts[3], self._read_json()))
+
+        if url.path == API_PREFIX + "/channels/stop":
+            state.stop(self._read_json())
+            return self._send(204)
+
+        if url.path == "/admin/expire-channels":
+            with state.lock:
+                state.channels = {}
+            return self._send(200, {"ok": True})
+
+        if url.path == "/admin/expire-sync-tokens":
+            with state.lock:
+                state.min_valid_seq = state.seq + 1
+            return self._send(200, {"ok": True})
+
+        if len(parts) == 4 and parts[0] == "admin" and parts[1] == "calendars" and parts[3] == "events":
+            return self._send(200, state.upsert(parts[2], self._read_json()))
+
+        self._send(404, {"error": {"code": 404}})
+
+    def do_DELETE(self):
+        parts = [unquote(p) for p in urlparse(self.path).path.split("/") if p]
+        if len(parts) == 5 and parts[0] == "admin" and parts[1] == "calendars" and parts[3] == "events":
+            if self.state.cancel(parts[2], parts[4]):
+                return self._send(200, {"ok": True})
+        self._send(404, {"error": {"code": 404}})
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(host="127.0.0.1", port=8080, state=None):
+    """Start the mock server in a background thread and return it"""
+    Handler.state = state or CalendarState()
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def main():
+    """Run the mock server until interrupted"""
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    server = serve("0.0.0.0", port)
+    print(f"Mock Calendar API listening on port {port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
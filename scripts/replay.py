@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""Run the firmware through days of schedule on a virtual clock.
+
+The unmodified main loop runs on simulated hardware with sim.VirtualClock:
+whenever every task is waiting, time jumps to the next timer, so a week of
+refreshes, renders and token renewals takes seconds. Calendar requests are
+answered in memory from a schedule of changes, either generated (a weekday
+standup, meeting chains, late additions, cancellations and an API outage) or
+loaded from a recording of real responses.
+
+Each time the LEDs change, a snapshot line gives the virtual local time, the
+colour of the first LED and the rightmost column (see VirtualMatrix.describe).
+Afterwards the real time spent per virtual step is summarised by kind: refresh
+steps sent requests, render steps wrote frames, idle steps did neither.
+
+    python scripts/replay.py                  a generated week, seed 1
+    python scripts/replay.py --days=2 --seed=7 --start=2025-06-02
+    python scripts/replay.py --save=F         write the snapshots to F
+    python scripts/replay.py --check=F        compare the snapshots with F, exit 1 on a difference
+    python scripts/replay.py --replay=F       replay a recording instead of a generated schedule,
+                                              for as long as it lasted or --days
+    python scripts/replay.py --record=F [seconds] [--mock]
+                                              run in real time against the real APIs (or the mock
+                                              server) and save the responses to F
+    python scripts/replay.py --log=INFO       show firmware logs, stamped with virtual time
+    python scripts/replay.py --echo           draw every frame in the terminal
+
+Recordings keep response times, statuses and event times only: tokens,
+summaries and request headers are dropped and calendar ids are replaced with
+calendar-1, calendar-2 and so on. Needs a config_local.py with a service
+account key, as the firmware signs a token for every hour of virtual time.
+scripts/fixtures/replay_week.txt holds the snapshots of the default run with
+the shipped config.
+"""
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+
+sys.path.insert(0, ".")
+sys.path.insert(0, "scripts")
+import config
+import hal
+import sim
+import request_policy
+import mock_calendar_server
+from http_client import HTTPClient
+from time_manager import parse_rfc3339, format_rfc3339
+from log_config import setup_logging, RingSink, LEVELS
+
+DEFAULT_START = "2025-03-10"  # A Monday
+DAY = 86400
+# Settings the replay runs with: no per-frame work, no push channels or hub, one sample a minute
+REPLAY_CONFIG = {
+    "ANIMATION_ENABLED": False,
+    "SCROLL_TEXT": False,
+    "WATCH_ENABLED": False,
+    "HUB_CLIENT_MODE": False,
+    "METRICS_ENABLED": False,
+    "ICS_FEEDS": [],
+    "POWER_SAMPLE_INTERVAL": 60,
+    "CALENDAR_API_BASE_URL": "https://www.googleapis.com/calendar/v3",
+    "OAUTH_TOKEN_URL": "https://oauth2.googleapis.com/token",
+}
+
+def _local(t):
+    """'YYYY-MM-DD HH:MM:SS' in local time"""
+    return format_rfc3339(t + config.UTC_OFFSET * 60)[:19].replace("T", " ")
+
+def _event(event_id, start, end):
+    return {"id": event_id, "start": {"dateTime": format_rfc3339(start)},
+            "end": {"dateTime": format_rfc3339(end)}}
+
+def _cancelled(event_id):
+    return {"id": event_id, "status": "cancelled"}
+
+def synthetic(start, days, seed, calendars=2):
+    """(calendar ids, changes, outages) for days of generated weekdays from local midnight start
+
+    changes are (time, calendar id, event) with cancellations as cancelled
+    events; outages are (start, end) spans in which every request gets a 503.
+    """
+    rng = random.Random(seed)
+    ids = ["calendar-%s" % (i + 1) for i in range(calendars)]
+    changes = []
+    outages = []
+    count = 0
+    for day in range(days):
+        midnight = start + day * DAY
+        if ((midnight + config.UTC_OFFSET * 60) // DAY + 3) % 7 >= 5:
+            continue  # Weekend
+        known = max(start, midnight - DAY)  # Most meetings are booked by the day before
+        changes.append((known, ids[0], _event("standup-%s" % day, midnight + 9 * 3600 + 1800, midnight + 9 * 3600 + 2700)))
+        meetings = []
+        t = midnight + 10 * 3600
+        for _ in range(rng.randint(2, 5)):
+            begin = t + rng.choice((0, 0, 1800, 3600, 5400))  # Half are back-to-back
+            end = begin + rng.choice((1800, 1800, 2700, 3600))
+            if end > midnight + 18 * 3600:
+                break
+            count += 1
+            meetings.append(("m%s" % count, rng.choice(ids), begin, end))
+            t = end
+        for event_id, calendar_id, begin, end in meetings:
+            changes.append((known, calendar_id, _event(event_id, begin, end)))
+        if rng.random() < 0.5:
+            # Booked an hour before it starts
+            count += 1
+            begin = midnight + rng.choice((13, 15, 16)) * 3600 + 900
+            changes.append((begin - 3600, rng.choice(ids), _event("m%s" % count, begin, begin + 1800)))
+        if meetings and rng.random() < 0.4:
+            event_id, calendar_id, begin, _ = rng.choice(meetings)
+            changes.append((max(known, begin - 2 * 3600), calendar_id, _cancelled(event_id)))
+        if day == 2:
+            outages.append((midnight + 11 * 3600, midnight + 12 * 3600 + 1800))
+    changes.sort(key=lambda c: c[0])
+    return ids, changes, outages
+
+class Recorder:
+    """Tees every HTTPClient response into a list of exchanges"""
+    def __init__(self):
+        self.exchanges = []
+        self.calendars = {}  # real calendar id -> anonymous one
+        self.events = {}  # real event id -> anonymous one
+
+    def install(self):
+        recorder = self
+        request = HTTPClient.request
+
+        async def recording_request(client, method, url, data=None, json=None, headers=None, sink=None):
+            body = bytearray()
+            tee = None
+            if sink:
+                def tee(chunk):
+                    body.extend(chunk)
+                    sink(chunk)
+            response = await request(client, method, url, data=data, json=json, headers=headers, sink=tee)
+            recorder.add(hal.clock(), method, url, response.status_code, response.content or bytes(body))
+            return response
+        HTTPClient.request = recording_request
+
+    def _calendar(self, calendar_id):
+        if calendar_id not in self.calendars:
+            self.calendars[calendar_id] = "calendar-%s" % (len(self.calendars) + 1)
+        return self.calendars[calendar_id]
+
+    def _item(self, item):
+        event_id = self.events.setdefault(item.get("id"), "e%s" % (len(self.events) + 1))
+        kept = {"id": event_id}
+        for key in ("status", "transparency", "start", "end"):
+            if key in item:
+                kept[key] = item[key]
+        return kept
+
+    def add(self, now, method, url, status, content):
+        url = urlparse(url)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        exchange = {"time": now, "status": status, "kind": "other"}
+        try:
+            body = json.loads(content) if status == 200 else {}
+        except ValueError:
+            body = {}
+        if url.path.endswith("/token"):
+            exchange["kind"] = "token"
+        elif len(parts) >= 2 and parts[-1] == "events" and parts[-3] == "calendars" and method == "GET":
+            exchange.update(kind="events", calendar=self._calendar(parts[-2]), sync="syncToken" in query,
+                            page="pageToken" in query, timeMin=query.get("timeMin"), timeMax=query.get("timeMax"),
+                            more="nextPageToken" in body, items=[self._item(i) for i in body.get("items", [])])
+        elif url.path.endswith("/freeBusy"):
+            exchange.update(kind="freebusy", timeMin=body.get("timeMin"), timeMax=body.get("timeMax"),
+                            busy={self._calendar(c): [[b["start"], b["end"]] for b in v.get("busy", [])]
+                                  for c, v in body.get("calendars", {}).items()})
+        self.exchanges.append(exchange)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"calendars": sorted(self.calendars.values()), "exchanges": self.exchanges}, f)
+
+def load_recording(path):
+    """(start, seconds, calendar ids, changes, outages) rebuilt from a recording
+
+    An event is taken to appear, change or go away at the time a response
+    first showed it. Full-window fetches and freeBusy answers also cancel
+    known events in their window that they no longer list, and a run of 429
+    and 5xx answers becomes an outage until the next success.
+    """
+    with open(path) as f:
+        recording = json.load(f)
+    exchanges = recording["exchanges"]
+    known = {c: {} for c in recording["calendars"]}  # calendar id -> {event id: event}
+    changes = []
+    outages = []
+    failing = None
+    seen = {}  # calendar id -> event ids listed by the full-window fetch in progress
+
+    def put(t, calendar_id, event):
+        events = known.setdefault(calendar_id, {})
+        if event.get("status") == "cancelled":
+            if events.pop(event["id"], None) is not None:
+                changes.append((t, calendar_id, _cancelled(event["id"])))
+        elif events.get(event["id"]) != event:
+            events[event["id"]] = event
+            changes.append((t, calendar_id, event))
+
+    def prune(t, calendar_id, time_min, time_max, listed):
+        time_max = time_max or "~"  # An incremental sync's first fetch is open-ended
+        for event_id, event in list(known.get(calendar_id, {}).items()):
+            if event_id not in listed and event["end"]["dateTime"] > time_min and event["start"]["dateTime"] < time_max:
+                put(t, calendar_id, _cancelled(event_id))
+
+    for exchange in exchanges:
+        t = exchange["time"]
+        status = exchange["status"]
+        if status == 429 or status >= 500:
+            failing = t if failing is None else failing
+            continue
+        if failing is not None:
+            outages.append((failing, t))
+            failing = None
+        if status != 200:
+            continue
+        if exchange["kind"] == "events":
+            calendar_id = exchange["calendar"]
+            listed = seen.setdefault(calendar_id, set()) if not exchange["sync"] else set()
+            if not exchange["sync"] and not exchange["page"]:
+                listed.clear()
+            for item in exchange["items"]:
+                listed.add(item["id"])
+                put(t, calendar_id, item)
+            if not exchange["sync"] and not exchange["more"] and exchange["timeMin"]:
+                prune(t, calendar_id, exchange["timeMin"], exchange["timeMax"], listed)
+        elif exchange["kind"] == "freebusy":
+            for calendar_id, busy in exchange["busy"].items():
+                listed = set()
+                for begin, end in busy:
+                    event = _event("busy-%s-%s" % (begin, end), parse_rfc3339(begin), parse_rfc3339(end))
+                    listed.add(event["id"])
+                    put(t, calendar_id, event)
+                prune(t, calendar_id, exchange["timeMin"], exchange["timeMax"], listed)
+    if failing is not None:
+        outages.append((failing, exchanges[-1]["time"] + 1))
+    start = int(exchanges[0]["time"]) if exchanges else int(time.time())
+    seconds = (int(exchanges[-1]["time"]) + 60 - start) if exchanges else DAY
+    return start, seconds, sorted(known), changes, outages
+
+class ReplayServer:
+    """Answers the token, events.list and freeBusy requests from a schedule of changes
+
+    Each change is applied to a mock_calendar_server.CalendarState once the
+    virtual clock passes its time, so sync tokens, ETags and pagination behave
+    as they do against the mock server. Every request in an outage gets a 503.
+    """
+    def __init__(self, clock, calendar_ids, changes, outages):
+        self.clock = clock
+        self.state = mock_calendar_server.CalendarState()
+        for calendar_id in calendar_ids:
+            self.state.calendars.setdefault(calendar_id, {})
+        self.changes = changes
+        self.applied = 0
+        self.outages = outages
+        self.requests = 0
+        self.failed = 0
+
+    def _apply(self, now):
+        while self.applied < len(self.changes) and self.changes[self.applied][0] <= now:
+            _, calendar_id, event = self.changes[self.applied]
+            if event.get("status") == "cancelled":
+                self.state.cancel(calendar_id, event["id"])
+            else:
+                self.state.upsert(calendar_id, event)
+            self.applied += 1
+
+    def _send(self, status, body=None, headers=None):
+        reply = {"Content-Type": "application/json"}
+        reply.update(headers or {})
+        return status, reply, json.dumps(body).encode() if body is not None else b""
+
+    def __call__(self, method, path, headers, body):
+        now = self.clock.time()
+        self._apply(now)
+        self.requests += 1
+        for begin, end in self.outages:
+            if begin <= now < end:
+                self.failed += 1
+                return self._send(503, {"error": {"code": 503, "message": "Backend Error"}})
+        url = urlparse(path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        state = self.state
+        if url.path == "/token":
+            return self._send(200, {"access_token": "replay-access-token", "expires_in": 3600, "token_type": "Bearer"})
+        if method == "GET" and url.path.startswith(mock_calendar_server.API_PREFIX) and len(parts) == 5 and parts[4] == "events":
+            state.stats["requests"] += 1
+            etag = state.etag(parts[3])
+            if query.get("syncToken") and headers.get("If-None-Match") == etag:
+                state.stats["not_modified"] += 1
+                return self._send(304, headers={"ETag": etag})
+            status, reply = state.list_events(parts[3], query)
+            return self._send(status, reply, {"ETag": etag} if status == 200 else None)
+        if method == "POST" and url.path == mock_calendar_server.API_PREFIX + "/freeBusy":
+            state.stats["requests"] += 1
+            return self._send(*state.free_busy(json.loads(body or b"{}")))
+        return self._send(404, {"error": {"code": 404}})
+
+class SnapshotMatrix(sim.VirtualMatrix):
+    """VirtualMatrix that notes (time, describe()) whenever the picture changes"""
+    def __init__(self, num_leds, echo=False):
+        super().__init__(num_leds, echo=echo, max_frames=2)
+        self.snapshots = []
+
+    def write(self, buf):
+        super().write(buf)
+        text = self.describe()
+        if not self.snapshots or self.snapshots[-1][1] != text:
+            self.snapshots.append((hal.clock(), text))
+
+class StepCosts:
+    """Real time spent at each virtual instant, by local day and kind of step"""
+    def __init__(self, server, matrix):
+        self.server = server
+        self.matrix = matrix
+        self.totals = {}  # (day, kind) -> [steps, total us, max us]
+        self.requests = 0
+        self.frames = 0
+        self.last = time.perf_counter()
+
+    def __call__(self, now, seconds):
+        t = time.perf_counter()
+        us = int((t - self.last) * 1000000)
+        if self.server.requests != self.requests:
+            kind = "refresh"
+        elif self.matrix.writes != self.frames:
+            kind = "render"
+        else:
+            kind = "idle"
+        totals = self.totals.setdefault((_local(now)[:10], kind), [0, 0, 0])
+        totals[0] += 1
+        totals[1] += us
+        totals[2] = max(totals[2], us)
+        self.requests = self.server.requests
+        self.frames = self.matrix.writes
+        self.last = t
+
+    def report(self):
+        print(f"{'day':10} {'kind':8} {'steps':>7} {'mean us':>9} {'max us':>9}")
+        for (day, kind), (steps, total, worst) in sorted(self.totals.items()):
+            print(f"{day:10} {kind:8} {steps:>7} {total // steps:>9} {worst:>9}")
+
+def configure(calendar_ids, workdir):
+    for name, value in REPLAY_CONFIG.items():
+        setattr(config, name, value)
+    config.CALENDAR_IDS = calendar_ids
+    config.SCHEDULE_CACHE_FILE = os.path.join(workdir, "schedule_cache.bin")
+    config.TOKEN_CACHE_FILE = os.path.join(workdir, "token_cache.json")
+
+def replay(start, seconds, calendar_ids, changes, outages, level, echo):
+    """Run the firmware for seconds of virtual time; returns (snapshots, server, costs, real seconds)"""
+    clock = sim.VirtualClock(start)
+    server = ReplayServer(clock, calendar_ids, changes, outages)
+    matrix = SnapshotMatrix(config.LED_COUNT, echo=echo)
+    sim.install(matrix=matrix, transport=sim.CannedTransport(server), clock=clock)
+    costs = StepCosts(server, matrix)
+    clock.on_advance = costs
+
+    import main as firmware
+    firmware.loggers = setup_logging(level, ring=RingSink())
+    loop = clock.attach(asyncio.new_event_loop())
+    asyncio.set_event_loop(loop)
+    began = time.perf_counter()
+    try:
+        loop.run_until_complete(asyncio.wait_for(firmware.run(), seconds))
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        real = time.perf_counter() - began
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+    return matrix.snapshots, server, costs, real
+
+def record(path, seconds, mock, level):
+    """Run the firmware in real time and save what the APIs answered"""
+    recorder = Recorder()
+    recorder.install()
+    transport = None
+    server = None
+    if mock:
+        from simulate import seed, MOCK_PORT, API_HOSTS
+        server = mock_calendar_server.serve(port=MOCK_PORT)
+        seed(mock_calendar_server.Handler.state, time.time())
+        transport = sim.LoopbackTransport({host: ("127.0.0.1", MOCK_PORT) for host in API_HOSTS})
+    sim.install(transport=transport)
+
+    import main as firmware
+    firmware.loggers = setup_logging(level)
+
+    async def run_for():
+        try:
+            await asyncio.wait_for(firmware.run(), seconds)
+        except asyncio.TimeoutError:
+            pass
+    try:
+        asyncio.run(run_for())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            server.shutdown()
+    recorder.save(path)
+    print(f"Recorded {len(recorder.exchanges)} responses from {len(recorder.calendars)} calendars to {path}")
+
+def snapshot_lines(snapshots):
+    return ["%s %s" % (_local(t), text) for t, text in snapshots]
+
+def main():
+    options = dict(arg[2:].partition("=")[::2] for arg in sys.argv[1:] if arg.startswith("--"))
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    level = LEVELS[options.get("log", "ERROR")]
+    if "record" in options:
+        record(options["record"], float(args[0]) if args else 600, "mock" in options, level)
+        return
+
+    request_policy._random = random.Random(int(options.get("seed", 1))).random  # Jitter repeats between runs
+    if "replay" in options:
+        start, seconds, calendar_ids, changes, outages = load_recording(options["replay"])
+        if "days" in options:
+            seconds = int(options["days"]) * DAY
+    else:
+        days = int(options.get("days", 7))
+        start = parse_rfc3339(options.get("start", DEFAULT_START) + "T00:00:00Z") - config.UTC_OFFSET * 60
+        seconds = days * DAY
+        calendar_ids, changes, outages = synthetic(start, days, int(options.get("seed", 1)))
+
+    workdir = tempfile.mkdtemp(prefix="replay")
+    try:
+        configure(calendar_ids, workdir)
+        snapshots, server, costs, real = replay(start, seconds, calendar_ids, changes, outages, level, "echo" in options)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    lines = snapshot_lines(snapshots)
+    if "echo" not in options:
+        print("\n".join(lines))
+    print()
+    costs.report()
+    print()
+    print(f"{seconds / 3600:.1f} h of schedule in {real:.1f} s ({seconds / real:.0f}x real time), "
+          f"{len(changes)} changes, {server.requests} requests ({server.failed} failed), "
+          f"{len(snapshots)} snapshots, mock stats {server.state.stats}")
+
+    if "save" in options:
+        with open(options["save"], "w") as f:
+            f.write("\n".join(lines) + "\n")
+        print(f"Saved {len(lines)} snapshots to {options['save']}")
+    if "check" in options:
+        with open(options["check"]) as f:
+            expected = f.read().splitlines()
+        for i, (want, got) in enumerate(zip(expected + [""] * len(lines), lines + [""] * len(expected))):
+            if want != got:
+                print(f"Snapshot {i + 1} differs from {options['check']}:\n  expected {want}\n  got      {got}")
+                sys.exit(1)
+        print(f"All {len(lines)} snapshots match {options['check']}")
+
+if __name__ == "__main__":
+    main()
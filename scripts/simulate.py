@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Run the busy light firmware on the host against simulated hardware.
+
+The LED matrix is drawn in the terminal, WiFi and NTP are faked, and the
+Google token and Calendar hosts are routed to the local mock server, which is
+seeded with a meeting in progress and one coming up. Needs a config_local.py
+with a service account key that the host's jwt package can sign with.
+
+    python scripts/simulate.py [seconds] [--quiet]
+"""
+import asyncio
+import sys
+import time
+
+sys.path.insert(0, ".")
+sys.path.insert(0, "scripts")
+import config
+import sim
+import mock_calendar_server
+from time_manager import format_rfc3339
+
+MOCK_PORT = 8090
+API_HOSTS = ("www.googleapis.com", "oauth2.googleapis.com")
+
+def seed(state, now):
+    """Put a meeting in progress and another later in the first calendar"""
+    calendar_id = config.CALENDAR_IDS[0]
+    state.upsert(calendar_id, {"start": {"dateTime": format_rfc3339(now - 600)},
+                               "end": {"dateTime": format_rfc3339(now + 1200)}})
+    state.upsert(calendar_id, {"start": {"dateTime": format_rfc3339(now + 3600)},
+                               "end": {"dateTime": format_rfc3339(now + 5400)}})
+
+async def run_for(firmware, seconds):
+    try:
+        await asyncio.wait_for(firmware.run(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    seconds = float(args[0]) if args else 10
+    echo = "--quiet" not in sys.argv
+
+    server = mock_calendar_server.serve(port=MOCK_PORT)
+    seed(mock_calendar_server.Handler.state, time.time())
+    transport = sim.LoopbackTransport({host: ("127.0.0.1", MOCK_PORT) for host in API_HOSTS})
+    matrix, wlan, ntp = sim.install(matrix=sim.VirtualMatrix(config.LED_COUNT, echo=echo),
+                                    transport=transport)
+
+    import main as firmware
+    from log_config import setup_logging
+    firmware.loggers = setup_logging()
+    try:
+        asyncio.run(run_for(firmware, seconds))
+    finally:
+        server.shutdown()
+    print(f"{matrix.writes} frames, {wlan.attempts} WiFi connects, "
+          f"{ntp.calls} NTP requests, {transport.connections} HTTP connections, "
+          f"mock stats {mock_calendar_server.Handler.state.stats}, "
+          f"{firmware.governor.average_mw():.0f} mW average")
+
+if __name__ == '__main__':
+    main()
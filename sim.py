@@ -0,0 +1,355 @@
+import sys
+import time
+import struct
+import asyncio
+import config
+import sntp
+from layout import PanelLayout
+
+# Host-side stand-ins for the device hardware, installed into hal when the
+# firmware runs under CPython. Each one can be configured to misbehave so
+# failure paths can be exercised without a board.
+
+# Frames kept by a VirtualMatrix before the oldest are dropped
+MAX_FRAMES = 1000
+# Letters naming the config colours in VirtualMatrix.describe()
+PALETTE = (("B", "COLOR_BUSY"), ("F", "COLOR_FREE"), ("U", "COLOR_UPDATING"), ("E", "COLOR_ERROR"),
+           ("P", "COLOR_PROGRESS"), ("O", "COLOR_OVERFLOW"))
+
+def _now():
+    """Wall clock through the hal hook, so the fakes follow a VirtualClock"""
+    import hal
+    return hal.clock()
+
+def _name(rgb):
+    """Letter of the config colour closest in hue to rgb, '.' for off"""
+    if not any(rgb):
+        return "."
+    best = None
+    norm = sum(c * c for c in rgb) ** 0.5
+    for letter, name in PALETTE:
+        color = getattr(config, name)
+        score = sum(a * b for a, b in zip(rgb, color)) / (norm * sum(c * c for c in color) ** 0.5)
+        if best is None or score > best[0]:
+            best = (score, letter)
+    return best[1]
+
+class VirtualMatrix:
+    """LED output that records frames and can draw them in a terminal"""
+    def __init__(self, num_leds, layout=None, echo=False, stream=None, max_frames=MAX_FRAMES):
+        self.num_leds = num_leds
+        self.layout = layout or PanelLayout()  # Must match the NeoPixel's, to undo the wiring
+        self.width = self.layout.width
+        self.height = self.layout.height
+        self.echo = echo
+        self.stream = stream or sys.stdout
+        self.max_frames = max_frames
+        self.frames = []  # (hal.clock(), GRB bytes)
+        self.writes = 0
+        self._drawn = False
+
+    def write(self, buf):
+        """Record a GRB framebuffer, echoing it to the terminal if enabled"""
+        self.writes += 1
+        self.frames.append((_now(), bytes(buf)))
+        if len(self.frames) > self.max_frames:
+            del self.frames[0]
+        if self.echo:
+            self.draw()
+
+    def pixel(self, x, y, frame=-1):
+        """RGB colour of one LED in a recorded frame"""
+        buf = self.frames[frame][1]
+        o = self.layout.position(x, y) * 3
+        return (buf[o + 1], buf[o], buf[o + 2])
+
+    def describe(self, frame=-1):
+        """A recorded frame as text: the first LED's colour, a space, then the rightmost column top down
+
+        Colours are named by hue, whatever the brightness: B busy, F free,
+        U updating, E error, P progress, O overflow and . for off.
+        """
+        column = "".join(_name(self.pixel(self.width - 1, y, frame)) for y in range(self.height))
+        return _name(self.pixel(0, 0, frame)) + " " + column
+
+    def render(self, frame=-1):
+        """Recorded frame as rows of ANSI true-colour blocks"""
+        rows = []
+        for y in range(self.height):
+            cells = []
+            for x in range(self.width):
+                r, g, b = self.pixel(x, y, frame)
+                cells.append(f"\x1b[38;2;{r};{g};{b}m██")
+            rows.append("".join(cells) + "\x1b[0m")
+        return "\n".join(rows)
+
+    def draw(self):
+        """Redraw the latest frame in place"""
+        if self._drawn:
+            self.stream.write(f"\x1b[{self.height}A")
+        self.stream.write(self.render() + "\n")
+        self.stream.flush()
+        self._drawn = True
+
+class NullOutput:
+    """LED output that only counts frames, so benchmarks measure the drawing alone"""
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, buf):
+        self.writes += 1
+
+class FakeWLAN:
+    """Station interface that connects after a delay and can be made to fail"""
+    def __init__(self, connect_delay=0.5, fail_attempts=0, ip="192.168.1.50"):
+        self.connect_delay = connect_delay
+        self.fail_attempts = fail_attempts  # Number of connect() calls that never succeed
+        self.ip = ip
+        self.is_active = False
+        self.attempts = 0
+        self.connected_at = None
+
+    def active(self, state=None):
+        if state is None:
+            return self.is_active
+        self.is_active = bool(state)
+        if not self.is_active:
+            self.connected_at = None
+
+    def connect(self, ssid, password):
+        self.attempts += 1
+        if self.is_active and self.attempts > self.fail_attempts:
+            self.connected_at = _now() + self.connect_delay
+        else:
+            self.connected_at = None
+
+    def disconnect(self):
+        """Drop the link, as if the access point went away"""
+        self.connected_at = None
+
+    def isconnected(self):
+        return self.connected_at is not None and _now() >= self.connected_at
+
+    def ifconfig(self):
+        return (self.ip, "255.255.255.0", "192.168.1.1", "192.168.1.1")
+
+class _FakeNTPSocket:
+    """Datagram socket whose requests are answered by the FakeNTP servers after their latency"""
+    def __init__(self, ntp):
+        self.ntp = ntp
+        self.replies = []  # (due time, data, addr)
+
+    def sendto(self, data, addr):
+        self.ntp.calls += 1
+        host = addr[0]
+        if host in self.ntp.failing_hosts:
+            return len(data)
+        sent = _now()
+        latency = self.ntp.host_latency.get(host, self.ntp.latency)
+        server_ms = int((sent + latency / 2) * 1000) + self.ntp.error_ms(sent)
+        reply = bytearray(sntp.PACKET_SIZE)
+        reply[0] = 0x24  # Version 4, server mode
+        reply[1] = 2  # Stratum
+        reply[24:32] = data[40:48]
+        struct.pack_into(">QQ", reply, 32, sntp.to_ntp(server_ms), sntp.to_ntp(server_ms))
+        self.replies.append((sent + latency, bytes(reply), addr))
+        return len(data)
+
+    def recvfrom(self, size):
+        now = _now()
+        for i, (due, data, addr) in enumerate(self.replies):
+            if due <= now:
+                del self.replies[i]
+                return data[:size], addr
+        raise OSError(11, "EAGAIN")
+
+    def close(self):
+        self.replies = []
+
+class FakeNTP:
+    """SNTP servers and an RTC that is offset ms wrong and gains drift ppm; never touches the host clock
+
+    latency is the round trip in seconds, overridden per server by
+    host_latency. Hosts in failing_hosts never answer.
+    """
+    def __init__(self, latency=0.02, failing_hosts=(), offset=0, drift=0, host_latency=None):
+        self.latency = latency
+        self.host_latency = host_latency or {}
+        self.failing_hosts = set(failing_hosts)
+        self.offset = offset  # How far behind the server the local clock is at start (in ms)
+        self.drift = drift  # How fast the local clock falls further behind (ppm)
+        self.started = _now()
+        self.calls = 0
+        self.steps = 0
+
+    def error_ms(self, now=None):
+        """Current server time minus local time"""
+        elapsed = (now or _now()) - self.started
+        return self.offset + int(elapsed * self.drift / 1000)
+
+    def resolve(self, host, port):
+        return (host, port)
+
+    def socket(self):
+        return _FakeNTPSocket(self)
+
+    def now_ms(self):
+        return int(_now() * 1000)
+
+    def step(self, offset_ms):
+        self.steps += 1
+        self.offset -= offset_ms
+        return offset_ms
+
+class LoopbackTransport:
+    """open_connection replacement that sends selected hosts to local servers
+
+    routes maps a hostname to (host, port); matched connections are made in
+    plain TCP so the mock servers need no certificates. Unmatched hosts fall
+    through to asyncio.open_connection.
+    """
+    def __init__(self, routes=None, latency=0):
+        self.routes = dict(routes or {})
+        self.latency = latency
+        self.connections = 0
+
+    async def __call__(self, host, port, ssl=None):
+        self.connections += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        target = self.routes.get(host)
+        if target is None:
+            return await asyncio.open_connection(host, port, ssl=ssl)
+        return await asyncio.open_connection(target[0], target[1])
+
+class CannedTransport:
+    """open_connection replacement that answers requests in memory
+
+    handler(method, path, headers, body) returns (status, headers, body) for
+    each request; no sockets are opened, so client-side costs can be measured
+    without a server in the loop.
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.connections = 0
+        self.requests = 0
+
+    async def __call__(self, host, port, ssl=None):
+        self.connections += 1
+        reader = asyncio.StreamReader()
+        return reader, _CannedWriter(self, reader)
+
+class _CannedWriter:
+    """Stream writer half of a CannedTransport connection"""
+    def __init__(self, transport, reader):
+        self.transport = transport
+        self.reader = reader
+        self.pending = bytearray()
+
+    def write(self, data):
+        self.pending.extend(data)
+        while True:
+            head_end = self.pending.find(b"\r\n\r\n")
+            if head_end < 0:
+                return
+            lines = bytes(self.pending[:head_end]).decode().split("\r\n")
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip()] = value.strip()
+            length = int(headers.get("Content-Length", 0))
+            if len(self.pending) < head_end + 4 + length:
+                return
+            body = bytes(self.pending[head_end + 4:head_end + 4 + length])
+            del self.pending[:head_end + 4 + length]
+            method, path, _ = lines[0].split(" ", 2)
+            self.transport.requests += 1
+            status, reply_headers, payload = self.transport.handler(method, path, headers, body)
+            head = [f"HTTP/1.1 {status} Canned", f"Content-Length: {len(payload)}"]
+            for name, value in reply_headers.items():
+                head.append(f"{name}: {value}")
+            self.reader.feed_data(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.reader.feed_eof()
+
+def lightsleep(ms):
+    """Blocks the whole process, like machine.lightsleep stops the event loop"""
+    time.sleep(ms / 1000)
+
+class VirtualClock:
+    """Wall clock and ticks that only move when the event loop has nothing to run
+
+    Passed to install(), it becomes the hal clock, ticks and lightsleep hooks;
+    attach() puts an asyncio loop's timers on it. Whenever every task is
+    waiting, time jumps to the earliest timer instead of sleeping, so the
+    firmware's sleeps and timeouts take no real time and a day of schedule
+    runs in moments.
+    Only in-memory transports such as CannedTransport can be used with it, as
+    a real socket does not answer in zero time. on_advance(now, seconds), if
+    set, is called before each jump.
+    """
+    def __init__(self, start):
+        self.start = start  # UTC seconds at the beginning of the run
+        self.elapsed = 0.0  # Seconds since, kept small so float steps stay exact
+        self.on_advance = None
+        self.advances = 0
+
+    def time(self):
+        return self.start + self.elapsed
+
+    def ticks_ms(self):
+        return int(self.elapsed * 1000)
+
+    def monotonic(self):
+        return self.elapsed
+
+    def advance(self, seconds):
+        if self.on_advance:
+            self.on_advance(self.time(), seconds)
+        self.elapsed += seconds
+        self.advances += 1
+
+    def lightsleep(self, ms):
+        """Light sleep passes virtual time only"""
+        self.advance(ms / 1000)
+
+    def attach(self, loop):
+        """Drive loop's timers from this clock; returns loop"""
+        loop.time = self.monotonic
+        selector = loop._selector
+        select = selector.select
+
+        def virtual_select(timeout=None):
+            events = select(0)
+            if events or timeout == 0:
+                return events
+            if timeout is None:
+                raise RuntimeError("Every task is waiting with no timer set; virtual time cannot move")
+            self.advance(timeout)
+            return events
+        selector.select = virtual_select
+        return loop
+
+def install(matrix=None, wlan=None, ntp=None, transport=None, clock=None):
+    """Point the hal hooks at simulated hardware; omitted parts get defaults
+
+    With a VirtualClock, the clocks and light sleep follow it too.
+    """
+    import hal
+    if clock:
+        hal.install(clock=clock.time, ticks_ms=clock.ticks_ms)
+    matrix = matrix or VirtualMatrix(config.LED_COUNT)
+    wlan = wlan or FakeWLAN()
+    ntp = ntp or FakeNTP()
+    hal.install(
+        led_output=lambda pin_num, num_leds: matrix,
+        wlan=lambda: wlan,
+        ntp=lambda: ntp,
+        open_connection=transport or asyncio.open_connection,
+        lightsleep=clock.lightsleep if clock else lightsleep,
+    )
+    return matrix, wlan, ntp
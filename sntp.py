@@ -0,0 +1,60 @@
+import struct
+import time
+
+# SNTP (RFC 4330) packet handling. A request carries our transmit time; the
+# reply echoes it as the originate timestamp and adds the server's receive and
+# transmit times, so one exchange gives both the clock offset and the
+# round-trip delay:
+#   offset = ((t2 - t1) + (t3 - t4)) / 2
+#   delay  = (t4 - t1) - (t3 - t2)
+# All times are integer milliseconds since the epoch of time.time(), which
+# keeps full precision on ports with single-precision floats.
+
+PORT = 123
+PACKET_SIZE = 48
+LI_VN_MODE = 0x23  # No leap warning, version 4, client mode
+MODE_SERVER = 4
+LI_UNSYNCHRONIZED = 3
+MAX_STRATUM = 15
+
+# Seconds from the NTP epoch (1900) to the epoch used by time.time()
+NTP_DELTA = 3155673600 if time.gmtime(0)[0] == 2000 else 2208988800
+
+def to_ntp(ms):
+    """64-bit NTP timestamp for a time in milliseconds"""
+    seconds, ms = divmod(ms, 1000)
+    return ((seconds + NTP_DELTA) & 0xFFFFFFFF) << 32 | (ms << 32) // 1000
+
+def from_ntp(value):
+    """Milliseconds for a 64-bit NTP timestamp, assuming NTP era 1 from 2036"""
+    seconds = value >> 32
+    if seconds < 0x80000000:
+        seconds += 0x100000000
+    return (seconds - NTP_DELTA) * 1000 + ((value & 0xFFFFFFFF) * 1000 >> 32)
+
+def encode_request(t1):
+    """Client request stamped with transmit time t1"""
+    packet = bytearray(PACKET_SIZE)
+    packet[0] = LI_VN_MODE
+    struct.pack_into(">Q", packet, 40, to_ntp(t1))
+    return packet
+
+def decode_response(data, t1, t4):
+    """(offset_ms, delay_ms) from a reply to the request sent at t1, or None if it is unusable
+
+    Rejects replies that do not answer our request (originate timestamp
+    mismatch), kiss-o'-death packets and servers that are not synchronized.
+    """
+    if len(data) < PACKET_SIZE:
+        return None
+    flags, stratum = data[0], data[1]
+    if flags & 0x07 != MODE_SERVER or flags >> 6 == LI_UNSYNCHRONIZED:
+        return None
+    if not 0 < stratum <= MAX_STRATUM:
+        return None
+    originate, receive, transmit = struct.unpack_from(">QQQ", data, 24)
+    if originate != to_ntp(t1) or not transmit:
+        return None
+    t2 = from_ntp(receive)
+    t3 = from_ntp(transmit)
+    return ((t2 - t1) + (t3 - t4)) // 2, (t4 - t1) - (t3 - t2)
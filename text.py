@@ -0,0 +1,186 @@
+import time
+import config
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # CPython
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+# 5x7 bitmap font for printable ASCII (32-126). Each glyph is five column
+# bytes, left to right, with bit 0 as the top row.
+GLYPH_WIDTH = 5
+GLYPH_HEIGHT = 7
+FIRST_CHAR = 32
+FONT = bytes((
+    0x00, 0x00, 0x00, 0x00, 0x00,  # ' '
+    0x00, 0x00, 0x5F, 0x00, 0x00,  # !
+    0x00, 0x07, 0x00, 0x07, 0x00,  # "
+    0x14, 0x7F, 0x14, 0x7F, 0x14,  # #
+    0x24, 0x2A, 0x7F, 0x2A, 0x12,  # $
+    0x23, 0x13, 0x08, 0x64, 0x62,  # %
+    0x36, 0x49, 0x55, 0x22, 0x50,  # &
+    0x00, 0x05, 0x03, 0x00, 0x00,  # '
+    0x00, 0x1C, 0x22, 0x41, 0x00,  # (
+    0x00, 0x41, 0x22, 0x1C, 0x00,  # )
+    0x14, 0x08, 0x3E, 0x08, 0x14,  # *
+    0x08, 0x08, 0x3E, 0x08, 0x08,  # +
+    0x00, 0x50, 0x30, 0x00, 0x00,  # ,
+    0x08, 0x08, 0x08, 0x08, 0x08,  # -
+    0x00, 0x60, 0x60, 0x00, 0x00,  # .
+    0x20, 0x10, 0x08, 0x04, 0x02,  # /
+    0x3E, 0x51, 0x49, 0x45, 0x3E,  # 0
+    0x00, 0x42, 0x7F, 0x40, 0x00,  # 1
+    0x42, 0x61, 0x51, 0x49, 0x46,  # 2
+    0x21, 0x41, 0x45, 0x4B, 0x31,  # 3
+    0x18, 0x14, 0x12, 0x7F, 0x10,  # 4
+    0x27, 0x45, 0x45, 0x45, 0x39,  # 5
+    0x3C, 0x4A, 0x49, 0x49, 0x30,  # 6
+    0x01, 0x71, 0x09, 0x05, 0x03,  # 7
+    0x36, 0x49, 0x49, 0x49, 0x36,  # 8
+    0x06, 0x49, 0x49, 0x29, 0x1E,  # 9
+    0x00, 0x36, 0x36, 0x00, 0x00,  # :
+    0x00, 0x56, 0x36, 0x00, 0x00,  # ;
+    0x08, 0x14, 0x22, 0x41, 0x00,  # <
+    0x14, 0x14, 0x14, 0x14, 0x14,  # =
+    0x00, 0x41, 0x22, 0x14, 0x08,  # >
+    0x02, 0x01, 0x51, 0x09, 0x06,  # ?
+    0x32, 0x49, 0x79, 0x41, 0x3E,  # @
+    0x7E, 0x11, 0x11, 0x11, 0x7E,  # A
+    0x7F, 0x49, 0x49, 0x49, 0x36,  # B
+    0x3E, 0x41, 0x41, 0x41, 0x22,  # C
+    0x7F, 0x41, 0x41, 0x22, 0x1C,  # D
+    0x7F, 0x49, 0x49, 0x49, 0x41,  # E
+    0x7F, 0x09, 0x09, 0x09, 0x01,  # F
+    0x3E, 0x41, 0x49, 0x49, 0x7A,  # G
+    0x7F, 0x08, 0x08, 0x08, 0x7F,  # H
+    0x00, 0x41, 0x7F, 0x41, 0x00,  # I
+    0x20, 0x40, 0x41, 0x3F, 0x01,  # J
+    0x7F, 0x08, 0x14, 0x22, 0x41,  # K
+    0x7F, 0x40, 0x40, 0x40, 0x40,  # L
+    0x7F, 0x02, 0x0C, 0x02, 0x7F,  # M
+    0x7F, 0x04, 0x08, 0x10, 0x7F,  # N
+    0x3E, 0x41, 0x41, 0x41, 0x3E,  # O
+    0x7F, 0x09, 0x09, 0x09, 0x06,  # P
+    0x3E, 0x41, 0x51, 0x21, 0x5E,  # Q
+    0x7F, 0x09, 0x19, 0x29, 0x46,  # R
+    0x46, 0x49, 0x49, 0x49, 0x31,  # S
+    0x01, 0x01, 0x7F, 0x01, 0x01,  # T
+    0x3F, 0x40, 0x40, 0x40, 0x3F,  # U
+    0x1F, 0x20, 0x40, 0x20, 0x1F,  # V
+    0x3F, 0x40, 0x38, 0x40, 0x3F,  # W
+    0x63, 0x14, 0x08, 0x14, 0x63,  # X
+    0x07, 0x08, 0x70, 0x08, 0x07,  # Y
+    0x61, 0x51, 0x49, 0x45, 0x43,  # Z
+    0x00, 0x7F, 0x41, 0x41, 0x00,  # [
+    0x02, 0x04, 0x08, 0x10, 0x20,  # backslash
+    0x00, 0x41, 0x41, 0x7F, 0x00,  # ]
+    0x04, 0x02, 0x01, 0x02, 0x04,  # ^
+    0x40, 0x40, 0x40, 0x40, 0x40,  # _
+    0x00, 0x01, 0x02, 0x04, 0x00,  # `
+    0x20, 0x54, 0x54, 0x54, 0x78,  # a
+    0x7F, 0x48, 0x44, 0x44, 0x38,  # b
+    0x38, 0x44, 0x44, 0x44, 0x20,  # c
+    0x38, 0x44, 0x44, 0x48, 0x7F,  # d
+    0x38, 0x54, 0x54, 0x54, 0x18,  # e
+    0x08, 0x7E, 0x09, 0x01, 0x02,  # f
+    0x0C, 0x52, 0x52, 0x52, 0x3E,  # g
+    0x7F, 0x08, 0x04, 0x04, 0x78,  # h
+    0x00, 0x44, 0x7D, 0x40, 0x00,  # i
+    0x20, 0x40, 0x44, 0x3D, 0x00,  # j
+    0x7F, 0x10, 0x28, 0x44, 0x00,  # k
+    0x00, 0x41, 0x7F, 0x40, 0x00,  # l
+    0x7C, 0x04, 0x18, 0x04, 0x78,  # m
+    0x7C, 0x08, 0x04, 0x04, 0x78,  # n
+    0x38, 0x44, 0x44, 0x44, 0x38,  # o
+    0x7C, 0x14, 0x14, 0x14, 0x08,  # p
+    0x08, 0x14, 0x14, 0x18, 0x7C,  # q
+    0x7C, 0x08, 0x04, 0x04, 0x08,  # r
+    0x48, 0x54, 0x54, 0x54, 0x20,  # s
+    0x04, 0x3F, 0x44, 0x40, 0x20,  # t
+    0x3C, 0x40, 0x40, 0x20, 0x7C,  # u
+    0x1C, 0x20, 0x40, 0x20, 0x1C,  # v
+    0x3C, 0x40, 0x30, 0x40, 0x3C,  # w
+    0x44, 0x28, 0x10, 0x28, 0x44,  # x
+    0x0C, 0x50, 0x50, 0x50, 0x3C,  # y
+    0x44, 0x64, 0x54, 0x4C, 0x44,  # z
+    0x00, 0x08, 0x36, 0x41, 0x00,  # {
+    0x00, 0x00, 0x7F, 0x00, 0x00,  # |
+    0x00, 0x41, 0x36, 0x08, 0x00,  # }
+    0x08, 0x04, 0x08, 0x10, 0x08,  # ~
+))
+
+def render(message):
+    """Column bitmasks for a message, one blank column after each glyph"""
+    columns = bytearray(len(message) * (GLYPH_WIDTH + 1))
+    o = 0
+    for ch in message:
+        code = ord(ch) - FIRST_CHAR
+        if not 0 <= code < len(FONT) // GLYPH_WIDTH:
+            code = ord("?") - FIRST_CHAR
+        g = code * GLYPH_WIDTH
+        columns[o:o + GLYPH_WIDTH] = FONT[g:g + GLYPH_WIDTH]
+        o += GLYPH_WIDTH + 1
+    return columns
+
+class Marquee:
+    """Text in a rectangle of the LEDs, scrolled right to left when it does not fit
+
+    The message is rendered to column bitmasks once when it changes. Each
+    frame fills the rectangle with the background and sets only the lit
+    pixels of the visible columns. The scroll position follows elapsed time,
+    so a slow frame skips columns instead of slowing the text down.
+    """
+    def __init__(self, leds, x, y, width, speed=None):
+        self.leds = leds
+        self.x = x
+        self.y = y
+        self.width = width
+        self.speed = speed or config.TEXT_SCROLL_SPEED  # Columns per second
+        self.message = None
+        self.columns = b""
+        self.color = None
+        self.background = None
+        self.started = ticks_ms()
+
+    def set(self, message, color, background):
+        """Show a message; scrolling restarts only when the words change"""
+        self.color = color
+        self.background = background
+        if message == self.message:
+            return
+        self.message = message
+        self.columns = render(message)
+        if len(self.columns) > self.width:
+            # Leading gap so the text scrolls in from the right edge
+            self.columns = bytes(self.width) + self.columns
+        self.started = ticks_ms()
+
+    def clear(self):
+        """Stop showing text, e.g. while the matrix shows the error colour"""
+        self.message = None
+        self.columns = b""
+
+    def scrolling(self):
+        return len(self.columns) > self.width
+
+    def draw(self):
+        """Draw the current window of the message into the framebuffer"""
+        leds = self.leds
+        leds.fill_rect(self.x, self.y, self.width, GLYPH_HEIGHT, self.background)
+        columns = self.columns
+        if self.scrolling():
+            offset = ticks_diff(ticks_ms(), self.started) * self.speed // 1000 % len(columns)
+            shown = min(self.width, len(columns) - offset)
+            leds.blit(columns, self.x, self.y, self.color, offset, shown)
+            if shown < self.width:
+                # Wrap around to the start of the message
+                leds.blit(columns, self.x + shown, self.y, self.color, 0, self.width - shown)
+        else:
+            # Short messages sit centred and still
+            pad = (self.width - len(columns) + 1) // 2
+            leds.blit(columns, self.x + pad, self.y, self.color)
@@ -1,147 +1,302 @@
-import ntptime
-import time
-from datetime import datetime, timezone
+import asyncio
 import config
+import hal
+import sntp
+from metrics import metrics
+
+try:
+    from time import ticks_diff
+except ImportError:
+    # CPython
+    def ticks_diff(a, b):
+        return a - b
+
+# Parsed timestamps memoised per TimeManager; cleared when it grows past this
+PARSE_CACHE_SIZE = 64
+
+# How often a sync checks its sockets for replies (in seconds)
+POLL_INTERVAL = 0.01
+# Shortest gap between syncs that gives a usable drift measurement (in ms)
+MIN_DRIFT_SPAN = 60000
+# How far ticks_ms and the wall clock may disagree over that gap before it is discarded (in ms)
+MAX_SPAN_MISMATCH = 60000
+# Weight of each new drift measurement in the running estimate
+DRIFT_SMOOTHING = 0.5
+# Earliest believable RTC reading (2025-01-01); the RTC restarts far before this after power loss
+MIN_VALID_TIME = 1735689600
+# Clock error corrected from an HTTP Date header, which only has 1 s resolution (in ms)
+DATE_TOLERANCE = 2000
+
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+def days_from_civil(y, m, d):
+    """Days since 1970-01-01 for a proleptic Gregorian date"""
+    y -= m <= 2
+    era = (y if y >= 0 else y - 399) // 400
+    yoe = y - era * 400
+    doy = (153 * (m - 3 if m > 2 else m + 9) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+def civil_from_days(z):
+    """(year, month, day) for a count of days since 1970-01-01"""
+    z += 719468
+    era = (z if z >= 0 else z - 146096) // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + 3 if mp < 10 else mp - 9
+    return yoe + era * 400 + (m <= 2), m, d
+
+def parse_rfc3339(value):
+    """Parse an RFC 3339 date-time or date into an integer UTC timestamp
+
+    Accepts 'YYYY-MM-DDTHH:MM:SS[.fff](Z|+HH:MM|-HH:MM)' and date-only
+    'YYYY-MM-DD' (midnight UTC). Fractional seconds are truncated.
+    """
+    days = days_from_civil(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+    if len(value) == 10:
+        return days * 86400
+    if value[10] not in "Tt ":
+        raise ValueError("Invalid RFC 3339 timestamp")
+    seconds = days * 86400 + int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+    
+    # Skip fractional seconds
+    i = 19
+    n = len(value)
+    if i < n and value[i] == ".":
+        i += 1
+        while i < n and "0" <= value[i] <= "9":
+            i += 1
+    if i >= n:
+        raise ValueError("Missing UTC offset")
+    
+    sign = value[i]
+    if sign in "Zz":
+        return seconds
+    if sign not in "+-" or n - i != 6:
+        raise ValueError("Invalid UTC offset")
+    offset = int(value[i + 1:i + 3]) * 3600 + int(value[i + 4:i + 6]) * 60
+    return seconds - offset if sign == "+" else seconds + offset
+
+def parse_http_date(value):
+    """Parse an IMF-fixdate HTTP header ('Sun, 06 Nov 1994 08:49:37 GMT') into a UTC timestamp"""
+    parts = value.split()
+    if len(parts) != 6 or parts[5] != "GMT":
+        raise ValueError("Invalid HTTP date")
+    days = days_from_civil(int(parts[3]), MONTHS.index(parts[2]) + 1, int(parts[1]))
+    hms = parts[4]
+    return days * 86400 + int(hms[0:2]) * 3600 + int(hms[3:5]) * 60 + int(hms[6:8])
+
+def format_rfc3339(timestamp):
+    """Format a UTC timestamp as 'YYYY-MM-DDTHH:MM:SSZ'"""
+    timestamp = int(timestamp)
+    days, secs = divmod(timestamp, 86400)
+    y, m, d = civil_from_days(days)
+    return "%04d-%02d-%02dT%02d:%02d:%02dZ" % (y, m, d, secs // 3600, secs // 60 % 60, secs % 60)
 
 class TimeManager:
+    """Keeps the clock on NTP time and parses the API's timestamps
+
+    Each sync sends one SNTP request to every configured server at once and
+    uses the reply with the shortest round trip. The offset left uncorrected
+    since the previous sync, divided by the ticks_ms time between them, gives
+    the drift of the local clock, and the sync interval doubles while that
+    drift keeps the clock within NTP_TOLERANCE and halves when it does not.
+    """
     def __init__(self, logger):
-        self.last_sync = 0
-        self.last_sync_success = 0
-        self.drift_history = []  # Store recent drift measurements
-        self.current_server_index = 0
         self.logger = logger
-        
-    def _try_ntp_server(self, server):
-        """Try to sync with a specific NTP server"""
+        self._parse_cache = {}
+        self.addresses = {}  # Resolved NTP server addresses by host
+        self.synced = False
+        self.date_synced = False  # Clock set from an HTTP Date header while NTP was unavailable
+        self.last_sync = None  # ticks_ms and wall clock of the last successful sync
+        self.last_sync_time = None
+        self.last_attempt = hal.ticks_ms()
+        self.wait = 0  # Seconds from last_attempt until the next sync is due
+        self.residual = 0  # Clock error left uncorrected at the last sync (in ms)
+        self.offset = None  # Last measured offset and round-trip delay (in ms)
+        self.delay = None
+        self.drift = None  # Local clock drift in ppm; positive when it runs slow
+        self.interval = config.NTP_SYNC_INTERVAL
+        self.failures = 0
+
+    def servers(self):
+        return [config.NTP_SERVER] + list(config.NTP_BACKUP_SERVERS)
+
+    def _address(self, ntp, host):
+        address = self.addresses.get(host)
+        if address is None:
+            address = ntp.resolve(host, sntp.PORT)
+            self.addresses[host] = address
+        return address
+
+    async def _query(self, ntp):
+        """Ask every server at once; returns (offset, delay, host) for the best reply or None"""
+        pending = []
+        for host in self.servers():
+            try:
+                sock = ntp.socket()
+            except Exception as e:
+                self.logger.warning("Could not open NTP socket: %s", e)
+                break
+            try:
+                t1 = ntp.now_ms()
+                sock.sendto(sntp.encode_request(t1), self._address(ntp, host))
+                pending.append((sock, host, t1))
+            except Exception as e:
+                self.logger.warning("NTP request to %s failed: %s", host, e)
+                self.addresses.pop(host, None)
+                sock.close()
+        best = None
+        started = hal.ticks_ms()
         try:
-            self.logger.debug(f"Attempting to sync with NTP server: {server}")
-            ntptime.host = server
-            ntptime.settime()
-            self.logger.debug(f"Successfully synced with {server}")
-            return True
-        except Exception as e:
-            self.logger.warning(f"Failed to sync with {server}: {str(e)}")
+            while pending:
+                elapsed = ticks_diff(hal.ticks_ms(), started)
+                # A reply still outstanding now has a longer round trip than the best one
+                if elapsed >= config.NTP_TIMEOUT * 1000 or (best and elapsed > best[1]):
+                    break
+                for entry in pending[:]:
+                    sock, host, t1 = entry
+                    try:
+                        data, _ = sock.recvfrom(sntp.PACKET_SIZE)
+                    except OSError:
+                        continue
+                    sample = sntp.decode_response(data, t1, ntp.now_ms())
+                    pending.remove(entry)
+                    sock.close()
+                    if sample is None:
+                        self.logger.warning("Ignoring unusable NTP reply from %s", host)
+                        continue
+                    self.logger.debug("NTP %s: offset %s ms, delay %s ms", host, sample[0], sample[1])
+                    if best is None or sample[1] < best[1]:
+                        best = (sample[0], sample[1], host)
+                await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            for sock, host, _ in pending:
+                self.logger.debug("No reply in time from NTP server %s", host)
+                sock.close()
+        return best
+
+    def _update_drift(self, offset, now, wall):
+        """Fold the error accumulated since the last sync into the drift estimate"""
+        if self.last_sync is None:
+            return
+        span = ticks_diff(now, self.last_sync)
+        # ticks_ms wraps after a few days; trust the span only if the wall clock agrees
+        if span < MIN_DRIFT_SPAN or abs((wall - self.last_sync_time) * 1000 - span) > MAX_SPAN_MISMATCH:
+            return
+        drift = (offset - self.residual) * 1000000 / span
+        if self.drift is None:
+            self.drift = drift
+        else:
+            self.drift += (drift - self.drift) * DRIFT_SMOOTHING
+
+    def _adapt_interval(self):
+        """Double the interval while drift keeps well within tolerance, halve it when it does not"""
+        if self.drift is None:
+            return
+        expected = abs(self.drift) * self.interval / 1000  # ms of error by the next sync
+        if expected * 4 < config.NTP_TOLERANCE:
+            self.interval = min(self.interval * 2, config.NTP_MAX_INTERVAL)
+        elif expected > config.NTP_TOLERANCE:
+            self.interval = max(self.interval // 2, config.NTP_MIN_INTERVAL)
+
+    async def sync_time(self):
+        """Measure the clock against the NTP servers and step it if it is out of tolerance"""
+        started = metrics.start()
+        ntp = hal.ntp()
+        best = await self._query(ntp)
+        now = hal.ticks_ms()
+        self.last_attempt = now
+        if best is None:
+            self.failures += 1
+            metrics.incr("ntp_failures")
+            self.wait = min(config.NTP_RETRY_INTERVAL << (self.failures - 1), config.NTP_MAX_INTERVAL)
+            self.logger.error("All NTP servers failed, retrying in %s s", self.wait)
             return False
-            
-    def _calculate_drift(self):
-        """Calculate time drift since last sync"""
-        if not self.last_sync_success:
-            self.logger.debug("No previous successful sync, skipping drift calculation")
-            return None
-            
-        # Get current time before sync
-        pre_sync_time = time.time()
-        
-        # Try to sync
-        if self._try_ntp_server(config.NTP_SERVER):
-            # Get time after sync
-            post_sync_time = time.time()
-            
-            # Calculate drift (in seconds)
-            drift = post_sync_time - pre_sync_time
-            
-            # Store drift history (keep last 5 measurements)
-            self.drift_history.append(drift)
-            if len(self.drift_history) > 5:
-                self.drift_history.pop(0)
-                
-            self.logger.debug(f"Calculated drift: {drift} seconds")
-            return drift
-            
-        self.logger.warning("Failed to calculate drift - sync failed")
-        return None
-        
-    def _get_average_drift_rate(self):
-        """Calculate average drift rate in seconds per hour"""
-        if not self.drift_history:
-            self.logger.debug("No drift history available")
-            return None
-            
-        total_drift = sum(self.drift_history)
-        avg_drift = total_drift / len(self.drift_history)
-        time_span = (time.time() - self.last_sync_success) / 3600  # Convert to hours
-        
-        if time_span > 0:
-            drift_rate = avg_drift / time_span
-            self.logger.debug(f"Average drift rate: {drift_rate} seconds/hour")
-            return drift_rate
-            
-        self.logger.warning("Invalid time span for drift calculation")
-        return None
-        
-    def sync_time(self):
-        """Synchronize time with NTP server with retry logic"""
-        self.logger.info("Starting time synchronization")
-        
-        # First try primary server
-        if self._try_ntp_server(config.NTP_SERVER):
-            self.last_sync = time.time()
-            self.last_sync_success = self.last_sync
-            self.logger.info("Time synchronized with primary NTP server")
-            return True
-            
-        # If primary fails, try backup servers
-        for server in config.NTP_BACKUP_SERVERS:
-            self.logger.info(f"Trying backup NTP server: {server}")
-            if self._try_ntp_server(server):
-                self.last_sync = time.time()
-                self.last_sync_success = self.last_sync
-                self.logger.info(f"Time synchronized with backup NTP server: {server}")
-                return True
-                
-            # Wait before trying next server
-            time.sleep(1)
-            
-        self.logger.error("All NTP servers failed")
-        return False
-        
-    def ensure_time_synced(self):
-        """Ensure time is synced with NTP server with dynamic interval"""
-        current_time = time.time()
-        
-        # Calculate time since last sync
-        time_since_sync = current_time - self.last_sync
-        
-        # Check if it's time to sync
-        if time_since_sync >= config.NTP_SYNC_INTERVAL:
-            self.logger.debug("Sync interval reached, checking drift")
-            
-            # Calculate drift
-            drift = self._calculate_drift()
-            
-            # If drift is significant (more than 1 second), sync immediately
-            if drift and abs(drift) > 1:
-                self.logger.warning(f"Significant drift detected: {drift} seconds")
-                return self.sync_time()
-                
-            # Get average drift rate
-            drift_rate = self._get_average_drift_rate()
-            
-            # If drift rate is high, decrease sync interval
-            if drift_rate and abs(drift_rate) > 1:  # More than 1 second per hour
-                self.logger.warning(f"High drift rate detected: {drift_rate} seconds/hour")
-                # Temporarily reduce sync interval by half
-                if time_since_sync >= (config.NTP_SYNC_INTERVAL / 2):
-                    self.logger.info("Performing early sync due to high drift rate")
-                    return self.sync_time()
-            
-            # Normal sync interval
-            self.logger.info("Performing regular sync")
-            return self.sync_time()
-            
-        self.logger.debug("Time sync not needed yet")
+        metrics.record("ntp_sync", started)
+        offset, delay, host = best
+        wall = hal.clock()
+        self._update_drift(offset, now, wall)
+        applied = 0
+        if not self.synced or abs(offset) > config.NTP_TOLERANCE:
+            applied = ntp.step(offset)
+        self.residual = offset - applied
+        self.offset = offset
+        self.delay = delay
+        self.last_sync = now
+        self.last_sync_time = wall
+        self.synced = True
+        self.failures = 0
+        self._adapt_interval()
+        self.wait = self.interval
+        metrics.set("ntp_offset_ms", offset)
+        metrics.set("ntp_delay_ms", delay)
+        metrics.set("ntp_interval_seconds", self.interval)
+        if self.drift is not None:
+            metrics.set("ntp_drift_ppm", self.drift)
+        self.logger.info("Time synchronized with %s: offset %s ms, delay %s ms, drift %s ppm, next sync in %s s",
+                         host, offset, delay, "?" if self.drift is None else "%.1f" % self.drift, self.interval)
         return True
+
+    def clock_valid(self):
+        """True once the clock can be trusted for tokens and rendering
+
+        Before the first NTP sync this is the case when an HTTP Date header
+        has set it, or when the RTC kept running through a reset.
+        """
+        return self.synced or self.date_synced or hal.clock() >= MIN_VALID_TIME
+
+    def observe_date(self, value):
+        """Take the time from an HTTP Date header until NTP has synced"""
+        if self.synced or self.date_synced:
+            return
+        try:
+            # The header is truncated to the second; assume the middle of it
+            server_ms = parse_http_date(value) * 1000 + 500
+        except (ValueError, IndexError):
+            self.logger.debug("Ignoring malformed Date header: %s", value)
+            return
+        ntp = hal.ntp()
+        offset = server_ms - ntp.now_ms()
+        if abs(offset) > DATE_TOLERANCE:
+            ntp.step(offset)
+        self.date_synced = True
+        self.logger.info("Clock set from HTTP Date header (offset %s ms)", offset)
+
+    def seconds_until_sync(self):
+        return max(0, self.wait - ticks_diff(hal.ticks_ms(), self.last_attempt) // 1000)
+
+    async def ensure_time_synced(self):
+        """Sync once the adaptive interval (or failure backoff) has run out; True while time is good"""
+        if self.seconds_until_sync() > 0:
+            return self.synced
+        return await self.sync_time()
     
     def get_utc_timestamp(self):
         """Get current UTC timestamp"""
-        return time.time()
+        return hal.clock()
     
     def format_utc_datetime(self, timestamp):
         """Format timestamp as UTC datetime string for Google Calendar API"""
-        dt = datetime.fromtimestamp(timestamp, timezone.utc)
-        return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+        return format_rfc3339(timestamp)
     
     def parse_datetime(self, dt_str):
-        """Parse datetime string from Google Calendar API to timestamp"""
-        dt = datetime.strptime(dt_str, "%Y-%m-%dT%H:%M:%SZ")
-        return dt.replace(tzinfo=timezone.utc).timestamp() 
\ No newline at end of file
+        """Parse datetime string from Google Calendar API to timestamp
+
+        All-day events give a bare date, which is taken as local midnight
+        UTC_OFFSET minutes from UTC, the same as an iCalendar DATE.
+        """
+        cache = self._parse_cache
+        ts = cache.get(dt_str)
+        if ts is None:
+            ts = parse_rfc3339(dt_str)
+            if len(dt_str) == 10:
+                ts -= config.UTC_OFFSET * 60
+            if len(cache) >= PARSE_CACHE_SIZE:
+                cache.clear()
+            cache[dt_str] = ts
+        return ts
\ No newline at end of file
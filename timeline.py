@@ -0,0 +1,101 @@
+from array import array
+import config
+
+def _bisect_right(a, x):
+    """Index of the first element of sorted sequence a greater than x"""
+    lo = 0
+    hi = len(a)
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if x < a[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+class Timeline:
+    """Merged busy intervals with O(log n) lookups
+
+    Built once per fetch from (start, end) timestamp pairs in any order.
+    Overlapping intervals and intervals separated by at most merge_gap seconds
+    (back-to-back meetings) are merged into one busy block. Blocks are stored
+    as offsets from the first start in two parallel int arrays, which keeps
+    every value a small int on MicroPython and avoids one tuple per event.
+    """
+    def __init__(self, intervals=(), merge_gap=None):
+        if merge_gap is None:
+            merge_gap = config.BACK_TO_BACK_GAP
+        intervals = sorted(intervals)
+        self.base = int(intervals[0][0]) if intervals else 0
+        self.starts = array("l")
+        self.ends = array("l")
+        base = self.base
+        for start, end in intervals:
+            start = int(start) - base
+            end = int(end) - base
+            if self.ends and start - self.ends[-1] <= merge_gap:
+                if end > self.ends[-1]:
+                    self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __eq__(self, other):
+        return (isinstance(other, Timeline) and self.base == other.base
+                and list(self.starts) == list(other.starts) and list(self.ends) == list(other.ends))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def blocks(self):
+        """Iterate merged (start, end) timestamp pairs"""
+        base = self.base
+        for i in range(len(self.starts)):
+            yield self.starts[i] + base, self.ends[i] + base
+
+    def block_at(self, t):
+        """Return the (start, end) busy block containing t, or None"""
+        i = _bisect_right(self.starts, t - self.base) - 1
+        if i >= 0 and t - self.base <= self.ends[i]:
+            return self.starts[i] + self.base, self.ends[i] + self.base
+        return None
+
+    def busy_at(self, t):
+        """True if t falls inside a busy block"""
+        return self.block_at(t) is not None
+
+    def remaining(self, t):
+        """Seconds until the busy block containing t ends, 0 when free"""
+        block = self.block_at(t)
+        return block[1] - t if block else 0
+
+    def next_start(self, t):
+        """Start of the first busy block beginning after t, or None"""
+        i = _bisect_right(self.starts, t - self.base)
+        if i < len(self.starts):
+            return self.starts[i] + self.base
+        return None
+
+    def status(self, t):
+        """(is_busy, remaining_minutes, next_meeting_in, target) at t
+
+        target is the timestamp the progress column counts down to (end of
+        the current busy block, or start of the next meeting), or None.
+        """
+        block = self.block_at(t)
+        if block:
+            return True, int((block[1] - t) / 60), None, block[1]
+        next_start = self.next_start(t)
+        if next_start is not None:
+            return False, 0, int((next_start - t) / 60), next_start
+        return False, 0, None, None
+
+    def next_boundary(self, t):
+        """Earliest block start or end after t, or None"""
+        block = self.block_at(t)
+        if block and block[1] > t:
+            return block[1]
+        return self.next_start(t)
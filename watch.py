@@ -0,0 +1,165 @@
+import asyncio
+import os
+import config
+from calendar_api import _quote
+from log_config import sanitize_calendar_id
+
+class Channel:
+    """One events.watch push channel"""
+    def __init__(self, calendar_id, channel_id, resource_id, expires):
+        self.calendar_id = calendar_id
+        self.id = channel_id
+        self.resource_id = resource_id
+        self.expires = expires  # UTC timestamp
+
+class WatchManager:
+    """Keeps an events.watch channel open per calendar and tracks which calendars changed
+
+    Google POSTs a notification to WATCH_ADDRESS whenever a watched calendar
+    changes; the receiver served here marks that calendar dirty and wakes the
+    fetcher, which then syncs only the dirty calendars. Channels are renewed
+    WATCH_RENEW_MARGIN seconds before they expire. A calendar without a live
+    channel (registration failed or lapsed) is reported as uncovered, and the
+    fetcher keeps polling on its normal cadence until every channel is back.
+    """
+    def __init__(self, calendar, logger, calendar_ids=None):
+        self.calendar = calendar
+        self.logger = logger
+        self.calendar_ids = calendar_ids or config.CALENDAR_IDS
+        self.channels = {}  # calendar id -> Channel
+        self.dirty = set()
+        self.changed = asyncio.Event()  # Set when a notification marks a calendar dirty
+        self.token = "".join("%02x" % b for b in os.urandom(16))  # Echoed back by Google in each notification
+        self.serial = 0
+        self.stats = {"notifications": 0, "rejected": 0, "registered": 0, "failed": 0}
+
+    def _live(self, calendar_id, now):
+        channel = self.channels.get(calendar_id)
+        return channel is not None and channel.expires > now
+
+    def all_covered(self, now):
+        """True when every calendar has a live channel, so polling can slow down"""
+        for calendar_id in self.calendar_ids:
+            if not self._live(calendar_id, now):
+                return False
+        return True
+
+    def mark(self, calendar_ids):
+        """Flag calendars for refetch and wake the fetcher"""
+        self.dirty.update(calendar_ids)
+        if self.dirty:
+            self.changed.set()
+
+    def take_dirty(self):
+        """Calendars changed since the last call, in configured order"""
+        dirty = [calendar_id for calendar_id in self.calendar_ids if calendar_id in self.dirty]
+        self.dirty.clear()
+        self.changed.clear()
+        return dirty
+
+    def notification(self, headers):
+        """Handle one webhook POST; returns True if it came from one of our channels"""
+        channel_id = headers.get("x-goog-channel-id")
+        state = headers.get("x-goog-resource-state")
+        if headers.get("x-goog-channel-token") != self.token:
+            self.stats["rejected"] += 1
+            return False
+        for channel in self.channels.values():
+            if channel.id == channel_id:
+                break
+        else:
+            self.stats["rejected"] += 1
+            return False
+        self.stats["notifications"] += 1
+        if state == "sync":
+            # Sent once when the channel is created; nothing changed yet
+            return True
+        self.logger.debug("Change notification for calendar %s", sanitize_calendar_id(channel.calendar_id))
+        self.mark([channel.calendar_id])
+        return True
+
+    async def _register(self, calendar_id):
+        """Open a new channel for a calendar, returning it or None"""
+        self.serial += 1
+        channel_id = "busylight-%s-%d" % (self.token[:8], self.serial)
+        url = f"{self.calendar.base_url}/calendars/{_quote(calendar_id)}/events/watch"
+        body = {
+            "id": channel_id,
+            "type": "web_hook",
+            "address": config.WATCH_ADDRESS,
+            "token": self.token,
+            "params": {"ttl": str(config.WATCH_TTL)},
+        }
+        try:
+            headers = {"Authorization": f"Bearer {self.calendar.token}"}
+            response = await self.calendar.policy.call("watch", lambda: self.calendar.http.post(url, json=body, headers=headers))
+            if response.status_code != 200:
+                self.logger.warning("events.watch for %s failed: %s", sanitize_calendar_id(calendar_id), response.status_code)
+                return None
+            result = response.json()
+            expires = int(result.get("expiration", 0)) // 1000 or self.calendar.time_manager.get_utc_timestamp() + config.WATCH_TTL
+            return Channel(calendar_id, channel_id, result.get("resourceId"), expires)
+        except Exception as e:
+            self.logger.warning("events.watch for %s failed: %s", sanitize_calendar_id(calendar_id), e)
+            return None
+
+    async def _stop(self, channel):
+        try:
+            await self.calendar.http.post(f"{self.calendar.base_url}/channels/stop",
+                                          json={"id": channel.id, "resourceId": channel.resource_id},
+                                          headers={"Authorization": f"Bearer {self.calendar.token}"})
+        except Exception as e:
+            self.logger.debug("channels.stop failed: %s", e)
+
+    async def maintain(self):
+        """Open missing channels and renew those close to expiry"""
+        now = self.calendar.time_manager.get_utc_timestamp()
+        due = [calendar_id for calendar_id in self.calendar_ids
+               if not self._live(calendar_id, now + config.WATCH_RENEW_MARGIN)]
+        if not due or not await self.calendar._ensure_token():
+            return
+        for calendar_id in due:
+            channel = await self._register(calendar_id)
+            if channel is None:
+                self.stats["failed"] += 1
+                continue
+            old = self.channels.get(calendar_id)
+            self.channels[calendar_id] = channel
+            self.stats["registered"] += 1
+            self.logger.info("Watching calendar %s until %s", sanitize_calendar_id(calendar_id),
+                             self.calendar.time_manager.format_utc_datetime(channel.expires))
+            if old:
+                await self._stop(old)
+            # Changes made before the channel existed were not notified
+            self.mark([calendar_id])
+
+    async def _handle(self, reader, writer):
+        """Webhook receiver: read one request and answer 200 straight away"""
+        try:
+            request = await asyncio.wait_for(reader.readline(), config.HTTP_TIMEOUT)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), config.HTTP_TIMEOUT)
+                if not line or line == b"\r\n":
+                    break
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            if length:
+                await asyncio.wait_for(reader.readexactly(length), config.HTTP_TIMEOUT)
+            ok = request.startswith(b"POST ") and self.notification(headers)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n" if ok else
+                         b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+        except Exception as e:
+            self.logger.debug("Webhook request failed: %s", e)
+        finally:
+            writer.close()
+
+    async def run(self):
+        """Serve the webhook receiver and keep channels renewed"""
+        await asyncio.start_server(self._handle, "0.0.0.0", config.WATCH_PORT)
+        self.logger.info("Webhook receiver listening on port %s", config.WATCH_PORT)
+        while True:
+            await self.maintain()
+            await asyncio.sleep(config.WATCH_CHECK_INTERVAL)